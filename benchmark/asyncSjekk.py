@@ -0,0 +1,143 @@
+"""
+Kjørbar sjekk av dfasync.AsyncDatafangstKlient mot lokal mockserver, med begge backender
+
+Går gjennom DF1.0 (kontrakter, featureCollections, status, POST/PUT), DF2.0 (login, opplasting av dict, fil og gzip,
+godkjenning, nytt token etter HTTP 401) og feilhåndtering (404, nettverksfeil som DatafangstHttpFeil), én gang med
+requests i tråder og én gang med aiohttp hvis det er installert. Returkode 0 når alt stemmer.
+
+    python benchmark/asyncSjekk.py [--backend requests aiohttp]
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import sys
+import tempfile
+import time
+
+sys.path.insert( 0, os.path.dirname( os.path.dirname( os.path.abspath( __file__ ))))
+
+import df20         # noqa: E402
+import dfasync      # noqa: E402
+import dfklient     # noqa: E402
+import mockserver   # noqa: E402
+
+
+class _Sjekker:
+
+    def __init__( self, backend:str ):
+        self.backend = backend
+        self.feilet = []
+
+    def __call__( self, navn:str, ok, detaljer='' ):
+        print( f"\t{'OK  ' if ok else 'FEIL'} {self.backend:<8} {navn} {detaljer}" )
+        if not ok:
+            self.feilet.append( f"{self.backend}: {navn}" )
+
+
+def _ledigPort( ):
+    with socket.socket() as s:
+        s.bind( ( '127.0.0.1', 0 ))
+        return s.getsockname()[1]
+
+
+async def _df10( sjekk, base:str, brukAiohttp:bool ):
+    api = base + 'api/v1/contract/'
+    async with dfasync.AsyncDatafangstKlient( api=api, user='sjekk', pw='sjekk', brukAiohttp=brukAiohttp ) as klient:
+        kontrakter = await klient.alleKontrakter()
+        sjekk( 'alleKontrakter', mockserver.KONTRAKT in [ x['id'] for x in kontrakter['contracts'] ] )
+
+        fcListe = await klient.alleFeaturecollections( mockserver.KONTRAKT )
+        ider = [ x['id'] for x in fcListe['featureCollections'] ]
+        statuser = await asyncio.gather( *[ klient.sjekkstatusFeatureCollection( mockserver.KONTRAKT, x ) for x in ider ] )
+        sjekk( 'sjekkstatusFeatureCollection', len( statuser ) == len( ider ) and all( x['validationStatus'] == 'ACCEPTED' for x in statuser ),
+               f"{len( ider )} samtidig" )
+
+        data = await klient.get_data( api + mockserver.KONTRAKT + '/featurecollection/' + ider[0], geojson=True )
+        sjekk( 'get_data geojson', len( data['features'] ) > 0 )
+
+        respons = await klient.postFeatureCollection( mockserver.INNSENDINGSKONTRAKT, mockserver.lagFeatureCollection( 0, 10 ))
+        status = await klient.sjekkResponsStatus( respons )
+        sjekk( 'postFeatureCollection + sjekkResponsStatus', status['featureCollectionId'] == respons['featureCollectionId'] )
+
+        respons = await klient.putFeatureCollection( mockserver.INNSENDINGSKONTRAKT, respons['featureCollectionId'], mockserver.lagFeatureCollection( 1, 10 ))
+        sjekk( 'putFeatureCollection', respons['featureCollectionId'] == status['featureCollectionId'] )
+
+        try:
+            await klient.sjekkstatusFeatureCollection( mockserver.KONTRAKT, 'finnesikke' )
+            sjekk( '404 gir DatafangstHttpFeil', False )
+        except dfklient.DatafangstHttpFeil as e:
+            sjekk( '404 gir DatafangstHttpFeil', e.status_code == 404 )
+
+    # Ingen lytter på porten: nettverksfeil skal komme som DatafangstHttpFeil med requests-unntak som årsak
+    dod = f"http://127.0.0.1:{_ledigPort()}/api/v1/contract/"
+    async with dfasync.AsyncDatafangstKlient( api=dod, user='sjekk', pw='sjekk', brukAiohttp=brukAiohttp,
+                                              retry=dfklient.RetryPolicy( maksForsok=2, basisVentetid=0.01 )) as klient:
+        try:
+            await klient.alleKontrakter()
+            sjekk( 'nettverksfeil', False )
+        except dfklient.DatafangstHttpFeil as e:
+            sjekk( 'nettverksfeil', e.forsok == 2 and isinstance( e.__cause__, dfklient.requests.exceptions.ConnectionError ),
+                   type( e.__cause__ ).__name__ )
+
+
+async def _df20( sjekk, base:str, brukAiohttp:bool, mappe:str ):
+    apiUrl = base + 'api/v2/'
+    authapi = base + 'api/v1/auth/autentiser'
+    async with dfasync.AsyncDatafangstKlient( api=apiUrl, brukAiohttp=brukAiohttp ) as klient:
+        sjekk( 'login med feil authapi', await klient.login( 'sjekk', 'sjekk', authapi=base + 'finnesikke' ) is None )
+        header = await klient.login( 'sjekk', 'sjekk', authapi=authapi )
+        sjekk( 'login', header is not None and header['Authorization'].startswith( 'Bearer ' ))
+
+        data = mockserver.lagFeatureCollection( 2, 50 )
+        filnavn = os.path.join( mappe, 'sjekk.geojson' )
+        with open( filnavn, 'w' ) as fp:
+            json.dump( data, fp )
+        sjekk( 'lastOppGeojson dict', await klient.lastOppGeojson( data, mockserver.KONTRAKT, 'dict.geojson' ))
+        sjekk( 'lastOppGeojson fil', await klient.lastOppGeojson( filnavn, mockserver.KONTRAKT, 'fil.geojson' ))
+        sjekk( 'lastOppGeojson fil gzip', await klient.lastOppGeojson( filnavn, mockserver.KONTRAKT, 'gzip.geojson', gzip=True ))
+        sjekk( 'lastOppGeojson bytes gzip', await klient.lastOppGeojson( json.dumps( data ).encode(), mockserver.KONTRAKT, 'bytes.geojson', gzip=True ))
+        sjekk( 'godkjennFiler', await klient.godkjennFiler( mockserver.KONTRAKT, [ 'dict.geojson', 'fil.geojson', 'gzip.geojson' ] ))
+
+    # TokenHandterer med et token serveren ikke kjenner: 401, nytt token og nytt forsøk (også for gzip-strøm fra fil)
+    handterer = df20.TokenHandterer( 'sjekk-' + ( 'aiohttp' if brukAiohttp else 'requests' ), pw='sjekk', klient=dfklient.DatafangstKlient() )
+    handterer.authapi = authapi
+    handterer._tilstand.update( { 'token' : 'utgatt', 'utloper' : time.time() + 3600 } )
+    async with dfasync.AsyncDatafangstKlient( api=apiUrl, tokenHandterer=handterer, brukAiohttp=brukAiohttp ) as klient:
+        ok = await asyncio.gather( *[ klient.lastOppGeojson( filnavn, mockserver.KONTRAKT, f"token{nr}.geojson", gzip=True ) for nr in range( 4 ) ] )
+        sjekk( 'nytt token etter 401', all( ok ) and handterer.token() != 'utgatt' )
+
+
+async def _sjekk( backend:str, base:str, mappe:str ):
+    sjekk = _Sjekker( backend )
+    brukAiohttp = backend == 'aiohttp'
+    await _df10( sjekk, base, brukAiohttp )
+    await _df20( sjekk, base, brukAiohttp, mappe )
+    return sjekk.feilet
+
+
+def main( argv=None ):
+    parser = argparse.ArgumentParser( description='Sjekk av dfasync mot mockserver' )
+    parser.add_argument( '--backend', nargs='+', default=[ 'requests', 'aiohttp' ], choices=( 'requests', 'aiohttp' ))
+    args = parser.parse_args( argv )
+
+    prosess, base = mockserver.startProsess( mockserver.Oppsett( antall=5, features=20, valideringstid=0 ))
+    feilet = []
+    try:
+        with tempfile.TemporaryDirectory() as mappe:
+            for backend in args.backend:
+                if backend == 'aiohttp' and dfasync.aiohttp is None:
+                    print( "aiohttp er ikke installert, hopper over" )
+                    continue
+                print( f"Backend {backend}" )
+                feilet += asyncio.run( _sjekk( backend, base, mappe ))
+    finally:
+        prosess.terminate()
+
+    print( f"{len( feilet )} feil" + ( f": {feilet}" if feilet else '' ))
+    return 1 if feilet else 0
+
+
+if __name__ == '__main__':
+    sys.exit( main() )
@@ -0,0 +1,61 @@
+"""
+Sammenligner JSON-backendene i dfjson (orjson, msgspec, json) på Datafangst-featureCollections
+
+Måler parsing (loads) og serialisering (dumps) i MB per sekund, og kopiering til kompakt geojson med
+geojsonstrom.skrivFeatureCollection (lesing der går alltid via json). Backender som ikke er installert hoppes over.
+
+    python benchmark/jsonBenchmark.py --features 20000 --gjentak 5
+"""
+import argparse
+import io
+import os
+import sys
+import time
+
+sys.path.insert( 0, os.path.dirname( os.path.dirname( os.path.abspath( __file__ ))))
+
+import dfjson       # noqa: E402
+import geojsonstrom # noqa: E402
+import mockserver   # noqa: E402
+
+
+def _beste( funksjon, gjentak:int ):
+    beste = None
+    for _ in range( gjentak ):
+        t0 = time.perf_counter()
+        funksjon()
+        sekunder = time.perf_counter() - t0
+        beste = sekunder if beste is None else min( beste, sekunder )
+    return beste
+
+
+def main( argv=None ):
+    parser = argparse.ArgumentParser( description='Sammenligner JSON-backendene i dfjson' )
+    parser.add_argument( '--features', type=int, default=10000 )
+    parser.add_argument( '--gjentak', type=int, default=5 )
+    args = parser.parse_args( argv )
+
+    data = mockserver.lagFeatureCollection( 0, args.features )
+    tekst = dfjson.dumps( data )
+    mb = len( tekst ) / 1e6
+    print( f"featureCollection med {args.features} features, {mb:.1f} MB" )
+
+    resultater = []
+    for navn in dfjson.BACKENDER:
+        try:
+            dfjson.velgBackend( navn )
+        except ImportError:
+            print( f"{navn:<8} ikke installert" )
+            continue
+        lese = _beste( lambda: dfjson.loads( tekst ), args.gjentak )
+        skrive = _beste( lambda: dfjson.dumps( data ), args.gjentak )
+        strom = _beste( lambda: geojsonstrom.skrivFeatureCollection( [ tekst ], io.StringIO(), format='kompakt' ), args.gjentak )
+        resultater.append( { 'backend' : navn, 'loads' : mb / lese, 'dumps' : mb / skrive, 'kompakt' : mb / strom } )
+        print( f"{navn:<8} loads {mb / lese:8.1f} MB/s   dumps {mb / skrive:8.1f} MB/s   skrivFeatureCollection {mb / strom:8.1f} MB/s" )
+
+    dfjson.velgBackend()
+    return resultater
+
+
+if __name__ == '__main__':
+    main()
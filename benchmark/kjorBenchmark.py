@@ -0,0 +1,201 @@
+"""
+Reproduserbare ytelsesmålinger mot lokal mockserver (benchmark/mockserver.py), uten nettverk og uten produksjon
+
+Scenarier
+    dump    : df10.lagreFeatureCollections for alle featureCollections på kontrakten
+    post    : df10.postFeatureCollection, én featureCollection per kall
+    status  : statuspoller.ventPaaStatus på featureCollections som nettopp er sendt inn
+    upload  : df20.lastOppFiler (DF2.0 opplasting og godkjenning av geojson-filer)
+    async   : som post, pluss statuskall, med dfasync.AsyncDatafangstKlient og --workers samtidige kall i én tråd
+
+Hvert scenario kjøres for hvert antall tråder i --workers, og vi rapporterer antall kall, kall per sekund,
+p50 og p99 tidsbruk per kall (fra dfmetrikk-hendelsene), antall nye forsøk og høyeste minnebruk (tracemalloc).
+Mockserveren kjører i egen prosess, så den ikke påvirker målingene.
+
+    python benchmark/kjorBenchmark.py --scenario dump upload --workers 1 4 8 --antall 100 --features 1000
+    python benchmark/kjorBenchmark.py --forsinkelse 0.1 --feilrate 0.02 --json > resultat.json
+"""
+import argparse
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+sys.path.insert( 0, os.path.dirname( os.path.dirname( os.path.abspath( __file__ ))))
+
+import dfklient   # noqa: E402
+import mockserver # noqa: E402
+
+SCENARIER = ( 'dump', 'post', 'status', 'upload', 'async' )
+
+
+class _Tidtaker:
+    """
+    Lytter som tar vare på tidsbruk for hvert HTTP-kall
+    """
+    def __init__( self ):
+        self.las = threading.Lock()
+        self.sekunder = []
+        self.retries = 0
+        self.feil = 0
+
+    def __call__( self, hendelse:dict ):
+        if hendelse.get( 'type' ) != 'http':
+            return
+        with self.las:
+            self.sekunder.append( hendelse['sekunder'] )
+            self.retries += hendelse['retries']
+            if hendelse['feil'] or ( hendelse['status'] or 0 ) >= 400:
+                self.feil += 1
+
+
+def _kvantil( verdier:list, q:float ):
+    if not verdier:
+        return None
+    verdier = sorted( verdier )
+    return verdier[min( len( verdier ) - 1, int( q * len( verdier )))]
+
+
+def _dump( base, klient, workers, args, mappe ):
+    import df10
+    df10.lagreFeatureCollections( mockserver.KONTRAKT, os.path.join( mappe, 'dump' ), api=base + 'api/v1/contract/', user='benchmark',
+                                  klient=klient, maksParallelle=workers, format=args.format )
+
+
+def _post( base, klient, workers, args, mappe ):
+    import df10
+    data = mockserver.lagFeatureCollection( 0, args.features )
+    with ThreadPoolExecutor( max_workers=workers ) as pool:
+        responser = list( pool.map( lambda _: df10.postFeatureCollection( mockserver.INNSENDINGSKONTRAKT, data, api=base + 'api/v1/contract/',
+                                                                          user='benchmark', klient=klient ), range( args.antall )))
+    return responser
+
+
+def _status( base, klient, workers, args, mappe, responser ):
+    import statuspoller
+    statuspoller.ventPaaStatus( responser, api=base + 'api/v1/contract/', user='benchmark', klient=klient, utskrift=False,
+                                maksParallelle=workers, startIntervall=0.2, maksIntervall=2 )
+
+
+def _upload( base, klient, workers, args, mappe ):
+    import df20
+    filmappe = os.path.join( mappe, 'filer' )
+    if not os.path.exists( filmappe ):
+        os.makedirs( filmappe )
+        for nummer in range( args.antall ):
+            with open( os.path.join( filmappe, f"fil{nummer:05d}.geojson" ), 'w' ) as fp:
+                json.dump( mockserver.lagFeatureCollection( nummer, args.features ), fp )
+    df20.lastOppFiler( filmappe, mockserver.KONTRAKT, None, apiUrl=base + 'api/v2/', klient=klient, maksParallelle=workers, gzip=args.gzip )
+
+
+def _async( base, workers, args, tidtaker ):
+    import dfasync
+    data = mockserver.lagFeatureCollection( 0, args.features )
+
+    async def kjor():
+        async with dfasync.AsyncDatafangstKlient( api=base + 'api/v1/contract/', user='benchmark', pw='benchmark', poolstorrelse=max( 10, workers ),
+                                                  maksParallelle=workers, lyttere=[ tidtaker ] ) as klient:
+            responser = await asyncio.gather( *[ klient.postFeatureCollection( mockserver.INNSENDINGSKONTRAKT, data ) for _ in range( args.antall ) ] )
+            await asyncio.gather( *[ klient.sjekkResponsStatus( respons ) for respons in responser ] )
+
+    asyncio.run( kjor() )
+
+
+def kjorScenario( scenario:str, base:str, workers:int, args, mappe:str, responser=None ):
+    """
+    Kjører ett scenario med gitt antall tråder. Returnerer dict med målingene (og responsene fra post)
+    """
+    tidtaker = _Tidtaker()
+    if scenario == 'upload':
+        import df20
+        tokenHandterer = df20.TokenHandterer( 'benchmark', pw='benchmark', miljo='TEST' )
+        tokenHandterer.authapi = base + 'api/v1/auth/autentiser'
+        klient = dfklient.DatafangstKlient( api=base + 'api/v2/', tokenHandterer=tokenHandterer, poolstorrelse=max( 10, workers ), lyttere=[ tidtaker ] )
+    else:
+        klient = dfklient.DatafangstKlient( api=base + 'api/v1/contract/', user='benchmark', pw='benchmark', poolstorrelse=max( 10, workers ),
+                                            lyttere=[ tidtaker ] )
+
+    if args.minne:
+        tracemalloc.start()
+    utskrift = io.StringIO()
+    t0 = time.perf_counter()
+    with redirect_stdout( utskrift if not args.vis else sys.stdout ):
+        if scenario == 'dump':
+            _dump( base, klient, workers, args, mappe )
+        elif scenario == 'post':
+            responser = _post( base, klient, workers, args, mappe )
+        elif scenario == 'status':
+            _status( base, klient, workers, args, mappe, responser )
+        elif scenario == 'upload':
+            _upload( base, klient, workers, args, mappe )
+        elif scenario == 'async':
+            _async( base, workers, args, tidtaker )
+    sekunder = time.perf_counter() - t0
+    toppMinne = None
+    if args.minne:
+        toppMinne = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    klient.lukk()
+
+    resultat = { 'scenario' : scenario, 'workers' : workers, 'kall' : len( tidtaker.sekunder ), 'sekunder' : round( sekunder, 3 ),
+                 'kallPerSekund' : round( len( tidtaker.sekunder ) / sekunder, 1 ) if sekunder else None,
+                 'p50' : _kvantil( tidtaker.sekunder, 0.50 ), 'p99' : _kvantil( tidtaker.sekunder, 0.99 ),
+                 'retries' : tidtaker.retries, 'feil' : tidtaker.feil,
+                 'toppMinneMB' : round( toppMinne / 1e6, 1 ) if toppMinne is not None else None }
+    return resultat, responser
+
+
+def main( argv=None ):
+    parser = argparse.ArgumentParser( description='Benchmark av df10/df20 mot lokal mockserver' )
+    parser.add_argument( '--scenario', nargs='+', default=list( SCENARIER ), choices=SCENARIER )
+    parser.add_argument( '--workers', nargs='+', type=int, default=[ 1, 4, 8 ] )
+    parser.add_argument( '--antall', type=int, default=50, help='Antall featureCollections / filer per scenario' )
+    parser.add_argument( '--features', type=int, default=500, help='Antall features per featureCollection' )
+    parser.add_argument( '--forsinkelse', type=float, default=0.02, help='Sekund forsinkelse per kall i mockserveren' )
+    parser.add_argument( '--jitter', type=float, default=0.01 )
+    parser.add_argument( '--feilrate', type=float, default=0.0, help='Andel kall som får HTTP 503' )
+    parser.add_argument( '--valideringstid', type=float, default=1.0 )
+    parser.add_argument( '--seed', type=int, default=1 )
+    parser.add_argument( '--format', default='innrykk', choices=( 'innrykk', 'kompakt', 'ndjson' ))
+    parser.add_argument( '--gzip', action='store_true', help='Gzip ved upload' )
+    parser.add_argument( '--uten-minne', dest='minne', action='store_false', help='Ikke mål minnebruk (tracemalloc gjør alt litt tregere)' )
+    parser.add_argument( '--vis', action='store_true', help='Vis utskrift fra funksjonene som måles' )
+    parser.add_argument( '--json', action='store_true', help='Skriv resultatene som JSON' )
+    args = parser.parse_args( argv )
+
+    oppsett = mockserver.Oppsett( forsinkelse=args.forsinkelse, jitter=args.jitter, feilrate=args.feilrate, antall=args.antall,
+                                  features=args.features, valideringstid=args.valideringstid, seed=args.seed )
+    prosess, base = mockserver.startProsess( oppsett )
+    resultater = []
+    try:
+        with tempfile.TemporaryDirectory() as mappe:
+            for workers in args.workers:
+                responser = None
+                for scenario in args.scenario:
+                    if scenario == 'status' and responser is None:
+                        # Trenger nylig innsendte featureCollections å vente på
+                        _, responser = kjorScenario( 'post', base, workers, args, mappe )
+                    resultat, responser = kjorScenario( scenario, base, workers, args, mappe, responser=responser )
+                    resultater.append( resultat )
+                    if not args.json:
+                        print( f"{resultat['scenario']:<7} workers={workers:<3} {resultat['kall']:>6} kall {resultat['sekunder']:>8.2f} s "
+                               f"{resultat['kallPerSekund']:>8.1f} kall/s  p50 {resultat['p50'] or 0:.3f} s  p99 {resultat['p99'] or 0:.3f} s  "
+                               f"retries {resultat['retries']}  feil {resultat['feil']}  minne {resultat['toppMinneMB']} MB", flush=True )
+    finally:
+        prosess.terminate()
+
+    if args.json:
+        json.dump( { 'oppsett' : vars( args ), 'resultater' : resultater }, sys.stdout, indent=2 )
+        print()
+    return resultater
+
+
+if __name__ == '__main__':
+    main()
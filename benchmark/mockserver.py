@@ -0,0 +1,298 @@
+"""
+Lokal stand-in for datafangst API, til benchmarking uten å belaste produksjon
+
+DF1.0 (under /api/v1/contract/)
+    GET  /                                      kontraktliste
+    GET  /{kontrakt}                            metadata for kontrakt
+    GET  /{kontrakt}/featurecollection          featureCollections på kontrakten
+    GET  /{kontrakt}/featurecollection/{id}     geojson (med ETag og If-None-Match / HTTP 304)
+    GET  /{kontrakt}/featurecollection/{id}/status
+    POST /{kontrakt}/featurecollection          ny featureCollection (HTTP 202), validering tar valideringstid sekund
+    PUT  /{kontrakt}/featurecollection/{id}
+
+DF2.0
+    POST  /api/v1/auth/autentiser               JWT id_token med exp
+    POST  /api/v2/kontrakter/{kontrakt}/filer/kropp       (godtar chunked body og Content-Encoding: gzip)
+    PATCH /api/v2/kontrakter/{kontrakt}/filer/godkjenn
+
+Forsinkelse, feilrate (HTTP 503 med Retry-After) og størrelse på data styres med Oppsett. Tilfeldighetene
+har fast seed, og genererte data er like fra gang til gang.
+
+    python benchmark/mockserver.py --port 8765 --forsinkelse 0.05 --feilrate 0.01 --antall 200 --features 1000
+"""
+import argparse
+import base64
+from dataclasses import dataclass, asdict
+import gzip
+import hashlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import random
+import threading
+import time
+import uuid
+
+# Kontrakten med ferdige featureCollections, og en tom kontrakt til innsending (så nedlasting måler det samme hver gang)
+KONTRAKT = '7877472b-190f-4898-9939-82915952e15f'
+INNSENDINGSKONTRAKT = 'e93b459b-a2c4-4e6b-bb21-0d7fe3ae0736'
+
+
+@dataclass
+class Oppsett:
+    """
+    Oppførsel for mockserveren
+
+    forsinkelse : sekund, grunnforsinkelse per kall
+    jitter : sekund, tilfeldig tillegg (0 - jitter) per kall
+    sekundPerMB : sekund ekstra per MB i responsen, simulerer båndbredde
+    feilrate : andel kall (0-1) som får HTTP 503
+    antall : antall featureCollections på kontrakten fra start
+    features : antall features per featureCollection
+    valideringstid : sekund fra POST/PUT til status ACCEPTED
+    tokenLevetid : sekund før id_token går ut
+    seed : seed for tilfeldige forsinkelser og feil
+    """
+    forsinkelse : float = 0.02
+    jitter : float = 0.01
+    sekundPerMB : float = 0.0
+    feilrate : float = 0.0
+    antall : int = 50
+    features : int = 500
+    valideringstid : float = 1.0
+    tokenLevetid : float = 3600
+    seed : int = 1
+
+
+def lagFeatureCollection( nummer:int, antallFeatures:int ):
+    """
+    Deterministisk DF1.0 FeatureCollection med antallFeatures punkter (Trafikkspeil, typeId 474)
+    """
+    rnd = random.Random( nummer )
+    features = []
+    for i in range( antallFeatures ):
+        features.append( { 'type' : 'Feature', 'id' : str( i + 1 ),
+                           'geometry' : { 'type' : 'Point', 'coordinates' : [ round( 250000 + rnd.random() * 50000, 3 ), round( 6650000 + rnd.random() * 50000, 3 ), 100.0 ] },
+                           'properties' : { 'typeId' : 474, 'dataCatalogVersion' : '2.36', 'tag' : f"trafikkspeil {nummer}-{i}",
+                                            'attributes' : { '5293' : rnd.choice( [ 'Rund', 'Rektangulær' ] ), '5294' : rnd.randint( 40, 120 ) } } } )
+    return { 'type' : 'FeatureCollection', 'crs' : { 'type' : 'name', 'properties' : { 'name' : 'EPSG:25833' } }, 'features' : features }
+
+
+def _jwt( utloper:float ):
+    def b64( data ):
+        return base64.urlsafe_b64encode( json.dumps( data ).encode() ).decode().rstrip( '=' )
+    return b64( { 'alg' : 'none' } ) + '.' + b64( { 'exp' : utloper, 'sub' : 'benchmark' } ) + '.x'
+
+
+class _Tilstand:
+
+    def __init__( self, oppsett:Oppsett ):
+        self.oppsett = oppsett
+        self.las = threading.Lock()
+        self.rnd = random.Random( oppsett.seed )
+        self.kontrakter = { KONTRAKT : { }, INNSENDINGSKONTRAKT : { } }     # kontrakt => featureCollection id => { 'body', 'etag', 'klar' }
+        self.tokens = set()
+        self.teller = { }
+        for nummer in range( oppsett.antall ):
+            self.lagre( KONTRAKT, str( uuid.UUID( int=nummer + 1 )), json.dumps( lagFeatureCollection( nummer, oppsett.features )).encode(), klar=0 )
+
+    def lagre( self, kontrakt:str, fcId:str, body:bytes, klar:float ):
+        with self.las:
+            self.kontrakter.setdefault( kontrakt, { } )[fcId] = { 'body' : body, 'etag' : '"' + hashlib.md5( body ).hexdigest() + '"', 'klar' : klar }
+
+    def trekk( self ):
+        with self.las:
+            return self.rnd.random(), self.rnd.random()
+
+    def tell( self, navn:str ):
+        with self.las:
+            self.teller[navn] = self.teller.get( navn, 0 ) + 1
+
+
+class _Handler( BaseHTTPRequestHandler ):
+    protocol_version = 'HTTP/1.1'
+    # Headere og body skrives hver for seg, med Nagle + forsinket ACK gir det ~40 ms ekstra per kall på keep-alive
+    disable_nagle_algorithm = True
+
+    def log_message( self, *args ):
+        pass
+
+    @property
+    def tilstand( self ) -> _Tilstand:
+        return self.server.tilstand
+
+    def _body( self ):
+        if self.headers.get( 'Transfer-Encoding', '' ).lower() == 'chunked':
+            biter = []
+            while True:
+                lengde = int( self.rfile.readline().split( b';' )[0], 16 )
+                if lengde == 0:
+                    self.rfile.readline()
+                    break
+                biter.append( self.rfile.read( lengde ))
+                self.rfile.readline()
+            data = b''.join( biter )
+        else:
+            data = self.rfile.read( int( self.headers.get( 'Content-Length', 0 )))
+        if self.headers.get( 'Content-Encoding' ) == 'gzip':
+            data = gzip.decompress( data )
+        return data
+
+    def _svar( self, kode:int, data=None, headere=None ):
+        body = data if isinstance( data, bytes ) else ( json.dumps( data ).encode() if data is not None else b'' )
+        oppsett = self.tilstand.oppsett
+        if oppsett.sekundPerMB and body:
+            time.sleep( oppsett.sekundPerMB * len( body ) / 1e6 )
+        self.send_response( kode )
+        self.send_header( 'Content-Type', 'application/json' )
+        self.send_header( 'Content-Length', str( len( body )))
+        for navn, verdi in ( headere or { } ).items():
+            self.send_header( navn, verdi )
+        self.end_headers()
+        self.wfile.write( body )
+
+    def _forsinkOgKanskjeFeil( self ):
+        """
+        True hvis kallet skal få HTTP 503
+        """
+        oppsett = self.tilstand.oppsett
+        tilfeldigFeil, tilfeldigJitter = self.tilstand.trekk()
+        time.sleep( oppsett.forsinkelse + oppsett.jitter * tilfeldigJitter )
+        if tilfeldigFeil < oppsett.feilrate:
+            self.tilstand.tell( '503' )
+            self._svar( 503, { 'feil' : 'Simulert feil' }, { 'Retry-After' : '0' } )
+            return True
+        return False
+
+    def _autorisert( self ):
+        token = ( self.headers.get( 'Authorization' ) or '' )[len( 'Bearer ' ):]
+        return token in self.tilstand.tokens
+
+    def _df10( self, metode:str ):
+        sti = self.path.split( '?' )[0]
+        base = f"http://{self.headers.get( 'Host' )}/api/v1/contract/"
+        deler = [ x for x in sti[len( '/api/v1/contract/' ):].split( '/' ) if x ]
+        fc = self.tilstand.kontrakter.get( deler[0], { } ) if deler else { }
+
+        if metode == 'GET' and len( deler ) == 0:
+            return self._svar( 200, { 'contracts' : [ { 'id' : x, 'name' : 'Benchmarkkontrakt' } for x in self.tilstand.kontrakter ] } )
+        if metode == 'GET' and len( deler ) == 1:
+            return self._svar( 200, { 'id' : deler[0], 'name' : 'Benchmarkkontrakt' } )
+        if len( deler ) == 2 and metode == 'GET':
+            return self._svar( 200, { 'featureCollections' : [
+                { 'id' : fcId, 'resources' : [ { 'rel' : 'self', 'src' : base + deler[0] + '/featurecollection/' + fcId },
+                                                { 'rel' : 'status', 'src' : base + deler[0] + '/featurecollection/' + fcId + '/status' } ] }
+                for fcId in list( fc ) ] } )
+        if ( len( deler ) == 2 and metode == 'POST' ) or ( len( deler ) == 3 and metode == 'PUT' ):
+            data = self._body()
+            fcId = deler[2] if metode == 'PUT' else str( uuid.uuid4() )
+            self.tilstand.lagre( deler[0], fcId, data, klar=time.time() + self.tilstand.oppsett.valideringstid )
+            lenke = base + deler[0] + '/featurecollection/' + fcId
+            return self._svar( 202, { 'featureCollectionId' : fcId, 'validationStatus' : 'PENDING',
+                                      'resources' : [ { 'rel' : 'self', 'src' : lenke }, { 'rel' : 'status', 'src' : lenke + '/status' } ],
+                                      'featureIdMappings' : [ ] } )
+        if len( deler ) == 3 and metode == 'GET' and deler[2] in fc:
+            element = fc[deler[2]]
+            if self.headers.get( 'If-None-Match' ) == element['etag']:
+                return self._svar( 304, headere={ 'ETag' : element['etag'] } )
+            return self._svar( 200, element['body'], { 'ETag' : element['etag'] } )
+        if len( deler ) == 4 and deler[3] == 'status' and deler[2] in fc:
+            ferdig = time.time() >= fc[deler[2]]['klar']
+            return self._svar( 200, { 'featureCollectionId' : deler[2], 'validationStatus' : 'ACCEPTED' if ferdig else 'PROCESSING',
+                                      'validationIssues' : [], 'featureIdMappings' : [] } )
+        return self._svar( 404, { 'feil' : f"Ukjent {metode} {sti}" } )
+
+    def _df20( self, metode:str ):
+        sti = self.path.split( '?' )[0]
+        if sti.endswith( '/auth/autentiser' ) and metode == 'POST':
+            self._body()
+            token = _jwt( time.time() + self.tilstand.oppsett.tokenLevetid )
+            with self.tilstand.las:
+                self.tilstand.tokens.add( token )
+            return self._svar( 200, { 'id_token' : token } )
+        if not self._autorisert():
+            self._body()
+            return self._svar( 401, { 'feil' : 'Ugyldig token' } )
+        if sti.endswith( '/filer/kropp' ) and metode == 'POST':
+            data = self._body()
+            self.tilstand.tell( 'filer' )
+            return self._svar( 201, { 'filnavn' : self.headers.get( 'X-FILNAVN' ), 'bytes' : len( data ) } )
+        if sti.endswith( '/filer/godkjenn' ) and metode == 'PATCH':
+            filnavn = json.loads( self._body() )
+            return self._svar( 200, [ { 'filnavn' : x, 'status' : 'GODKJENT' } for x in filnavn ] )
+        self._body()
+        return self._svar( 404, { 'feil' : f"Ukjent {metode} {sti}" } )
+
+    def _behandle( self, metode:str ):
+        self.tilstand.tell( metode )
+        if self._forsinkOgKanskjeFeil():
+            if metode in ( 'POST', 'PUT', 'PATCH' ):
+                self._body()
+            return
+        if self.path.startswith( '/api/v1/contract/' ):
+            return self._df10( metode )
+        return self._df20( metode )
+
+    def do_GET( self ):
+        self._behandle( 'GET' )
+
+    def do_POST( self ):
+        self._behandle( 'POST' )
+
+    def do_PUT( self ):
+        self._behandle( 'PUT' )
+
+    def do_PATCH( self ):
+        self._behandle( 'PATCH' )
+
+
+class _Server( ThreadingHTTPServer ):
+    daemon_threads = True
+    request_queue_size = 256
+
+
+def start( oppsett=None, port=0 ):
+    """
+    Starter mockserveren i en bakgrunnstråd
+
+    RETURNS
+        ( server, base-url ), f.eks base-url + 'api/v1/contract/' for DF1.0. Stopp med server.shutdown()
+    """
+    server = _Server( ( '127.0.0.1', port ), _Handler )
+    server.tilstand = _Tilstand( oppsett or Oppsett() )
+    threading.Thread( target=server.serve_forever, daemon=True ).start()
+    return server, f"http://127.0.0.1:{server.server_port}/"
+
+
+def _kjorIProsess( oppsett:dict, ko ):
+    server, base = start( Oppsett( **oppsett ))
+    ko.put( base )
+    threading.Event().wait()
+
+
+def startProsess( oppsett=None ):
+    """
+    Starter mockserveren i en egen prosess, slik at den ikke påvirker tids- og minnemålingene i prosessen som måles
+
+    RETURNS
+        ( multiprocessing.Process, base-url ). Stopp med prosess.terminate()
+    """
+    import multiprocessing
+    ko = multiprocessing.Queue()
+    prosess = multiprocessing.Process( target=_kjorIProsess, args=( asdict( oppsett or Oppsett() ), ko ), daemon=True )
+    prosess.start()
+    return prosess, ko.get( timeout=60 )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser( description='Mock datafangst API for benchmarking' )
+    parser.add_argument( '--port', type=int, default=8765 )
+    for felt, standard in asdict( Oppsett() ).items():
+        parser.add_argument( '--' + felt, type=type( standard ), default=standard )
+    args = vars( parser.parse_args() )
+    port = args.pop( 'port' )
+    server, base = start( Oppsett( **args ), port=port )
+    print( f"Mock datafangst på {base}api/v1/contract/ (DF1.0) og {base}api/v2/ (DF2.0), kontrakt {KONTRAKT}" )
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
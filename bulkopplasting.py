@@ -0,0 +1,217 @@
+"""
+Opplasting av store FeatureCollections til DF1.0 i mindre batcher
+
+Veldig store innsendinger med df10.postFeatureCollection får tidsavbrudd eller blir avvist. postBulk deler
+FeatureCollection i batcher begrenset på antall features og/eller størrelse, og sender batchene samtidig
+(med et tak på antall samtidige kall). Features som henger sammen via assosiasjoner (properties['associations'],
+som peker på andre features med featureIds) havner alltid i samme batch.
+
+Eksempel
+    resultat = bulkopplasting.postBulk( kontrakt, minStoreGeojson, maksFeatures=2000, maksParallelle=4, user='jajens', pw=pw )
+    statuspoller.ventPaaStatus( resultat['responser'], user='jajens', pw=pw )
+
+featureIdMappings kommer først i statusresponsen når valideringen er ferdig (POST-responsen er PENDING og har tom
+liste). Bruk postBulk( ..., ventPaaValidering=True ) eller hentFeatureIdMappings( resultat ) for å få dem samlet.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import df10
+import dfjson
+import statuspoller
+
+
+def _refererteIder( feature:dict ):
+    """
+    Finner ID'ene til andre features som dette featuret peker på via assosiasjoner
+    """
+    properties = feature.get( 'properties' ) or { }
+    ider = []
+    for assosiasjon in properties.get( 'associations' ) or []:
+        if not isinstance( assosiasjon, dict ):
+            continue
+        ider.extend( assosiasjon.get( 'featureIds' ) or [] )
+        if 'featureId' in assosiasjon:
+            ider.append( assosiasjon['featureId'] )
+    return [ str( x ) for x in ider ]
+
+
+def _sammenhengendeGrupper( features:list ):
+    """
+    Grupperer features (som indekser) slik at features koblet via assosiasjoner havner i samme gruppe (union-find).
+    Gruppene kommer i samme rekkefølge som første feature i hver gruppe
+    """
+    forelder = list( range( len( features )))
+
+    def rot( i ):
+        while forelder[i] != i:
+            forelder[i] = forelder[forelder[i]]
+            i = forelder[i]
+        return i
+
+    indeksForId = { str( f['id'] ) : i for i, f in enumerate( features ) if f.get( 'id' ) is not None }
+    for i, feature in enumerate( features ):
+        for annenId in _refererteIder( feature ):
+            j = indeksForId.get( annenId )
+            if j is not None:
+                a, b = rot( i ), rot( j )
+                if a != b:
+                    forelder[max( a, b )] = min( a, b )
+
+    grupper = { }
+    for i in range( len( features )):
+        grupper.setdefault( rot( i ), [] ).append( i )
+    return list( grupper.values() )
+
+
+def delIBatcher( data:dict, maksFeatures=1000, maksBytes=None ):
+    """
+    Deler en FeatureCollection i flere mindre FeatureCollections
+
+    ARGUMENTS
+        data : dict, Datafangst 1.0 geojson FeatureCollection
+
+    KEYWORDS
+        maksFeatures : int, default 1000. Maks antall features per batch (None = ingen grense)
+
+        maksBytes : int, default None. Maks omtrentlig størrelse (JSON, bytes) per batch
+
+    RETURNS
+        liste med FeatureCollections (dict). Øvrige toppnivå-elementer (type, crs ...) kopieres til hver batch.
+        En gruppe assosierte features som alene er større enn grensene blir sin egen batch
+    """
+    features = data['features']
+    toppnivaa = { k : v for k, v in data.items() if k != 'features' }
+    storrelse = [ len( dfjson.dumps( f )) + 1 for f in features ] if maksBytes else None
+
+    batcher = []
+    gjeldende = []
+    gjeldendeBytes = 0
+    for gruppe in _sammenhengendeGrupper( features ):
+        gruppeBytes = sum( storrelse[i] for i in gruppe ) if maksBytes else 0
+        forMange = maksFeatures and len( gjeldende ) + len( gruppe ) > maksFeatures
+        forStor = maksBytes and gjeldendeBytes + gruppeBytes > maksBytes
+        if gjeldende and ( forMange or forStor ):
+            batcher.append( gjeldende )
+            gjeldende = []
+            gjeldendeBytes = 0
+        if ( maksFeatures and len( gruppe ) > maksFeatures ) or ( maksBytes and gruppeBytes > maksBytes ):
+            print( f"Advarsel: {len(gruppe)} assosierte features er større enn batch-grensen, sendes samlet i én batch")
+        gjeldende.extend( gruppe )
+        gjeldendeBytes += gruppeBytes
+    if gjeldende:
+        batcher.append( gjeldende )
+
+    resultat = []
+    for batch in batcher:
+        enBatch = dict( toppnivaa )
+        enBatch['features'] = [ features[i] for i in sorted( batch ) ]
+        resultat.append( enBatch )
+    return resultat
+
+
+def postBulk( contractId:str, data:dict, maksFeatures=1000, maksBytes=None, maksParallelle=4, api='https://datafangst.vegvesen.no/api/v1/contract/',
+                user='jajens', pw=None, klient=None, ventPaaValidering=False, frist=None ):
+    """
+    Sender inn en stor FeatureCollection til kontrakten som flere mindre featureCollections, se delIBatcher
+
+    ARGUMENTS:
+        contractId - str, ID til kontrakten som vi skal sende data til
+
+        data - dict, Datafangst 1.0 geojson  https://apiskriv.vegdata.no/datafangst/datafangst-api#format
+
+    KEYWORDS:
+        maksFeatures, maksBytes : grenser per batch, se delIBatcher
+
+        maksParallelle : int, default 4. Maks antall batcher som sendes samtidig
+
+        api, user, pw, klient : som for df10.postFeatureCollection
+
+        ventPaaValidering : bool, default False. Venter til alle batcher er ferdig validert og samler featureIdMappings
+                            fra statusresponsene, se hentFeatureIdMappings
+
+        frist : sekund, maks ventetid med ventPaaValidering=True. Default None (ingen grense)
+
+    RETURNS
+        dictionary med
+            responser : liste med responsen fra df10.postFeatureCollection for hver vellykket batch (kan gis til statuspoller)
+            featureCollectionIds : liste med ID til de nye featureCollections
+            statuslenker : liste med lenker til status for hver batch
+            featureIdMappings : samlet liste med featureIdMappings fra statusresponsene. Tom uten ventPaaValidering=True,
+                                siden de først finnes når valideringen er ferdig
+            statuser : dict featureCollection ID => siste statusrespons (kun med ventPaaValidering=True)
+            feilet : liste med ( batchnummer, feilmelding ) for batcher som ikke ble tatt imot
+            antallBatcher : int
+    """
+    if not ( klient and klient.harInnlogging() ) and not isinstance( pw, str ):
+        pw = df10.hentPassord( user, api )
+
+    batcher = delIBatcher( data, maksFeatures=maksFeatures, maksBytes=maksBytes )
+    print( f"Sender {len(data['features'])} features til kontrakt {contractId} i {len(batcher)} batcher, inntil {maksParallelle} samtidig")
+
+    def send( nummer, batch ):
+        respons = df10.postFeatureCollection( contractId, batch, api=api, user=user, pw=pw, klient=klient )
+        return nummer, respons
+
+    resultat = { 'responser' : [], 'featureCollectionIds' : [], 'statuslenker' : [], 'featureIdMappings' : [], 'feilet' : [],
+                    'antallBatcher' : len( batcher ) }
+    with ThreadPoolExecutor( max_workers=max( 1, maksParallelle )) as pool:
+        jobber = [ pool.submit( send, nummer, batch ) for nummer, batch in enumerate( batcher ) ]
+
+        # Går gjennom i batch-rekkefølge, så resultatet blir likt fra gang til gang
+        for nummer, jobb in enumerate( jobber ):
+            try:
+                _, respons = jobb.result()
+            except Exception as e:
+                print( f"Batch {nummer+1} av {len(batcher)} feilet: {e}")
+                resultat['feilet'].append( ( nummer, str( e )) )
+                continue
+            resultat['responser'].append( respons )
+            resultat['featureCollectionIds'].append( respons['featureCollectionId'] )
+            resultat['statuslenker'].extend( x['src'] for x in respons.get( 'resources', [] ) if x.get( 'rel' ) == 'status' and 'src' in x )
+
+    print( f"{len(resultat['responser'])} av {len(batcher)} batcher sendt inn på kontrakt {contractId}")
+    if ventPaaValidering:
+        hentFeatureIdMappings( resultat, vent=True, frist=frist, maksParallelle=maksParallelle, api=api, user=user, pw=pw, klient=klient )
+    return resultat
+
+
+def hentFeatureIdMappings( resultat:dict, vent=True, frist=None, maksParallelle=4, api='https://datafangst.vegvesen.no/api/v1/contract/',
+                            user='jajens', pw=None, klient=None ):
+    """
+    Henter status for hver batch fra postBulk og samler featureIdMappings fra statusresponsene
+
+    ARGUMENTS
+        resultat : dict fra postBulk. resultat['featureIdMappings'] og resultat['statuser'] fylles inn
+
+    KEYWORDS
+        vent : bool, default True. Venter til hver batch har endelig status (ACCEPTED eller REJECTED), se statuspoller.
+               Med vent=False hentes status fra statuslenkene én gang, mappinger for batcher under validering blir da tomme
+
+        frist : sekund, maks ventetid med vent=True
+
+        maksParallelle, api, user, pw, klient : som for postBulk
+
+    RETURNS
+        samlet liste med featureIdMappings, i batch-rekkefølge
+    """
+    if vent:
+        statuser = statuspoller.ventPaaStatus( resultat['responser'], utskrift=False, frist=frist, maksParallelle=maksParallelle,
+                                                api=api, user=user, pw=pw, klient=klient )
+    else:
+        if not ( klient and klient.harInnlogging() ) and not isinstance( pw, str ):
+            pw = df10.hentPassord( user, api )
+        def hent( lenke ):
+            return df10.get_data( lenke, user=user, pw=pw, klient=klient )
+        with ThreadPoolExecutor( max_workers=max( 1, maksParallelle )) as pool:
+            statuser = { }
+            for status in pool.map( hent, resultat['statuslenker'] ):
+                statuser[status.get( 'featureCollectionId' )] = status
+
+    resultat['statuser'] = statuser
+    resultat['featureIdMappings'] = []
+    for fcId in resultat['featureCollectionIds']:
+        resultat['featureIdMappings'].extend(( statuser.get( fcId ) or { } ).get( 'featureIdMappings' ) or [] )
+
+    ikkeFerdig = [ fcId for fcId in resultat['featureCollectionIds'] if ( statuser.get( fcId ) or { } ).get( 'validationStatus' ) not in statuspoller.TERMINALE ]
+    if ikkeFerdig:
+        print( f"{len( ikkeFerdig )} av {len( resultat['featureCollectionIds'] )} batcher er ikke ferdig validert, mangler featureIdMappings for dem" )
+    return resultat['featureIdMappings']
@@ -0,0 +1,269 @@
+"""
+Kommandolinje for bulkjobber mot datafangst, uten interaktive spørsmål (egnet for cron)
+
+    python datafangst.py dump   KONTRAKT MAPPE [--format ndjson] [--workers 8]
+    python datafangst.py dumpalle MAPPE [KONTRAKT ...] [--per-sekund 20] [--maks-samtidige 6] [--workers 8]
+    python datafangst.py sync   KONTRAKT MAPPE [--format ndjson] [--workers 8]
+    python datafangst.py status KONTRAKT [FEATURECOLLECTION ...] [--vent] [--db validering.sqlite]
+    python datafangst.py upload KONTRAKT FIL_ELLER_MAPPE [...] [--gzip] [--ikke-godkjenn]      (DF2.0)
+    python datafangst.py dakat  [--sjekk-hvert 3600]
+
+Felles valg: --env (PROD, TEST, UTV), --user, --workers og --json (resultatet som JSON på stdout, fremdrift
+på stderr). Brukernavn og passord hentes fra --user / miljøvariablene DATAFANGST_USER og DATAFANGST_PASSWORD,
+og ellers fra keyring (tjeneste 'datafangst') hvis pakken keyring er installert. Vi spør bare interaktivt
+når vi kjører i en terminal.
+
+Returkode 0 når alt gikk bra, 1 hvis noe feilet underveis og 2 ved feil i argumenter eller innlogging.
+"""
+import argparse
+from contextlib import redirect_stdout
+import getpass
+import json
+import os
+import sys
+
+import dfklient
+
+KEYRING_TJENESTE = 'datafangst'
+
+
+class _Avbrudd( Exception ):
+    pass
+
+
+def _passord( user:str ):
+    """
+    Passord fra miljøvariabel, keyring eller (kun i terminal) interaktivt
+    """
+    pw = os.environ.get( 'DATAFANGST_PASSWORD' )
+    if pw:
+        return pw
+    try:
+        import keyring
+    except ImportError:
+        keyring = None
+    if keyring is not None:
+        pw = keyring.get_password( KEYRING_TJENESTE, user )
+        if pw:
+            return pw
+    if sys.stdin.isatty():
+        return getpass.getpass( f"{user}'s passord for datafangst:" )
+    raise _Avbrudd( f"Mangler passord for {user}: sett DATAFANGST_PASSWORD eller lagre det med keyring (tjeneste '{KEYRING_TJENESTE}')" )
+
+
+def _bruker( args ):
+    user = args.user or os.environ.get( 'DATAFANGST_USER' )
+    if not user:
+        raise _Avbrudd( "Mangler brukernavn: bruk --user eller sett DATAFANGST_USER" )
+    return user
+
+
+def _df10( args ):
+    """
+    ( api, user, klient ) for DF1.0 med innlogging på klientens sesjon
+    """
+    user = _bruker( args )
+    miljo = args.env or 'PROD'
+    api = args.api or dfklient._finnApi( miljo, dfklient.DF10_API )
+    klient = dfklient.DatafangstKlient( api=api, user=user, pw=_passord( user ), poolstorrelse=max( 10, args.workers ))
+    return api, user, klient
+
+
+def kjorDump( args ):
+    import df10
+    api, user, klient = _df10( args )
+    resultat = df10.lagreFeatureCollections( args.kontrakt, args.mappe, api=api, user=user, klient=klient,
+                                             maksParallelle=args.workers, format=args.format, romligIndeks=args.romligIndeks )
+    resultat['mappe'] = args.mappe
+    return resultat, len( resultat['feilet'] ) == 0
+
+
+def kjorDumpAlle( args ):
+    import kontraktdump
+    api, user, klient = _df10( args )
+    resultat = kontraktdump.dumpKontrakter( args.mappe, kontrakter=args.kontrakt or None, api=api, user=user, klient=klient,
+                                            maksParallelle=args.workers, perSekund=args.perSekund, maksSamtidige=args.maksSamtidige,
+                                            format=args.format, romligIndeks=args.romligIndeks, nyStart=args.nyStart )
+    resultat['mappe'] = args.mappe
+    return resultat, len( resultat['feilet'] ) == 0
+
+
+def kjorSync( args ):
+    import speiling
+    api, user, klient = _df10( args )
+    resultat = speiling.synkroniserKontrakt( args.kontrakt, args.mappe, api=api, user=user, klient=klient,
+                                             maksParallelle=args.workers, format=args.format, slettFjernede=not args.behold )
+    if args.romligIndeks:
+        import romligindeks
+        with romligindeks.Romligindeks( args.mappe ) as indeks:
+            resultat['romligIndeks'] = indeks.oppdater()
+    return resultat, len( resultat['feilet'] ) == 0
+
+
+def kjorStatus( args ):
+    from concurrent.futures import ThreadPoolExecutor
+    import df10
+    api, user, klient = _df10( args )
+
+    fcIder = args.featurecollection
+    feil = { }
+    if not fcIder:
+        fcIder = [ x['id'] for x in df10.alleFeaturecollections( args.kontrakt, api=api, user=user, klient=klient )['featureCollections'] ]
+
+    if args.vent:
+        import statuspoller
+        statuser = statuspoller.ventPaaStatus( fcIder, kontrakt=args.kontrakt, api=api, user=user, klient=klient,
+                                               maksParallelle=args.workers, frist=args.frist if args.frist else None )
+    else:
+        # Feil registreres per featureCollection, så ett feilende kall ikke tar med seg resultatene for de andre
+        def hent( fcId ):
+            try:
+                return df10.sjekkFeatureCollectionStatus( args.kontrakt, fcId, utskrift=False, user=user, api=api, klient=klient )
+            except Exception as e:
+                feil[fcId] = f"{type( e ).__name__}: {e}"
+                return None
+        with ThreadPoolExecutor( max_workers=max( 1, args.workers )) as pool:
+            statuser = dict( zip( fcIder, pool.map( hent, fcIder )))
+
+    if args.db:
+        import valideringsanalyse
+        with valideringsanalyse.Analysebase( args.db ) as db:
+            for fcId, status in statuser.items():
+                if status is None:
+                    continue
+                db.leggTil( status, contractId=args.kontrakt, featureCollectionId=fcId )
+
+    resultat = []
+    for fcId in fcIder:
+        status = statuser.get( fcId ) or { }
+        issues = status.get( 'validationIssues' ) or []
+        antall = { }
+        for issue in issues:
+            antall[issue.get( 'severity' )] = antall.get( issue.get( 'severity' ), 0 ) + 1
+        resultat.append( { 'featureCollectionId' : fcId, 'validationStatus' : status.get( 'validationStatus' ), 'validationIssues' : antall } )
+        if fcId in feil:
+            resultat[-1]['feil'] = feil[fcId]
+        print( f"{fcId} {status.get( 'validationStatus' )} {antall}{' (feil: ' + feil[fcId] + ')' if fcId in feil else ''}" )
+
+    return resultat, all( x['validationStatus'] not in ( 'REJECTED', None ) for x in resultat )
+
+
+def kjorUpload( args ):
+    import df20
+    user = _bruker( args )
+    miljo = args.env or 'TEST'
+    tokenHandterer = df20.TokenHandterer( user, pw=_passord( user ), brukertype=args.brukertype, miljo=miljo, tokenfil=True )
+    klient = dfklient.df20Klient( miljo=miljo, poolstorrelse=max( 10, args.workers ), tokenHandterer=tokenHandterer )
+    apiUrl = args.api or dfklient._finnApi( miljo, dfklient.DF20_API )
+
+    filer = []
+    for fil in args.filer:
+        filer.extend( df20._filliste( fil ))
+    try:
+        resultat = df20.lastOppFiler( filer, args.kontrakt, None, destination=args.destination, apiUrl=apiUrl, klient=klient,
+                                      maksParallelle=args.workers, godkjenn=not args.ikke_godkjenn, batchstorrelse=args.batch, gzip=args.gzip )
+    except ValueError as e:
+        # Filnavn som ville overskrevet hverandre på serveren, sjekkes før noe lastes opp
+        raise _Avbrudd( str( e )) from e
+    return resultat, all( x['lastetOpp'] and x['godkjent'] is not False for x in resultat )
+
+
+def kjorDakat( args ):
+    from datakatalogendring import dakatcache
+    miljo = args.env or 'PROD'
+    try:
+        dakatcache.dumpDatakatalog.lesUrl( miljo )
+    except ValueError as e:
+        raise _Avbrudd( str( e )) from e
+    dakat = dakatcache.hentDatakatalog( miljo=miljo, mappe=args.mappe, sjekkHvert=args.sjekk_hvert, tvingOppdatering=args.tving )
+    print( dakat )
+    return { 'miljo' : dakat.miljo, 'versjon' : dakat.versjon, 'vegobjekttyper' : len( dakat.typer ),
+             'egenskapstyper' : len( dakat.egenskapstyper ), 'assosiasjoner' : len( dakat.assosiasjoner ) }, True
+
+
+def lagParser( ):
+    felles = argparse.ArgumentParser( add_help=False )
+    felles.add_argument( '--env', help='Miljø: PROD, TEST eller UTV. Default PROD for DF1.0 og dakat, TEST for upload (DF2.0)' )
+    felles.add_argument( '--api', help='Overstyrer API-url for miljøet' )
+    felles.add_argument( '--user', help='Brukernavn, default miljøvariabel DATAFANGST_USER' )
+    felles.add_argument( '--workers', type=int, default=4, help='Antall samtidige kall, default 4' )
+    felles.add_argument( '--json', action='store_true', help='Skriv resultatet som JSON til stdout, fremdrift til stderr' )
+
+    parser = argparse.ArgumentParser( prog='datafangst', description='Bulkjobber mot datafangst API (DF1.0 og DF2.0)' )
+    kommandoer = parser.add_subparsers( dest='kommando', required=True )
+
+    p = kommandoer.add_parser( 'dump', parents=[ felles ], help='Last ned alle featureCollections på en DF1.0-kontrakt' )
+    p.add_argument( 'kontrakt' )
+    p.add_argument( 'mappe' )
+    p.add_argument( '--format', default='innrykk', choices=( 'innrykk', 'kompakt', 'ndjson' ))
+    p.add_argument( '--romlig-indeks', dest='romligIndeks', action='store_true', help='Bygg romlig indeks underveis, se romligindeks.py' )
+    p.set_defaults( funksjon=kjorDump )
+
+    p = kommandoer.add_parser( 'dumpalle', parents=[ felles ], help='Last ned mange DF1.0-kontrakter i parallell, kan fortsette etter avbrudd, se kontraktdump.py' )
+    p.add_argument( 'mappe' )
+    p.add_argument( 'kontrakt', nargs='*', help='ID til kontrakter, default alle du har tilgang til' )
+    p.add_argument( '--format', default='innrykk', choices=( 'innrykk', 'kompakt', 'ndjson' ))
+    p.add_argument( '--per-sekund', dest='perSekund', type=float, help='Maks antall kall per sekund mot serveren' )
+    p.add_argument( '--maks-samtidige', dest='maksSamtidige', type=int, help='Maks antall samtidige kall mot serveren' )
+    p.add_argument( '--romlig-indeks', dest='romligIndeks', action='store_true', help='Bygg romlig indeks for hver kontrakt, se romligindeks.py' )
+    p.add_argument( '--ny-start', dest='nyStart', action='store_true', help='Ignorer sjekkpunkt fra forrige kjøring og last ned alt på nytt' )
+    p.set_defaults( funksjon=kjorDumpAlle )
+
+    p = kommandoer.add_parser( 'sync', parents=[ felles ], help='Inkrementell speiling av en DF1.0-kontrakt, se speiling.py' )
+    p.add_argument( 'kontrakt' )
+    p.add_argument( 'mappe' )
+    p.add_argument( '--format', default='innrykk', choices=( 'innrykk', 'kompakt', 'ndjson' ))
+    p.add_argument( '--behold', action='store_true', help='Ikke slett lokale filer for featureCollections som er fjernet på serveren' )
+    p.add_argument( '--romlig-indeks', dest='romligIndeks', action='store_true', help='Oppdater romlig indeks for endrede filer, se romligindeks.py' )
+    p.set_defaults( funksjon=kjorSync )
+
+    p = kommandoer.add_parser( 'status', parents=[ felles ], help='Valideringsstatus for featureCollections på en DF1.0-kontrakt' )
+    p.add_argument( 'kontrakt' )
+    p.add_argument( 'featurecollection', nargs='*', help='ID til featureCollections, default alle på kontrakten' )
+    p.add_argument( '--vent', action='store_true', help='Vent til alle har endelig status (ACCEPTED eller REJECTED)' )
+    p.add_argument( '--frist', type=float, default=3600, help='Maks antall sekund å vente med --vent, default 3600. 0 venter uten grense' )
+    p.add_argument( '--db', help='Lagre valideringsmeldingene i denne SQLite-fila, se valideringsanalyse.py' )
+    p.set_defaults( funksjon=kjorStatus )
+
+    p = kommandoer.add_parser( 'upload', parents=[ felles ], help='Last opp og godkjenn geojson-filer på en DF2.0-kontrakt' )
+    p.add_argument( 'kontrakt' )
+    p.add_argument( 'filer', nargs='+', help='Filer og/eller mapper med .geojson-filer' )
+    p.add_argument( '--destination', default='NVDB' )
+    p.add_argument( '--brukertype', default='ANSATT' )
+    p.add_argument( '--gzip', action='store_true', help='Komprimer filene under opplasting' )
+    p.add_argument( '--ikke-godkjenn', action='store_true', help='Last opp uten å godkjenne filene' )
+    p.add_argument( '--batch', type=int, default=50, help='Antall filer per godkjenning, default 50' )
+    p.set_defaults( funksjon=kjorUpload )
+
+    p = kommandoer.add_parser( 'dakat', parents=[ felles ], help='Oppdater lokal cache av datakatalogen, se datakatalogendring/dakatcache.py' )
+    p.add_argument( '--mappe', help='Mappe for cachen' )
+    p.add_argument( '--sjekk-hvert', type=float, default=0, help='Sekund mellom hver sjekk av datakatalogversjon' )
+    p.add_argument( '--tving', action='store_true', help='Last ned selv om versjonen finnes i cachen' )
+    p.set_defaults( funksjon=kjorDakat )
+
+    return parser
+
+
+def main( argv=None ):
+    args = lagParser().parse_args( argv )
+    stdout = sys.stdout
+    try:
+        if args.json:
+            with redirect_stdout( sys.stderr ):
+                resultat, ok = args.funksjon( args )
+            json.dump( resultat, stdout, indent=2, ensure_ascii=False, default=str )
+            stdout.write( '\n' )
+        else:
+            resultat, ok = args.funksjon( args )
+    except ( _Avbrudd, NotImplementedError ) as e:
+        # NotImplementedError: ukjent --env for API'et (dfklient._finnApi)
+        print( f"datafangst: {e}", file=sys.stderr )
+        return 2
+    except dfklient.DatafangstHttpFeil as e:
+        print( f"datafangst: {e}", file=sys.stderr )
+        return 1
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit( main() )
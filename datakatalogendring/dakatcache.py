@@ -0,0 +1,224 @@
+"""
+Lokal, versjonert cache av datakatalogen fra NVDB api LES
+
+hentDatakatalog spør /status om gjeldende datakatalogversjon og laster kun ned /vegobjekttyper?inkluder=alle
+når versjonen er ny. Datakatalogen lagres som pickle med ferdige oppslag (vegobjekttype per ID, egenskapstype per ID,
+assosiasjoner per mor- og datterobjekttype), én fil per miljø og versjon. Den rå lista fra API lagres ikke, den lages
+fra oppslaget på vegobjekttype ved behov (DakatIndeks.vegobjekttyper). Å lese pickle-fila tar en brøkdel av tiden
+det tar å parse JSON-dumpen og bygge oppslagene på nytt.
+
+Eksempel
+    dakat = dakatcache.hentDatakatalog( 'PROD' )
+    dakat.versjon, dakat.typer[45]['navn'], dakat.egenskapstyper[10952]['navn'], dakat.assosiasjonerFra[45]
+
+Cachen ligger i ~/.datafangst/datakatalog, eller mappen i miljøvariabelen DATAFANGST_DAKATCACHE
+"""
+import gc
+import json
+import os
+import pickle
+import time
+import requests
+
+try:
+    from . import dumpDatakatalog
+except ImportError:
+    import dumpDatakatalog
+
+try:
+    import dfjson
+except ImportError:
+    dfjson = None
+
+FORMATVERSJON = 1
+
+
+def standardMappe( ):
+    return os.environ.get( 'DATAFANGST_DAKATCACHE', os.path.join( os.path.expanduser( '~' ), '.datafangst', 'datakatalog' ))
+
+
+def _relasjon( objType:dict, egenskap:dict ):
+    """
+    Relasjon (assosiasjon) fra egenskapstype, samme oppsett som i finnUgyldigeRelasjoner
+    """
+    enRelasjon = {  'morObjTypeId'      : objType['id'],
+                    'morObjTypeNavn'    : objType['navn'],
+                    'type_id'           : egenskap['id'],
+                    'relasjonNavn'      : egenskap['navn'],
+                    'datatype'          : egenskap.get( 'datatype' ),
+                    'datterObjektTypeId': None }
+    if 'innhold' in egenskap:
+        enRelasjon['datterObjektTypeId'] = egenskap['innhold'].get( 'vegobjekttypeid' )
+        enRelasjon['datatype']           = egenskap['innhold'].get( 'datatype' )
+        enRelasjon['type_id']            = egenskap['innhold'].get( 'id', egenskap['id'] )
+        enRelasjon['liste_id']           = egenskap['id']
+    elif 'vegobjekttypeid' in egenskap:
+        enRelasjon['datterObjektTypeId'] = egenskap['vegobjekttypeid']
+    return enRelasjon
+
+
+def byggIndeks( vegobjekttyper:list, versjon:str, miljo='PROD' ):
+    """
+    Lager oppslagstabeller for en datakatalog. Returnerer dict med kun innebygde datatyper (trygt å pickle)
+    """
+    typer = { }
+    egenskapstyper = { }
+    egenskapstypeTilType = { }
+    assosiasjoner = []
+    for objType in vegobjekttyper:
+        typer[objType['id']] = objType
+        for egenskap in objType.get( 'egenskapstyper', [] ):
+            egenskapstyper[egenskap['id']] = egenskap
+            egenskapstypeTilType[egenskap['id']] = objType['id']
+            if 'Assosiert' in egenskap['navn']:
+                assosiasjoner.append( _relasjon( objType, egenskap ))
+
+    assosiasjonerFra = { }
+    assosiasjonerTil = { }
+    for relasjon in assosiasjoner:
+        assosiasjonerFra.setdefault( relasjon['morObjTypeId'], [] ).append( relasjon )
+        assosiasjonerTil.setdefault( relasjon['datterObjektTypeId'], [] ).append( relasjon )
+
+    return { 'formatversjon'        : FORMATVERSJON,
+             'miljo'                : miljo.upper(),
+             'versjon'              : versjon,
+             'typer'                : typer,
+             'egenskapstyper'       : egenskapstyper,
+             'egenskapstypeTilType' : egenskapstypeTilType,
+             'assosiasjoner'        : assosiasjoner,
+             'assosiasjonerFra'     : assosiasjonerFra,
+             'assosiasjonerTil'     : assosiasjonerTil }
+
+
+class DakatIndeks:
+    """
+    Datakatalog med oppslag. Lages av hentDatakatalog eller lesCache
+
+    Attributter
+        miljo, versjon : str
+        vegobjekttyper : liste, som fra /vegobjekttyper?inkluder=alle (samme rekkefølge), lages fra typer
+        typer : dict vegobjekttype ID => vegobjekttype
+        egenskapstyper : dict egenskapstype ID => egenskapstype
+        egenskapstypeTilType : dict egenskapstype ID => vegobjekttype ID
+        assosiasjoner : liste med relasjoner (morObjTypeId, type_id, datterObjektTypeId, ...)
+        assosiasjonerFra, assosiasjonerTil : dict vegobjekttype ID => liste med relasjoner
+    """
+    def __init__( self, data:dict ):
+        # Cache fra før lagret også den rå lista, den trenger vi ikke
+        self.__dict__.update( { navn : verdi for navn, verdi in data.items() if navn != 'vegobjekttyper' } )
+
+    @property
+    def vegobjekttyper( self ):
+        return list( self.typer.values() )
+
+    def __repr__( self ):
+        return f"DakatIndeks( miljo={self.miljo}, versjon={self.versjon}, {len(self.typer)} vegobjekttyper )"
+
+
+def _cachefil( mappe:str, miljo:str, versjon:str ):
+    return os.path.join( mappe, f"dakat-{miljo.upper()}-{versjon.replace( '.', '_' )}.pickle" )
+
+
+def _statusfil( mappe:str, miljo:str ):
+    return os.path.join( mappe, f"status-{miljo.upper()}.json" )
+
+
+def lesCache( miljo='PROD', versjon=None, mappe=None ):
+    """
+    Leser datakatalog fra cache uten nettverkskall. Uten versjon leses siste kjente versjon for miljøet
+
+    RETURNS
+        DakatIndeks, eller None hvis den ikke finnes i cachen
+    """
+    mappe = mappe or standardMappe()
+    if versjon is None:
+        if not os.path.exists( _statusfil( mappe, miljo )):
+            return None
+        with open( _statusfil( mappe, miljo )) as fp:
+            versjon = json.load( fp )['versjon']
+
+    filnavn = _cachefil( mappe, miljo, versjon )
+    if not os.path.exists( filnavn ):
+        return None
+    # Mange små objekter, gc under lesing koster bare tid
+    gcPaa = gc.isenabled()
+    gc.disable()
+    try:
+        with open( filnavn, 'rb' ) as fp:
+            data = pickle.load( fp )
+    finally:
+        if gcPaa:
+            gc.enable()
+    if data.get( 'formatversjon' ) != FORMATVERSJON:
+        return None
+    return DakatIndeks( data )
+
+
+def hentDatakatalog( miljo='PROD', mappe=None, sjekkHvert=0, tvingOppdatering=False ):
+    """
+    Henter datakatalogen fra lokal cache, og laster ned på nytt kun når NVDB api LES har ny versjon
+
+    KEYWORDS
+        miljo : str, default PROD. PROD, TEST eller UTV (evt ATM, STM)
+
+        mappe : str, mappe for cachen. Default ~/.datafangst/datakatalog eller miljøvariabel DATAFANGST_DAKATCACHE
+
+        sjekkHvert : sekund, default 0. Hvor lenge en sjekk mot /status gjelder. Med f.eks sjekkHvert=3600
+                     spør vi ikke /status mer enn én gang i timen, og da er det ingen nettverkskall i det hele tatt
+
+        tvingOppdatering : bool, default False. Laster ned datakatalogen selv om versjonen finnes i cachen
+
+    RETURNS
+        DakatIndeks
+    """
+    mappe = mappe or standardMappe()
+    os.makedirs( mappe, exist_ok=True )
+    statusfil = _statusfil( mappe, miljo )
+
+    versjon = None
+    if sjekkHvert and not tvingOppdatering and os.path.exists( statusfil ):
+        with open( statusfil ) as fp:
+            status = json.load( fp )
+        if time.time() - status['sjekket'] < sjekkHvert:
+            versjon = status['versjon']
+
+    url = dumpDatakatalog.lesUrl( miljo )
+    if versjon is None:
+        try:
+            r = requests.get( url + 'status', headers=dumpDatakatalog.headers )
+        except requests.exceptions.ConnectionError as e:
+            # Uten nett bruker vi siste kjente versjon, hvis vi har den
+            dakat = None if tvingOppdatering else lesCache( miljo=miljo, mappe=mappe )
+            if dakat is None:
+                raise
+            print( f"Får ikke kontakt med {url}, bruker datakatalog {dakat.versjon} fra cache" )
+            return dakat
+        if not r.ok:
+            raise ValueError( f"Klarte ikke hente statusinformasjon fra LES: {r.url}\n http {r.status_code} {r.text[0:500]}")
+        versjon = r.json()['datagrunnlag']['datakatalog']['versjon']
+        with open( statusfil, 'w' ) as fp:
+            json.dump( { 'versjon' : versjon, 'sjekket' : time.time() }, fp )
+
+    if not tvingOppdatering:
+        dakat = lesCache( miljo=miljo, versjon=versjon, mappe=mappe )
+        if dakat is not None:
+            return dakat
+
+    print( f"Laster ned datakatalog {versjon} for {miljo} fra {url}" )
+    r = requests.get( url + 'vegobjekttyper', headers=dumpDatakatalog.headers, params={ 'inkluder' : 'alle' })
+    if not r.ok:
+        raise ValueError( f"Klarte ikke hente datakatalog fra LES: {r.url}\n http {r.status_code} {r.text[0:500]}")
+
+    data = byggIndeks( dfjson.lesRespons( r ) if dfjson else r.json(), versjon, miljo=miljo )
+    filnavn = _cachefil( mappe, miljo, versjon )
+    with open( filnavn + '.tmp', 'wb' ) as fp:
+        pickle.dump( data, fp, protocol=pickle.HIGHEST_PROTOCOL )
+    os.replace( filnavn + '.tmp', filnavn )
+
+    return DakatIndeks( data )
+
+
+if __name__ == '__main__':
+
+    dakat = hentDatakatalog( )
+    print( dakat )
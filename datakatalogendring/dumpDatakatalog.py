@@ -5,11 +5,14 @@ import json
 import requests
 from datetime import datetime
 
-def lagreDakat( miljo='PROD' ):
+headers = {'Accept' : 'application/json', 
+           "X-Client" : "nvdbapiv3.py fra Nvdb gjengen, vegdirektoratet", 
+           "X-Kontaktperson" : "jan.kristian.jensen@vegvesen.no" }
+
+def lesUrl( miljo='PROD' ): 
     """
-    Lagrer JSON-fil med gjeldende datakatalogversjon hentet fra NVDB api LES 
+    Returnerer rot-URL til NVDB api LES for angitt driftsmiljø
     """
-
     if miljo.upper() == 'PROD': 
         url = 'https://nvdbapiles-v3.atlas.vegvesen.no/'
     elif miljo.upper() == 'TEST' or miljo.upper() == 'ATM': 
@@ -18,10 +21,16 @@ def lagreDakat( miljo='PROD' ):
         url = 'https://nvdbapiles-v3.utv.atlas.vegvesen.no/'
     else: 
         raise ValueError( f"Ukjent driftsmiljø: {miljo}, paramterer miljo= må være PROD, TEST eller UTV (evt ATM, STM)")
-    
-    headers = {'Accept' : 'application/json', 
-               "X-Client" : "nvdbapiv3.py fra Nvdb gjengen, vegdirektoratet", 
-             "X-Kontaktperson" : "jan.kristian.jensen@vegvesen.no" }
+    return url 
+
+def lagreDakat( miljo='PROD' ):
+    """
+    Lagrer JSON-fil med gjeldende datakatalogversjon hentet fra NVDB api LES 
+
+    Se også dakatcache.hentDatakatalog, som holder en lokal, indeksert kopi per miljø og versjon 
+    """
+
+    url = lesUrl( miljo )
 
     # Henter statusinformasjon
     r = requests.get( url + '/status', headers=headers)
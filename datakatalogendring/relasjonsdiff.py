@@ -0,0 +1,140 @@
+"""
+Relasjonstyper (assosiasjoner) i datakatalogen som tabell, og sammenligning mellom versjoner
+
+Erstatter løkkene i finnUgyldigeRelasjoner.py og datakatalogendring2_34.py med en gjenbrukbar modul:
+relasjonstabell lager en pandas DataFrame med alle relasjonstyper i én vektorisert operasjon, diffVersjoner
+sammenligner to datakatalogversjoner, og diffDatabase finner relasjonstyper i datafangst-databasen som ikke
+lenger er gyldige. slettSQL lager SQL-setningen for opprydding.
+
+Tabellen har både ID til innholdet (type_id, det datafangst-databasen bruker for lister) og ID til selve
+egenskapstypen (liste_id). diffDatabase sjekker kun type_id som default, som finnUgyldigeRelasjoner alltid har
+gjort. Med kolonner=( 'type_id', 'liste_id' ) godtas begge, slik datakatalogendring2_34.py gjør i stedet for å
+gjette på +200000 / +220000.
+
+Eksempel
+    ny = relasjonstabell( dakatcache.hentDatakatalog( 'PROD' ))
+    ugyldige = diffDatabase( pd.read_csv( 'select_distinct_relasjonstyper.txt', header=None )[0], ny )
+    print( slettSQL( ugyldige['type_id'] ))
+"""
+import pandas as pd
+
+KOLONNER = [ 'morObjTypeId', 'morObjTypeNavn', 'type_id', 'liste_id', 'relasjonNavn', 'datatype', 'datterObjektTypeId' ]
+
+
+def _somVegobjekttyper( dakat ):
+    """
+    Godtar liste med vegobjekttyper, dakatcache.DakatIndeks eller JSON-dump fra dumpDatakatalog.lagreDakat (filnavn)
+    """
+    if isinstance( dakat, str ):
+        return pd.read_json( dakat ).to_dict( orient='records' )
+    if hasattr( dakat, 'vegobjekttyper' ):
+        return dakat.vegobjekttyper
+    return dakat
+
+
+def relasjonstabell( dakat ):
+    """
+    Lager tabell med alle relasjonstyper (egenskapstyper med 'Assosiert' i navnet) i en datakatalog
+
+    ARGUMENTS
+        dakat : liste med vegobjekttyper fra /vegobjekttyper, dakatcache.DakatIndeks eller filnavn til JSON-dump
+
+    RETURNS
+        pandas DataFrame med kolonnene morObjTypeId, morObjTypeNavn, type_id, liste_id, relasjonNavn, datatype, datterObjektTypeId.
+        For lister med assosiasjoner er type_id ID til innholdet og liste_id ID til lista, ellers er de like
+    """
+    vegobjekttyper = [ t for t in _somVegobjekttyper( dakat ) if t.get( 'egenskapstyper' ) ]
+    if len( vegobjekttyper ) == 0:
+        return pd.DataFrame( columns=KOLONNER )
+
+    # Én rad per egenskapstype, uten å pakke ut alle feltene (tillatte verdier osv) vi ikke trenger
+    rader = pd.DataFrame( vegobjekttyper, columns=[ 'id', 'navn', 'egenskapstyper' ] )
+    rader = rader.explode( 'egenskapstyper', ignore_index=True ).dropna( subset=[ 'egenskapstyper' ] )
+    rader = rader[ rader['egenskapstyper'].str.get( 'navn' ).str.contains( 'Assosiert', na=False ) ]
+
+    egenskap = rader['egenskapstyper']
+    innhold = egenskap.str.get( 'innhold' )
+
+    tabell = pd.DataFrame( {
+        'morObjTypeId'       : rader['id'].astype( 'int64' ),
+        'morObjTypeNavn'     : rader['navn'],
+        'type_id'            : innhold.str.get( 'id' ).fillna( egenskap.str.get( 'id' )).astype( 'int64' ),
+        'liste_id'           : egenskap.str.get( 'id' ).astype( 'int64' ),
+        'relasjonNavn'       : egenskap.str.get( 'navn' ),
+        'datatype'           : innhold.str.get( 'datatype' ).fillna( egenskap.str.get( 'datatype' )),
+        'datterObjektTypeId' : innhold.str.get( 'vegobjekttypeid' ).fillna( egenskap.str.get( 'vegobjekttypeid' )).astype( 'Int64' ),
+    }, columns=KOLONNER )
+    return tabell.reset_index( drop=True )
+
+
+def _somTabell( dakat ):
+    return dakat if isinstance( dakat, pd.DataFrame ) else relasjonstabell( dakat )
+
+
+def diffVersjoner( gammel, ny, nokkel='type_id' ):
+    """
+    Sammenligner relasjonstyper i to datakatalogversjoner
+
+    ARGUMENTS
+        gammel, ny : relasjonstabell (DataFrame) eller noe relasjonstabell godtar
+
+    KEYWORDS
+        nokkel : str, default 'type_id'. Kolonnen som identifiserer en relasjonstype
+
+    RETURNS
+        dictionary med DataFrames
+            lagtTil : relasjonstyper som kun finnes i ny
+            fjernet : relasjonstyper som kun finnes i gammel
+            endret  : samme nøkkel, men ulik mor- eller datterobjekttype eller navn. Kolonnene har suffiks _gammel og _ny
+    """
+    gammel = _somTabell( gammel )
+    ny = _somTabell( ny )
+
+    lagtTil = ny[ ~ny[nokkel].isin( gammel[nokkel] ) ]
+    fjernet = gammel[ ~gammel[nokkel].isin( ny[nokkel] ) ]
+
+    begge = pd.merge( gammel, ny, on=nokkel, how='inner', suffixes=( '_gammel', '_ny' ))
+    ulik = pd.Series( False, index=begge.index )
+    for kol in [ 'morObjTypeId', 'datterObjektTypeId', 'relasjonNavn' ]:
+        if kol == nokkel:
+            continue
+        a = begge[kol + '_gammel'].astype( 'object' )
+        b = begge[kol + '_ny'].astype( 'object' )
+        ulik |= ~( ( a == b ) | ( a.isna() & b.isna() ))
+    endret = begge[ulik]
+
+    return { 'lagtTil' : lagtTil.reset_index( drop=True ),
+             'fjernet' : fjernet.reset_index( drop=True ),
+             'endret'  : endret.reset_index( drop=True ) }
+
+
+def diffDatabase( typeIder, dakat, kolonner=( 'type_id', )):
+    """
+    Finner relasjonstyper i datafangst-databasen som ikke finnes i datakatalogen
+
+    ARGUMENTS
+        typeIder : liste eller Series med type_id, f.eks resultatet av `select distinct type_id from feature_association2`
+
+        dakat : relasjonstabell (DataFrame) eller noe relasjonstabell godtar
+
+    KEYWORDS
+        kolonner : kolonner i relasjonstabellen der en type_id regnes som gyldig. Default kun type_id,
+                   bruk ( 'type_id', 'liste_id' ) for å også godta ID til selve egenskapstypen
+
+    RETURNS
+        DataFrame med kolonnen type_id for de ugyldige relasjonstypene
+    """
+    tabell = _somTabell( dakat )
+    typeIder = pd.Series( list( typeIder ), name='type_id' ).astype( 'int64' )
+    gyldige = pd.concat( [ tabell[kol] for kol in kolonner ] ).astype( 'int64' )
+    return typeIder[ ~typeIder.isin( gyldige ) ].drop_duplicates().to_frame().reset_index( drop=True )
+
+
+def slettSQL( typeIder, tabell='feature_association2' ):
+    """
+    SQL-setning som sletter relasjonene med angitte type_id fra datafangst-databasen
+    """
+    typeIder = [ str( int( x )) for x in typeIder ]
+    if len( typeIder ) == 0:
+        return f"-- Ingen ugyldige relasjonstyper å slette fra {tabell}"
+    return f"start transaction; delete from {tabell} where type_id in ({','.join( typeIder )});"
@@ -5,14 +5,16 @@ Se dokumentasjon på datafangst API her https://apiskriv.vegdata.no/datafangst/d
 """
 from datetime import datetime
 import json
-import requests
 from requests.auth import HTTPBasicAuth
 import getpass 
-from copy import deepcopy 
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import os 
-from time import sleep
-import pdb
-import nvdbapiv3 
+
+import dfjson
+import dfklient
+import geojsonstrom
+import koordinater
+import romligindeks
 
 def hentPassord( user:str, api:str): 
     servernavn = [ x for x in api.split( '/' ) if 'datafangst' in x ]
@@ -24,56 +26,98 @@ def hentPassord( user:str, api:str):
     return pw 
 
 
-def get_data( url:str, user='jajens', pw=None, geojson=False ): 
+def _brukerOgPassord( user, pw, api:str, klient=None ): 
     """
-    Gjør GET - forespørsel mot Datafangst og returnerer data 
+    Spør interaktivt etter brukernavn og passord hvis de mangler, men kun hvis klienten ikke allerede er logget inn
     """
+    if klient is not None and klient.harInnlogging(): 
+        return user, pw 
 
     if not isinstance( user, str): 
         user = input( "Datafangst eller NVDB brukernavn:")
 
     if not isinstance( pw, str): 
-        pw = hentPassord( user, url )
+        pw = hentPassord( user, api )
+
+    return user, pw 
+
+
+def _auth( user, pw, klient=None ): 
+    """
+    Returnerer HTTPBasicAuth for kallet, eller None hvis klienten har innlogging på sesjonen 
+    """
+    if klient is not None and klient.harInnlogging(): 
+        return None 
+    return HTTPBasicAuth( user, pw )
+
+
+def get_data( url:str, user='jajens', pw=None, geojson=False, klient=None ): 
+    """
+    Gjør GET - forespørsel mot Datafangst og returnerer data 
+
+    klient=dfklient.DatafangstKlient gjenbruker forbindelser (og innlogging) på tvers av kall. 
+    Uten klient brukes dfklient.fellesKlient() 
+
+    Forbigående feil prøves på ny etter klientens RetryPolicy (se dfklient). Feiler kallet likevel 
+    får du dfklient.DatafangstHttpFeil 
+    """
+    user, pw = _brukerOgPassord( user, pw, url, klient=klient )
+    auth = _auth( user, pw, klient=klient )
+    if klient is None: 
+        klient = dfklient.fellesKlient()
 
     if geojson: 
         headers = headers = { 'Content-Type' : 'application/geo+json', 'Accept' : 'application/geo+json' }
     else: 
         headers = headers = { 'Content-Type' : 'application/geo+json', 'Accept' : 'application/json' }
 
-    r = requests.get( url, headers=headers, auth=HTTPBasicAuth( user, pw) )
+    r = klient.get( url, headers=headers, auth=auth )
     if r.ok: 
-        data = r.json( )
+        data = dfjson.lesRespons( r )
         return data  
     else: 
-        print( f"GET-kall feilet: HTTP {r.status_code} {r.text[0:500]}, prøver på ny")
-        sleep( 15 )
-        r = requests.get( url, headers=headers, auth=HTTPBasicAuth( user, pw) )
-        if r.ok: 
-            data = r.json( )
-            return data  
-        else: 
-            print( f"GET-kall feilet: HTTP {r.status_code} {r.text[0:500]}, prøver på ny")            
-            sleep( 15 )
-            r = requests.get( url, headers=headers, auth=HTTPBasicAuth( user, pw) )
-            if r.ok: 
-                data = r.json( )
-                return data  
-            else: 
-                print( f"GET-kall feilet enda en gang: HTTP {r.status_code} {r.text[0:500]}, gir opp")    
-                pdb.set_trace( )
-                # from IPython import embed; embed()
-
-    return None 
-
-
-def alleKontrakter(  url='https://datafangst.vegvesen.no/api/v1/contract/', user='jajens', pw=None ): 
+        raise dfklient.DatafangstHttpFeil.fraRespons( r, melding='GET-kall feilet' )
+
+
+def get_stream( url:str, user='jajens', pw=None, geojson=False, klient=None, headers=None ): 
+    """
+    Som get_data, men returnerer requests.Response med stream=True i stedet for ferdig parset JSON. 
+
+    Brukes for store nedlastinger som leses bit for bit med r.iter_content( ), se geojsonstrom. 
+    Husk å lukke responsen (r.close() eller with-blokk) 
+
+    headers=dict legges til standard-headerne, f.eks If-None-Match for betingede kall. Svaret kan da være HTTP 304 
+    """
+    ekstraHeaders = headers
+    user, pw = _brukerOgPassord( user, pw, url, klient=klient )
+    auth = _auth( user, pw, klient=klient )
+    if klient is None: 
+        klient = dfklient.fellesKlient()
+
+    if geojson: 
+        headers = { 'Content-Type' : 'application/geo+json', 'Accept' : 'application/geo+json' }
+    else: 
+        headers = { 'Content-Type' : 'application/geo+json', 'Accept' : 'application/json' }
+
+    if ekstraHeaders: 
+        headers.update( ekstraHeaders )
+
+    r = klient.get( url, headers=headers, auth=auth, stream=True )
+    if r.ok: 
+        return r 
+    else: 
+        r.close()
+        raise dfklient.DatafangstHttpFeil.fraRespons( r, melding='GET-kall feilet' )
+
+
+def alleKontrakter(  url='https://datafangst.vegvesen.no/api/v1/contract/', user='jajens', pw=None, klient=None ): 
     """
     Henter liste med kontrakter fra contracts-endepunktet
     """
-    if not isinstance( user, str): 
+    if not isinstance( user, str) and not ( klient and klient.harInnlogging() ): 
         user = input( "Datafangst eller NVDB brukernavn:")
 
-    contracts = get_data( url, user=user, pw=pw )
+    contracts = get_data( url, user=user, pw=pw, klient=klient )
     return contracts
 
 
@@ -83,7 +127,8 @@ def searchContracts( contractList:dict, substring:str):
     Finner subsett av kontrakter der 'substring' er en del av kontraktnavnet
 
     ARGUMENTS
-        contractList:  dictionary fra datafangst API. Selve listen er i contractList['contracts'] 
+        contractList:  dictionary fra datafangst API. Selve listen er i contractList['contracts']. Kan også være 
+                       kontraktkatalog.Kontraktkatalog, da brukes søkeindeksen i katalogen 
 
         substring: text
 
@@ -91,16 +136,24 @@ def searchContracts( contractList:dict, substring:str):
         N/A
 
     RETURNS 
-        contractList etter filtrering     
+        contractList etter filtrering. Kontraktene i listen er de samme objektene som i contractList, de kopieres ikke 
     """
-    filtrert = deepcopy ( contractList )
+    if hasattr( contractList, 'sok' ): 
+        treff = contractList.sok( substring )
+        contractList = contractList.contractList 
+    else: 
+        sokeTekst = substring.lower()
+        treff = [ x for x in contractList['contracts'] if sokeTekst in x['name'].lower() ] 
+
+    # Grunn kopi holder, listen med kontrakter byttes uansett ut
+    filtrert = dict( contractList )
 
     if 'tekstfilter' in filtrert: 
         filtrert['tekstfilter'] += f" +> '{substring}'"
     else: 
-        filtrert['tekstfilter'] = f"'substring'" 
+        filtrert['tekstfilter'] = f"'{substring}'" 
 
-    filtrert['contracts'] = [ x for x in contractList['contracts'] if substring.lower() in x['name'].lower() ] 
+    filtrert['contracts'] = treff 
 
     maks_antall_utskrift=10
     if len( filtrert['contracts'] ) == 0: 
@@ -117,22 +170,18 @@ def searchContracts( contractList:dict, substring:str):
 
     return filtrert 
 
-def alleFeaturecollections( contractId:str, destination='NVDB', api='https://datafangst.vegvesen.no/api/v1/contract/', user='jajens', pw=None ):
+def alleFeaturecollections( contractId:str, destination='NVDB', api='https://datafangst.vegvesen.no/api/v1/contract/', user='jajens', pw=None, klient=None ):
     """
     henter liste med featureCollection fra kontrakt
     """
 
-    if not isinstance( user, str): 
-        user = input( "Datafangst eller NVDB brukernavn:")
-
-    if not isinstance( pw, str): 
-        pw = hentPassord( user, api )
+    user, pw = _brukerOgPassord( user, pw, api, klient=klient )
 
-    data = get_data( api + contractId + '/featurecollection', user=user, pw=pw )        
+    data = get_data( api + contractId + '/featurecollection', user=user, pw=pw, klient=klient )        
     return data 
 
 
-def sjekkFeatureCollectionStatus( kontrakt:str, featureCollectionId:str, utskrift=True, user='jajens', pw=None, api='https://datafangst.vegvesen.no/api/v1/contract/' ):
+def sjekkFeatureCollectionStatus( kontrakt:str, featureCollectionId:str, utskrift=True, user='jajens', pw=None, api='https://datafangst.vegvesen.no/api/v1/contract/', klient=None ):
     """
     Sjekker status for kontrakt/featurecollection 
 
@@ -150,16 +199,18 @@ def sjekkFeatureCollectionStatus( kontrakt:str, featureCollectionId:str, utskrif
 
         api:str - default api='https://datafangst.vegvesen.no/api/v1/contract/'
 
+        klient:dfklient.DatafangstKlient - default None. Gjenbrukbar HTTP-sesjon, se dfklient 
+
     RETURNS 
         dictionary med detaljert statusinformasjon. 
     """
-    minStatus = get_data( api + kontrakt + '/featurecollection/' + featureCollectionId + '/status', user=user, pw=pw )
+    minStatus = get_data( api + kontrakt + '/featurecollection/' + featureCollectionId + '/status', user=user, pw=pw, klient=klient )
     if utskrift: 
         print( json.dumps( minStatus, indent=4, ensure_ascii=False) )
 
     return minStatus 
 
-def sjekkResponsStatus( DF10Respons, user='jajens', pw=None, utskrift=True ):  
+def sjekkResponsStatus( DF10Respons, user='jajens', pw=None, utskrift=True, klient=None ):  
     """
     Følger status-lenken som finnes i responsen fra df10.postFeatureCollection eller df10.putFeatureCollection 
 
@@ -173,6 +224,8 @@ def sjekkResponsStatus( DF10Respons, user='jajens', pw=None, utskrift=True ):
         pw - str, passord med leserettigheter på kontrakten. Hvis blankt blir du interaktivt spurt i python shell. 
     
         utskrift - boolean, default = True. Sett lik false for å skru av logging til konsoll 
+
+        klient - dfklient.DatafangstKlient, default None. Gjenbrukbar HTTP-sesjon, se dfklient 
     Returns 
         dictionary med detaljert statusinformasjon. 
 
@@ -195,7 +248,7 @@ def sjekkResponsStatus( DF10Respons, user='jajens', pw=None, utskrift=True ):
     print( f"Henter status for {len( statusElement)} for feature Collection {DF10Respons['featureCollectionId']}")
     myList = []
     for enStatus in statusElement: 
-        minStatus = get_data( enStatus['src'], user=user, pw=pw )
+        minStatus = get_data( enStatus['src'], user=user, pw=pw, klient=klient )
         if utskrift: 
             print( minStatus )
         myList.append( minStatus)
@@ -208,7 +261,7 @@ def sjekkResponsStatus( DF10Respons, user='jajens', pw=None, utskrift=True ):
         print( f"Fant totalt {len(myList)} status-element, det var rart??? \n\n")
         return myList
 
-def sjekkstatusFeatureCollection( contractId:str, featurecollectionId:str, api='https://datafangst.vegvesen.no/api/v1/contract/',  user='jajens', pw=None ): 
+def sjekkstatusFeatureCollection( contractId:str, featurecollectionId:str, api='https://datafangst.vegvesen.no/api/v1/contract/',  user='jajens', pw=None, klient=None ): 
     """
     Returnerer URL til statusinformasjon som du kan åpne i nettleser
     
@@ -229,16 +282,18 @@ def sjekkstatusFeatureCollection( contractId:str, featurecollectionId:str, api='
                     Sett user=None for å oppgi brukernavn interaktivt i python shell. 
         
         pw=None - str, passord med skriverettigheter på kontrakten. Hvis blankt blir du interaktivt spurt i python shell.  
+
+        klient=None - dfklient.DatafangstKlient, gjenbrukbar HTTP-sesjon med connection pool. Har klienten innlogging trengs ikke user og pw 
         
     RETURNS 
         dictionary med responsen fra API. Inni denne responsen finner du lenke for å sjekke status. Se funksjon df10.sjekkStatus 
 
     """
     url =  api + contractId + '/featurecollection/' + featurecollectionId + '/status' 
-    minStatus = get_data( url, user=user, pw=pw )
+    minStatus = get_data( url, user=user, pw=pw, klient=klient )
     return minStatus
 
-def postFeatureCollection( contractId:str, data:dict, api='https://datafangst.vegvesen.no/api/v1/contract/', user='jajens', pw=None, **kwargs ): 
+def postFeatureCollection( contractId:str, data:dict, api='https://datafangst.vegvesen.no/api/v1/contract/', user='jajens', pw=None, klient=None, utm33=False, **kwargs ): 
     """
     Sender inn datafangst geojson til kontrakten  
 
@@ -261,35 +316,46 @@ def postFeatureCollection( contractId:str, data:dict, api='https://datafangst.ve
                     Sett user=None for å oppgi brukernavn interaktivt i python shell. 
         
         pw=None - str, passord med skriverettigheter på kontrakten. Hvis blankt blir du interaktivt spurt i python shell.  
+
+        klient=None - dfklient.DatafangstKlient, gjenbrukbar HTTP-sesjon med connection pool. Har klienten innlogging trengs ikke user og pw 
+
+        utm33=False - bool. Transformerer alle koordinater til EPSG:25833 før innsending (se koordinater.tilUtm33), så slipper 
+                    serveren å gjøre det under validering 
         
     RETURNS 
         dictionary med responsen fra API. Inni denne responsen finner du lenke for å sjekke status. Se funksjon df10.sjekkStatus 
+        Med utm33=True ligger rapporten fra koordinater.tilUtm33 (fra-CRS, metode, nøyaktighet) i responsen under 'koordinatrapport' 
     """
 
 
     headers = { 'Content-Type' : 'application/geo+json', 'Accept' : 'application/json' }
 
-    if not isinstance( user, str): 
-        user = input( "Datafangst eller NVDB brukernavn:")
+    user, pw = _brukerOgPassord( user, pw, api, klient=klient )
+    auth = _auth( user, pw, klient=klient )
+    if klient is None: 
+        klient = dfklient.fellesKlient()
 
-    if not isinstance( pw, str): 
-        pw = hentPassord( user, api )
+    rapport = None 
+    if utm33: 
+        data, rapport = koordinater.forInnsending( data )
 
     url = api + contractId + '/featurecollection'
-    r = requests.post( url, json=data, headers=headers, auth=HTTPBasicAuth(user, pw))
+    r = klient.post( url, data=dfjson.dumps( data ), headers=headers, auth=auth )
 
     if r.ok: 
         print( f"Vellykket innsending av geojson på kontrakt {contractId} HTTP post {r.status_code}" )
-        apiRespons = r.json()
+        apiRespons = dfjson.lesRespons( r )
+        if rapport is not None: 
+            apiRespons['koordinatrapport'] = rapport 
         print( f"FeatureCollection ID: {apiRespons['featureCollectionId']}")
         return apiRespons
     else: 
         print( f"Innsending av geojson http POST feilet {r.status_code} {r.text[0:500]}")        
-        from IPython import embed; embed()
+        raise dfklient.DatafangstHttpFeil.fraRespons( r, melding='Innsending av geojson feilet' )
 
 
 
-def putFeatureCollection( contractId:str, featureCollectionID:str, data:dict, api='https://datafangst.vegvesen.no/api/v1/contract/', user='jajens', pw=None, **kwargs ): 
+def putFeatureCollection( contractId:str, featureCollectionID:str, data:dict, api='https://datafangst.vegvesen.no/api/v1/contract/', user='jajens', pw=None, klient=None, utm33=False, **kwargs ): 
     """
     Overskriver en eksisterende geojson featureCollection på kontrakten. 
 
@@ -316,34 +382,80 @@ def putFeatureCollection( contractId:str, featureCollectionID:str, data:dict, ap
                     Sett user=None for å oppgi brukernavn interaktivt i python shell. 
         
         pw=None - str, passord med skriverettigheter på kontrakten. Hvis blankt blir du interaktivt spurt i python shell.  
+
+        klient=None - dfklient.DatafangstKlient, gjenbrukbar HTTP-sesjon med connection pool. Har klienten innlogging trengs ikke user og pw 
+
+        utm33=False - bool. Transformerer alle koordinater til EPSG:25833 før innsending (se koordinater.tilUtm33), så slipper 
+                    serveren å gjøre det under validering 
         
     RETURNS 
         dictionary med responsen fra API. Inni denne responsen finner du lenke for å sjekke status. Se funksjon df10.sjekkStatus 
+        Med utm33=True ligger rapporten fra koordinater.tilUtm33 (fra-CRS, metode, nøyaktighet) i responsen under 'koordinatrapport' 
     """
 
     headers = { 'Content-Type' : 'application/geo+json', 'Accept' : 'application/json' }
 
-    if not isinstance( user, str): 
-        user = input( "Datafangst eller NVDB brukernavn:")
+    user, pw = _brukerOgPassord( user, pw, api, klient=klient )
+    auth = _auth( user, pw, klient=klient )
+    if klient is None: 
+        klient = dfklient.fellesKlient()
 
-    if not isinstance( pw, str): 
-        pw = hentPassord( user, api )
+    rapport = None 
+    if utm33: 
+        data, rapport = koordinater.forInnsending( data )
 
     url = api + contractId + '/featurecollection/'  + featureCollectionID
-    r = requests.put( url, json=data, headers=headers, auth=HTTPBasicAuth(user, pw))
+    r = klient.put( url, data=dfjson.dumps( data ), headers=headers, auth=auth )
 
     if r.ok: 
         print( f"Vellykket overskriving av geojson på kontrakt {contractId} HTTP put {r.status_code} {r.text[0:500]}")
-        apiRespons = r.json()
+        apiRespons = dfjson.lesRespons( r )
+        if rapport is not None: 
+            apiRespons['koordinatrapport'] = rapport 
         print( f"FeatureCollection ID: {apiRespons['featureCollectionId']}")
         return apiRespons
 
     else: 
         print( f"Innsending av geojson http PUT feilet {r.status_code} {r.text[0:500]}")        
-        from IPython import embed; embed()
+        raise dfklient.DatafangstHttpFeil.fraRespons( r, melding='Overskriving av geojson feilet' )
 
 
-def lagreFeatureCollections( contractId:str, mappenavn:str, api='https://datafangst.vegvesen.no/api/v1/contract/', user='jajens', pw=None, **kwargs): 
+def _lagreEnFeatureCollection( col:dict, mappenavn:str, user='jajens', pw=None, klient=None, format='innrykk', indeks=None ): 
+    """
+    Laster ned én featureCollection med status og lagrer den som geojson-fil i mappenavn. 
+
+    Features kopieres rett fra responsen til disk med validationStatus lagt på underveis (geojsonstrom), 
+    så minnebruken er den samme uansett hvor stor featureCollection er. 
+
+    Med indeks=romligindeks.Romligindeks samles bbox, featureId og typeId for hvert feature underveis og legges i indeksen. 
+
+    Hjelpefunksjon for lagreFeatureCollections, returnerer antall vegobjekter som ble lagret. 
+    """
+    src = [ x for x in col['resources'] if 'src' in x ]
+    url= src[0]['src']
+    status = get_data( url + '/status', user=user, pw=pw, klient=klient )
+
+    filnavn = os.path.join( mappenavn, col['id'] + geojsonstrom.FILENDELSE[format] )
+    samler = romligindeks.Samler() if indeks is not None else None
+    # Skriver til .tmp og bytter inn til slutt, så et avbrudd ikke etterlater en halv fil (og indeksen peker på den forrige) 
+    try: 
+        with get_stream( url, user=user, pw=pw, geojson=True, klient=klient ) as r: 
+            with open( filnavn + '.tmp', 'w', encoding='utf-8' ) as fp:
+                antall = geojsonstrom.skrivFeatureCollection( r.iter_content( chunk_size=1 << 16 ), fp, 
+                                            ekstraEgenskaper={ 'validationStatus' : status['validationStatus'] }, format=format, hvertFeature=samler )
+    except BaseException: 
+        if os.path.exists( filnavn + '.tmp' ): 
+            os.remove( filnavn + '.tmp' )
+        raise 
+    os.replace( filnavn + '.tmp', filnavn )
+
+    if indeks is not None: 
+        indeks.leggTilFil( filnavn, samler.rader, featureCollectionId=col['id'] )
+
+    return antall 
+
+
+def lagreFeatureCollections( contractId:str, mappenavn:str, api='https://datafangst.vegvesen.no/api/v1/contract/', user='jajens', pw=None, maksParallelle=1, klient=None, format='innrykk', romligIndeks=False, **kwargs): 
     """
     Laster ned og lagrer alle featureCollections som finnes på angitt kontrakt til det angitte mappenavn 
 
@@ -353,43 +465,75 @@ def lagreFeatureCollections( contractId:str, mappenavn:str, api='https://datafan
         mappenavn : tekst, navn på den mappen der du vil lagre filene.  
 
     KEYWORDS
-        Samme som alleFeatureCollections 
+        maksParallelle : int, default 1. Antall featureCollections som lastes ned samtidig (tråder). Med 1 
+                        lastes de ned en og en, som før. Hver fil skrives til disk så snart den er ferdig nedlastet. 
+
+        klient : dfklient.DatafangstKlient, gjenbrukbar HTTP-sesjon. Bør ha poolstorrelse >= maksParallelle 
+
+        format : 'innrykk' (default, som json.dump med indent=4), 'kompakt' (uten mellomrom) eller 'ndjson' 
+                (ett vegobjekt per linje, filendelse .geojsonl). Filene skrives strømmende, se geojsonstrom 
+
+        romligIndeks : bool, default False. Bygger romlig indeks (romligindeks.sqlite i mappenavn) underveis, 
+                for raske bbox-, nærmeste- og vegobjekttype-søk i ettertid, se romligindeks 
+
+        Ellers samme som alleFeatureCollections 
 
     RETURNS 
-        None 
+        dictionary med antall (featureCollections på kontrakten), features (featureCollection ID => antall vegobjekter) 
+        og feilet (liste med featureCollection ID som ikke ble lagret) 
     """
     t0 = datetime.now()
 
-    if not isinstance( user, str): 
-        user = input( "Datafangst eller NVDB brukernavn:")
+    if format not in geojsonstrom.FORMATER: 
+        raise ValueError( f"Ukjent format {format}, må være en av {geojsonstrom.FORMATER}")
 
-    if not isinstance( pw, str): 
-        pw = hentPassord( user, api )
+    user, pw = _brukerOgPassord( user, pw, api, klient=klient )
 
-    data = alleFeaturecollections( contractId, api=api, user=user, pw=pw, **kwargs )
-    metadata = get_data( api+contractId, user=user, pw=pw )
-    print( f"{len(data['featureCollections'] )} feature collections på kontrakt {metadata['name']} {metadata['id']}, lagres til mappe {mappenavn} ")
+    data = alleFeaturecollections( contractId, api=api, user=user, pw=pw, klient=klient, **kwargs )
+    metadata = get_data( api+contractId, user=user, pw=pw, klient=klient )
+    antall = len( data['featureCollections'] )
+    print( f"{antall} feature collections på kontrakt {metadata['name']} {metadata['id']}, lagres til mappe {mappenavn} ")
     if not os.path.exists( mappenavn): 
         os.makedirs( mappenavn)
-    
-    for count, col in enumerate( data['featureCollections']): 
-        src = [ x for x in col['resources'] if 'src' in x ]
-        url= src[0]['src']
-        print( f"\t-> Henter feature collection {count+1} av {len(data['featureCollections'])} tidsbruk så langt: {datetime.now()-t0}")
-        myGeo = get_data( url, user=user, pw=pw, geojson=True )
-        status = get_data( url + '/status', user=user, pw=pw )
-
-        print( f"{len(myGeo['features'])} vegobjekter for featureCollection \n{url}")
 
-        # Legger på valideringsstatus
-        for idx,feat in enumerate( myGeo['features']): 
-            myGeo['features'][idx]['properties']['validationStatus'] = status['validationStatus']
-
-        with open( os.path.join( mappenavn, col['id']+'.geojson' ), 'w' ) as fp:
-            json.dump( myGeo, fp, indent=4, ensure_ascii=False  )
+    resultat = { 'antall' : antall, 'features' : { }, 'feilet' : [] }
+    indeks = romligindeks.Romligindeks( mappenavn ) if romligIndeks else None
+    feilet = resultat['feilet']
+    if not maksParallelle or maksParallelle <= 1: 
+        for count, col in enumerate( data['featureCollections']): 
+            print( f"\t-> Henter feature collection {count+1} av {antall} tidsbruk så langt: {datetime.now()-t0}")
+            try: 
+                antallFeatures = _lagreEnFeatureCollection( col, mappenavn, user=user, pw=pw, klient=klient, format=format, indeks=indeks )
+            except Exception as e: 
+                feilet.append( col['id'] )
+                print( f"\t-> Feilet for feature collection {col['id']}: {e}")
+                continue 
+            resultat['features'][col['id']] = antallFeatures 
+            print( f"{antallFeatures} vegobjekter for featureCollection {col['id']}")
 
+    else: 
+        print( f"Laster ned med inntil {maksParallelle} samtidige forespørsler")
+        with ThreadPoolExecutor( max_workers=maksParallelle ) as pool: 
+            jobber = { pool.submit( _lagreEnFeatureCollection, col, mappenavn, user=user, pw=pw, klient=klient, format=format, indeks=indeks ) : col for col in data['featureCollections'] }
+            for count, jobb in enumerate( as_completed( jobber )): 
+                col = jobber[jobb]
+                try: 
+                    antallFeatures = jobb.result()
+                except Exception as e: 
+                    feilet.append( col['id'] )
+                    print( f"\t-> Feilet for feature collection {col['id']}: {e}")
+                else: 
+                    resultat['features'][col['id']] = antallFeatures 
+                    print( f"\t-> Ferdig med feature collection {count+1} av {antall}, {antallFeatures} vegobjekter i {col['id']} tidsbruk så langt: {datetime.now()-t0}")
+
+    if len( feilet ) > 0: 
+        print( f"{len(feilet)} av {antall} feature collections feilet: {feilet}")
+
+    if indeks is not None: 
+        indeks.lukk()
 
     print( f"Tidsbruk totalt: {datetime.now()-t0}")
+    return resultat 
 
 
 
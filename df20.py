@@ -1,16 +1,21 @@
 """
 Håndtere kommunikasjon (opp-og nedlasting DF20)
 """
-import requests
 import getpass
 import json 
+import base64
+import os
+import threading
+import time
+import zlib
 from copy import deepcopy 
+from concurrent.futures import ThreadPoolExecutor
 
-def login( username=None,  pw=None, brukertype='ANSATT', miljo='TEST' ):
-    """
-    Logger inn i nye Datafangst (DF2.0). Returnerer http header til bruk i senere API-kall
-    """
+import dfjson
+import dfklient
+import koordinater
 
+def _authapi( miljo:str ): 
     if miljo.upper() in ['TEST', 'ATM' ]: 
         authapi = 'https://nvdbauth.test.atlas.vegvesen.no/api/v1/auth/autentiser'
     elif miljo.upper() in ['PROD', 'PRODUKSJON' ]: 
@@ -19,8 +24,31 @@ def login( username=None,  pw=None, brukertype='ANSATT', miljo='TEST' ):
         authapi = 'https://nvdbauth.utv.atlas.vegvesen.no/api/v1/auth/autentiser'
     else: 
         raise NotImplementedError(f"Har ikke implementert støtte for miljø {miljo} ennå")
+    return authapi 
+
 
+def _autentiser( username:str, pw:str, brukertype:str, authapi:str, klient=None ): 
+    """
+    POST mot nvdbauth. Returnerer requests.Response 
+    """
     innlogging_headers =  { 'X-Client' : 'LtGlahn python' }
+    innlogging_body    =  {'brukernavn' : username, 'brukertype' : brukertype, 'passord' : pw  }
+    if klient is None: 
+        klient = dfklient.fellesKlient()
+    return klient.post( authapi, headers=innlogging_headers, json=innlogging_body, medToken=False  )
+
+
+def login( username=None,  pw=None, brukertype='ANSATT', miljo='TEST', klient=None ):
+    """
+    Logger inn i nye Datafangst (DF2.0). Returnerer http header til bruk i senere API-kall
+
+    Sendes klient=dfklient.DatafangstKlient inn så legges token-headeren også på klientens sesjon, 
+    og klienten kan brukes direkte i lastOppGeojson og godkjennFiler 
+
+    For lange jobber og skript som kjøres ofte, se TokenHandterer (cacher token og fornyer det før det går ut)
+    """
+
+    authapi = _authapi( miljo )
 
     if not username: 
         username = getpass.getpass( 'Ditt brukernavn')
@@ -28,81 +56,409 @@ def login( username=None,  pw=None, brukertype='ANSATT', miljo='TEST' ):
     if not pw: 
         pw = getpass.getpass( f"Passord for bruker {username} i {authapi}:> ")
     
-    innlogging_body    =  {'brukernavn' : username, 'brukertype' : brukertype, 'passord' : pw  }
-    r_innlogging = requests.post( authapi, headers=innlogging_headers, json=innlogging_body  )
+    r_innlogging = _autentiser( username, pw, brukertype, authapi, klient=klient )
     if r_innlogging.ok: 
         print( "SUKSESS, vi er logget inn")
         id_token = r_innlogging.json()
         # MERK MELLOMROM mellom 'Bearer' og id_token  
         df_headers =  { 'X-Client': 'LtGlahn python',
                         'Authorization' : 'Bearer' + ' ' + id_token['id_token'] }
+        if klient is not None: 
+            klient.sesjon.headers.update( df_headers )
         return df_headers 
     else: 
         print( f"Innlogging feilet: http {r_innlogging.status_code} {r_innlogging.text}" )
         return None 
 
+
+def tokenUtloper( id_token:str ): 
+    """
+    Leser utløpstidspunkt (exp, sekunder siden 1970) fra et JWT-token uten å verifisere signaturen. None hvis det ikke lar seg lese
+    """
+    try: 
+        nyttelast = id_token.split( '.' )[1]
+        nyttelast += '=' * ( -len( nyttelast ) % 4 )
+        return float( json.loads( base64.urlsafe_b64decode( nyttelast ))['exp'] )
+    except ( IndexError, KeyError, ValueError, TypeError ): 
+        return None 
+
+
+class TokenHandterer: 
+    """
+    Holder på innloggingstoken for DF2.0, og fornyer det før det går ut 
+
+    Token deles mellom alle TokenHandterer-objekter og tråder i samme python-prosess for samme miljø, bruker og 
+    brukertype, og kan i tillegg lagres i en fil som kun eieren kan lese (tokenfil=True), slik at korte skript 
+    slipper å logge inn hver gang de kjøres. Passordet lagres aldri på disk. 
+
+    Eksempel 
+        tokens = df20.TokenHandterer( 'jajens', miljo='TEST', tokenfil=True )
+        df20.lastOppGeojson( minGeojson, kontrakt, 'fil.geojson', tokens )     # tokens.header() kalles for hvert kall 
+        klient = dfklient.df20Klient( miljo='TEST', tokenHandterer=tokens )  # fornyer token og prøver på nytt ved HTTP 401 
+
+    ARGUMENTS
+        username : str, brukernavn. Spørres interaktivt hvis None 
+
+    KEYWORDS
+        pw : str, passord. Spørres interaktivt første gang det trengs hvis None, og holdes i minnet for fornying 
+
+        brukertype : str, default 'ANSATT'
+
+        miljo : str, default 'TEST' 
+
+        tokenfil : False (default), True (~/.datafangst/token-MILJO-BRUKER-BRUKERTYPE.json) eller filnavn 
+
+        fornyFor : sekund, default 300. Token fornyes når det er mindre enn så lenge til det går ut 
+
+        levetid : sekund, default 3000. Antatt levetid hvis utløpstid ikke kan leses fra tokenet 
+
+        klient : dfklient.DatafangstKlient som brukes for innloggingskallet 
+    """
+
+    _delt = { }
+    _deltLaas = threading.Lock()
+
+    def __init__( self, username=None, pw=None, brukertype='ANSATT', miljo='TEST', tokenfil=False, fornyFor=300, levetid=3000, klient=None ): 
+        if not username: 
+            username = getpass.getpass( 'Ditt brukernavn')
+        self.username = username 
+        self._pw = pw 
+        self.brukertype = brukertype 
+        self.miljo = miljo.upper() 
+        self.authapi = _authapi( miljo )
+        self.fornyFor = fornyFor 
+        self.levetid = levetid 
+        self.klient = klient 
+
+        if tokenfil is True: 
+            tokenfil = os.path.join( os.path.expanduser( '~' ), '.datafangst', f"token-{self.miljo}-{username}-{brukertype}.json" )
+        self.tokenfil = tokenfil 
+
+        self._nokkel = ( self.miljo, username, brukertype )
+        with TokenHandterer._deltLaas: 
+            if self._nokkel not in TokenHandterer._delt: 
+                TokenHandterer._delt[self._nokkel] = { 'laas' : threading.Lock(), 'token' : None, 'utloper' : 0 }
+        self._tilstand = TokenHandterer._delt[self._nokkel]
+
+    def _lesTokenfil( self ): 
+        if not self.tokenfil or not os.path.exists( self.tokenfil ): 
+            return 
+        try: 
+            with open( self.tokenfil ) as fp: 
+                lagret = json.load( fp )
+        except ( OSError, ValueError ): 
+            return 
+        if lagret.get( 'utloper', 0 ) > self._tilstand['utloper']: 
+            self._tilstand['token'] = lagret['id_token']
+            self._tilstand['utloper'] = lagret['utloper']
+
+    def _skrivTokenfil( self ): 
+        if not self.tokenfil: 
+            return 
+        os.makedirs( os.path.dirname( os.path.abspath( self.tokenfil )), exist_ok=True )
+        fd = os.open( self.tokenfil, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600 )
+        with os.fdopen( fd, 'w' ) as fp: 
+            json.dump( { 'id_token' : self._tilstand['token'], 'utloper' : self._tilstand['utloper'] }, fp )
+
+    def _loggInn( self ): 
+        if not self._pw: 
+            self._pw = getpass.getpass( f"Passord for bruker {self.username} i {self.authapi}:> ")
+        r = _autentiser( self.username, self._pw, self.brukertype, self.authapi, klient=self.klient )
+        if not r.ok: 
+            raise dfklient.DatafangstHttpFeil.fraRespons( r, melding='Innlogging feilet' )
+        id_token = r.json()['id_token']
+        self._tilstand['token'] = id_token 
+        self._tilstand['utloper'] = tokenUtloper( id_token ) or time.time() + self.levetid 
+        self._skrivTokenfil()
+
+    def token( self ): 
+        """
+        Returnerer gyldig id_token. Logger inn (eller inn på nytt) kun hvis vi ikke har et token som varer en stund til 
+        """
+        with self._tilstand['laas']: 
+            if self._tilstand['utloper'] - time.time() < self.fornyFor: 
+                self._lesTokenfil()
+            if self._tilstand['utloper'] - time.time() < self.fornyFor: 
+                self._loggInn()
+            return self._tilstand['token']
+
+    def header( self ): 
+        """
+        Http header med gyldig token, samme som login( ) returnerer 
+        """
+        # MERK MELLOMROM mellom 'Bearer' og id_token  
+        return { 'X-Client': 'LtGlahn python', 'Authorization' : 'Bearer' + ' ' + self.token() }
+
+    def ugyldiggjor( self, token=None ): 
+        """
+        Glemmer token, f.eks etter HTTP 401. Neste kall til token( ) logger inn på nytt 
+
+        token=det tokenet som feilet (id_token eller 'Bearer ...'). Glemmes bare hvis det fortsatt er gjeldende token, 
+        så mange samtidige 401 på samme token gir én ny innlogging, ikke én per kall 
+        """
+        if token and token.startswith( 'Bearer ' ): 
+            token = token[len( 'Bearer ' ):]
+        with self._tilstand['laas']: 
+            if token and token != self._tilstand['token']: 
+                return 
+            self._tilstand['token'] = None 
+            self._tilstand['utloper'] = 0 
+            if self.tokenfil and os.path.exists( self.tokenfil ): 
+                os.remove( self.tokenfil )
+
+
+def _kopierHeader( header_med_token ): 
+    """
+    Kopi av header, header_med_token kan være dict fra login, TokenHandterer eller None 
+    """
+    if hasattr( header_med_token, 'header' ): 
+        return header_med_token.header()
+    return deepcopy( header_med_token ) if header_med_token else { }
+
     
-def hentKontrakter( header_med_token:dict, apiUrl ='https://datafangst-api-gateway.test.atlas.vegvesen.no/api/v2/'  )
+def hentKontrakter( header_med_token:dict, apiUrl ='https://datafangst-api-gateway.test.atlas.vegvesen.no/api/v2/'  ):
     """
     Henter liste med de kontraktene du har tilgang til 
     """
     pass
 
 
-def lastOppGeojson( myGeoJson:dict, kontrakt:str, filnavn:str, header_med_token:dict, destination='NVDB', apiUrl = 'https://datafangst-api-gateway.test.atlas.vegvesen.no/api/v2/' ): 
+class _GzipKropp: 
+    """
+    Gzip-komprimerer en fil bit for bit mens den sendes som request body. Hver iterasjon starter fra begynnelsen 
+    av fila, slik at body kan sendes på nytt ved retry 
+    """
+    def __init__( self, fp, bitstorrelse=1 << 16 ): 
+        self.fp = fp 
+        self.start = fp.tell()
+        self.bitstorrelse = bitstorrelse 
+
+    def __iter__( self ): 
+        self.fp.seek( self.start )
+        komprimering = zlib.compressobj( 6, zlib.DEFLATED, 31 )  # wbits 31 = gzip-format 
+        for bit in iter( lambda: self.fp.read( self.bitstorrelse ), b'' ): 
+            komprimert = komprimering.compress( bit )
+            if komprimert: 
+                yield komprimert 
+        yield komprimering.flush()
+
+
+def _kropp( myGeoJson, gzip=False ): 
+    """
+    Gjør om dict, filnavn, filobjekt eller bytes til request body, uten å parse eller serialisere json for annet enn dict
+
+    RETURNS 
+        ( body, filobjekt vi har åpnet og må lukke eller None, ekstra headere )
+    """
+    aapnet = None 
+    if isinstance( myGeoJson, dict ): 
+        kropp = dfjson.dumps( myGeoJson )
+    elif isinstance( myGeoJson, ( str, os.PathLike )): 
+        kropp = aapnet = open( myGeoJson, 'rb' )
+    else: 
+        kropp = myGeoJson 
+
+    if not gzip: 
+        return kropp, aapnet, { }
+    if isinstance( kropp, ( bytes, bytearray )): 
+        komprimering = zlib.compressobj( 6, zlib.DEFLATED, 31 )
+        return komprimering.compress( kropp ) + komprimering.flush(), aapnet, { 'Content-Encoding' : 'gzip' }
+    return _GzipKropp( kropp ), aapnet, { 'Content-Encoding' : 'gzip' }
+
+
+def lastOppGeojson( myGeoJson, kontrakt:str, filnavn:str, header_med_token:dict, destination='NVDB', apiUrl = 'https://datafangst-api-gateway.test.atlas.vegvesen.no/api/v2/', 
+                    klient=None, gzip=False, utm33=False, koordinatrapport=None ): 
     """
     Laster opp geojson på kontrakt. 
 
+    Filnavn, filobjekt og bytes sendes som de er, strømmet som request body uten å lese alt inn i minnet eller parse json. 
+
     ARGUMENTS
-        myGeoJson : dict, featureCollection med geojson features 
+        myGeoJson : dict (featureCollection med geojson features), filnavn til geojson-fil, filobjekt åpnet i binærmodus eller bytes 
 
         kontrakt : str, ID til kontrakten
 
         filnavn : str, filnavnet denne fila (featureCollection) skal ha
 
-        header_med_token : dict med http header informasjon, fås fra login-funksjon
-    """
+        header_med_token : dict med http header informasjon, fås fra login-funksjon, eller TokenHandterer. Kan være None hvis klienten har token 
 
-    geojson_as_str = json.dumps( myGeoJson )
+    KEYWORDS: 
+        klient : dfklient.DatafangstKlient, gjenbrukbar HTTP-sesjon med connection pool, se dfklient.df20Klient 
 
-    myHeaders = deepcopy( header_med_token )
-    myHeaders['Content-Type'] = 'application/geojson'
-    myHeaders['X-FILNAVN'] = filnavn
+        gzip : bool, default False. Komprimerer body underveis og sender med Content-Encoding: gzip 
 
-    params={'destination' : destination }
+        utm33 : bool, default False. Transformerer koordinatene til EPSG:25833 først, se koordinater.tilUtm33. Kun for dict 
 
-    url = apiUrl + 'kontrakter/' + kontrakt + '/filer/kropp'
+        koordinatrapport : dict, default None. Med utm33=True fylles den med rapporten fra koordinater.tilUtm33 
+                           (fra-CRS, metode, nøyaktighet i meter) 
 
-    r = requests.post( url, data=geojson_as_str, params=params, headers=myHeaders )
+    RETURNS 
+        True hvis opplastingen lyktes 
+    """
+
+    if utm33: 
+        myGeoJson, rapport = koordinater.forInnsending( myGeoJson )
+        if koordinatrapport is not None: 
+            koordinatrapport.update( rapport )
+    r = _postFil( myGeoJson, kontrakt, filnavn, header_med_token, destination, apiUrl, klient, gzip=gzip )
     if r.ok: 
         print( f"Fil {filnavn} lastet opp på kontrakt {kontrakt}")
     else: 
         print( f"Opplasting feiler: HTTP {r.status_code} {r.text}")
+    return r.ok 
 
 
-def godkjennFiler( kontrakt:str, filnavn:str, header_med_token:dict, apiUrl = 'https://datafangst-api-gateway.test.atlas.vegvesen.no/api/v2/' ): 
+def _postFil( myGeoJson, kontrakt:str, filnavn:str, header_med_token, destination:str, apiUrl:str, klient, gzip=False ): 
+    """
+    Selve opplastingen for lastOppGeojson og lastOppFiler. Returnerer requests.Response 
+    """
+    myHeaders = _kopierHeader( header_med_token )
+    myHeaders['Content-Type'] = 'application/geojson'
+    myHeaders['X-FILNAVN'] = filnavn
+
+    url = apiUrl + 'kontrakter/' + kontrakt + '/filer/kropp'
+
+    if klient is None: 
+        klient = dfklient.fellesKlient()
+    kropp, aapnet, ekstraHeadere = _kropp( myGeoJson, gzip=gzip )
+    myHeaders.update( ekstraHeadere )
+    try: 
+        return klient.post( url, data=kropp, params={'destination' : destination }, headers=myHeaders )
+    finally: 
+        if aapnet is not None: 
+            aapnet.close()
+
+
+def godkjennFiler( kontrakt:str, filnavn:str, header_med_token:dict, apiUrl = 'https://datafangst-api-gateway.test.atlas.vegvesen.no/api/v2/', klient=None ): 
     """
     Godkjenner fil(er) på kontrakt
 
     ARGUMENTS: 
         kontrakt : str, ID til kontrakten 
 
-        filnavn : str, filnavn på den eller de filen(e) som skal godkjennes (komma mellom filnavnene hvis det er flere)
+        filnavn : str, filnavn på den eller de filen(e) som skal godkjennes (komma mellom filnavnene hvis det er flere). Kan også være liste 
 
-        header_med_token : dict med http header informasjon, fås fra login-funksjonen
+        header_med_token : dict med http header informasjon, fås fra login-funksjonen, eller TokenHandterer. Kan være None hvis klienten har token 
 
     KEYWORDS: 
         apiurl : str, lenke til riktig API miljo 
+
+        klient : dfklient.DatafangstKlient, gjenbrukbar HTTP-sesjon med connection pool, se dfklient.df20Klient 
+
+    RETURNS 
+        True hvis godkjenningen lyktes 
     """
-    myHeaders = deepcopy( header_med_token )
+    myHeaders = _kopierHeader( header_med_token )
     myHeaders['Content-Type'] = 'application/json'
 
     url = apiUrl + 'kontrakter/' + kontrakt + '/filer/godkjenn'
-    payload = filnavn.split( ',')  # Blir til en liste med tekst. 
+    if isinstance( filnavn, str ): 
+        payload = filnavn.split( ',')  # Blir til en liste med tekst. 
+    else: 
+        payload = list( filnavn )
+        filnavn = ','.join( payload )
     payload = json.dumps( payload )
 
-    r = requests.patch( url, payload,  headers=myHeaders )
+    if klient is None: 
+        klient = dfklient.fellesKlient()
+    r = klient.patch( url, data=payload,  headers=myHeaders )
     if r.ok: 
         print( f"Godkjente filer: {filnavn} på kontrakt {kontrakt}")
     else: 
         print( f"Godkjenning av filer feiler: HTTP {r.status_code} {r.text}")
+    return r.ok 
+
+
+def _filliste( filer ): 
+    """
+    Mappe (str) blir til sortert liste med .geojson og .json - filer i mappen, ellers brukes filer som den er 
+    """
+    if isinstance( filer, str ) and os.path.isdir( filer ): 
+        return sorted( os.path.join( filer, x ) for x in os.listdir( filer ) if x.lower().endswith( ( '.geojson', '.json' )) )
+    if isinstance( filer, str ): 
+        return [ filer ]
+    return list( filer )
+
+
+def _lastOppFil( sti:str, kontrakt:str, header_med_token, destination:str, apiUrl:str, klient, gzip=False ): 
+    """
+    Laster opp én fil ved å strømme innholdet rett fra disk, uten å lese det inn som json. Returnerer resultat-dict 
+    """
+    filnavn = os.path.basename( sti )
+    resultat = { 'fil' : sti, 'filnavn' : filnavn, 'lastetOpp' : False, 'godkjent' : None, 'feil' : None }
+    t0 = time.monotonic()
+
+    try: 
+        r = _postFil( sti, kontrakt, filnavn, header_med_token, destination, apiUrl, klient, gzip=gzip )
+        if r.ok: 
+            resultat['lastetOpp'] = True 
+        else: 
+            resultat['feil'] = f"HTTP {r.status_code} {r.text[0:500]}"
+    except Exception as e: 
+        resultat['feil'] = str( e )
+
+    resultat['sekunder'] = round( time.monotonic() - t0, 2 )
+    return resultat 
+
+
+def lastOppFiler( filer, kontrakt:str, header_med_token, destination='NVDB', apiUrl = 'https://datafangst-api-gateway.test.atlas.vegvesen.no/api/v2/', 
+                    klient=None, maksParallelle=4, godkjenn=True, batchstorrelse=50, gzip=False ): 
+    """
+    Laster opp mange geojson-filer til kontrakten samtidig, og godkjenner dem i batcher etterpå 
+
+    Filene strømmes rett fra disk som request body, de blir ikke lest inn og parset. 
+
+    ARGUMENTS
+        filer : str (mappe eller ett filnavn) eller liste med filnavn. For en mappe lastes alle .geojson og .json filer opp 
+
+        kontrakt : str, ID til kontrakten
+
+        header_med_token : dict fra login, TokenHandterer eller None hvis klienten har token 
+
+    KEYWORDS 
+        destination, apiUrl, klient : som for lastOppGeojson. Bruk gjerne klient med poolstorrelse >= maksParallelle 
+
+        maksParallelle : int, default 4. Maks antall opplastinger samtidig 
+
+        godkjenn : bool, default True. Godkjenner filene som ble lastet opp 
+
+        batchstorrelse : int, default 50. Antall filer per godkjenning (ett PATCH-kall per batch) 
+
+        gzip : bool, default False. Komprimerer filene underveis, se lastOppGeojson 
+
+    RETURNS 
+        liste med ett resultat (dict) per fil: fil, filnavn, lastetOpp (bool), godkjent (bool, None hvis ikke forsøkt), feil, sekunder 
+    """
+    t0 = time.monotonic()
+    filer = _filliste( filer )
+
+    # Filnavnet på serveren er uten mappe, a/x.geojson og b/x.geojson ville overskrevet hverandre 
+    mapper = { }
+    for sti in filer: 
+        mapper.setdefault( os.path.basename( sti ), [] ).append( sti )
+    like = { navn : stier for navn, stier in mapper.items() if len( stier ) > 1 }
+    if like: 
+        raise ValueError( f"Flere filer har samme filnavn og ville overskrevet hverandre på serveren: {like}" )
+
+    if klient is None: 
+        klient = dfklient.fellesKlient()
+
+    print( f"Laster opp {len(filer)} filer til kontrakt {kontrakt}, inntil {maksParallelle} samtidig")
+    with ThreadPoolExecutor( max_workers=max( 1, maksParallelle )) as pool: 
+        resultater = list( pool.map( lambda sti: _lastOppFil( sti, kontrakt, header_med_token, destination, apiUrl, klient, gzip=gzip ), filer ))
+
+    for resultat in resultater: 
+        if not resultat['lastetOpp']: 
+            print( f"Opplasting av {resultat['fil']} feiler: {resultat['feil']}")
+    lastetOpp = [ x for x in resultater if x['lastetOpp'] ]
+    print( f"{len(lastetOpp)} av {len(filer)} filer lastet opp på kontrakt {kontrakt}")
+
+    if godkjenn: 
+        for start in range( 0, len( lastetOpp ), batchstorrelse ): 
+            batch = lastetOpp[start:start+batchstorrelse]
+            ok = godkjennFiler( kontrakt, [ x['filnavn'] for x in batch ], header_med_token, apiUrl=apiUrl, klient=klient )
+            for resultat in batch: 
+                resultat['godkjent'] = ok 
+
+    print( f"Tidsbruk totalt: {time.monotonic()-t0:.1f} sekund")
+    return resultater 
@@ -0,0 +1,421 @@
+"""
+Asyncio-klient for Datafangst 1.0 og 2.0, med samme funksjoner som df10 og df20 som korutiner
+
+For tjenester som allerede kjører asyncio slipper man å dytte hvert kall over i en tråd. AsyncDatafangstKlient holder
+én delt connection pool og en semafor som begrenser antall samtidige kall, og bruker samme RetryPolicy,
+DatafangstHttpFeil og dfmetrikk-hendelser som dfklient.DatafangstKlient.
+
+Med aiohttp installert gjøres kallene rett i event-loopen. Uten aiohttp gjøres hvert enkelt HTTP-forsøk med requests i
+en tråd (asyncio.to_thread), med felles requests.Session; ventetid mellom forsøk og begrensning av samtidighet skjer
+likevel i event-loopen. API'et er det samme.
+
+Eksempel
+    async with dfasync.AsyncDatafangstKlient( api=dfklient.DF10_API['PROD'], user='jajens', pw=pw, maksParallelle=16 ) as klient:
+        fcListe = await klient.alleFeaturecollections( kontrakt )
+        statuser = await asyncio.gather( *[ klient.sjekkstatusFeatureCollection( kontrakt, x['id'] ) for x in fcListe['featureCollections'] ] )
+
+    async with dfasync.AsyncDatafangstKlient( api=dfklient.DF20_API['TEST'] ) as klient:
+        await klient.login( 'jajens', pw, miljo='TEST' )
+        await klient.lastOppGeojson( minGeojson, kontrakt, 'fil.geojson' )
+        await klient.godkjennFiler( kontrakt, 'fil.geojson' )
+"""
+import asyncio
+import time
+from types import SimpleNamespace
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.auth import HTTPBasicAuth
+
+import df20
+import dfjson
+import dfklient
+import dfmetrikk
+import koordinater
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+
+class Respons:
+    """
+    Ferdig lest HTTP-respons fra aiohttp, med de feltene fra requests.Response som resten av biblioteket bruker
+    """
+    def __init__( self, metode:str, url:str, status_code:int, headers, content:bytes, reason=None ):
+        self.request = SimpleNamespace( method=metode )
+        self.url = url
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.reason = reason
+
+    @property
+    def ok( self ):
+        return self.status_code < 400
+
+    @property
+    def text( self ):
+        return self.content.decode( 'utf-8', errors='replace' )
+
+    def json( self ):
+        return dfjson.loads( self.content )
+
+    def close( self ):
+        pass
+
+
+def _somRequestsFeil( e ):
+    """
+    Oversetter aiohttp-unntak til requests-unntak, slik at RetryPolicy kan brukes som den er
+    """
+    if isinstance( e, aiohttp.ClientConnectorError ):
+        return requests.exceptions.ConnectionError( f"NewConnectionError: {e}" )
+    if isinstance( e, ( asyncio.TimeoutError, aiohttp.ServerTimeoutError )):
+        return requests.exceptions.ReadTimeout( str( e ) or 'timeout' )
+    return requests.exceptions.ConnectionError( str( e ))
+
+
+async def _asynkIterator( kropp ):
+    # Hver bit leses (og evt komprimeres, df20._GzipKropp) i egen tråd, så event-loopen ikke blokkeres
+    biter = iter( kropp )
+    slutt = object()
+    while True:
+        bit = await asyncio.to_thread( next, biter, slutt )
+        if bit is slutt:
+            return
+        yield bit
+
+
+class AsyncDatafangstKlient:
+    """
+    Asyncio-klient mot ett Datafangst-miljø. Brukes med async with, eller husk await klient.lukk()
+
+    KEYWORDS
+        api : str, rot-URL til API'et, f.eks dfklient.DF10_API['PROD'] eller dfklient.DF20_API['TEST']
+
+        user, pw : str, Basic Auth (DF1.0)
+
+        header_med_token : dict fra df20.login, eller tokenHandterer=df20.TokenHandterer (DF2.0). Se også login
+
+        poolstorrelse : int, default 10. Antall forbindelser i connection pool
+
+        maksParallelle : int, default poolstorrelse. Maks antall kall som er i gang samtidig
+
+        retry, timeout, lyttere : som dfklient.DatafangstKlient
+
+        brukAiohttp : None (default, aiohttp hvis installert), True eller False
+    """
+
+    def __init__( self, api=None, user=None, pw=None, header_med_token=None, tokenHandterer=None, poolstorrelse=10, maksParallelle=None,
+                    retry=None, timeout=( 10, 300 ), lyttere=None, brukAiohttp=None ):
+        if brukAiohttp and aiohttp is None:
+            raise ImportError( "brukAiohttp=True krever aiohttp (pip install aiohttp)" )
+        self.api = api
+        self.tokenHandterer = tokenHandterer
+        self.lyttere = list( lyttere or [] )
+        self.poolstorrelse = poolstorrelse
+        self.maksParallelle = maksParallelle or poolstorrelse
+        self.retry = retry if retry is not None else dfklient.RetryPolicy()
+        self.timeout = timeout
+        self.brukAiohttp = aiohttp is not None if brukAiohttp is None else brukAiohttp
+        self.auth = ( user, pw ) if isinstance( user, str ) and isinstance( pw, str ) else None
+        self.headers = { 'X-Client' : 'LtGlahn python' }
+        if header_med_token:
+            self.headers.update( header_med_token )
+        self._semafor = None
+        self._sesjon = None
+
+    def harInnlogging( self ):
+        return self.auth is not None or 'Authorization' in self.headers or self.tokenHandterer is not None
+
+    async def __aenter__( self ):
+        return self
+
+    async def __aexit__( self, *args ):
+        await self.lukk()
+
+    def _sesjonen( self ):
+        if self._semafor is None:
+            self._semafor = asyncio.Semaphore( self.maksParallelle )
+        if self._sesjon is None:
+            if self.brukAiohttp:
+                self._sesjon = aiohttp.ClientSession(
+                        connector=aiohttp.TCPConnector( limit=self.poolstorrelse ),
+                        timeout=aiohttp.ClientTimeout( sock_connect=self.timeout[0], sock_read=self.timeout[1] ),
+                        auth=aiohttp.BasicAuth( *self.auth ) if self.auth else None )
+            else:
+                self._sesjon = requests.Session()
+                adapter = HTTPAdapter( pool_connections=self.poolstorrelse, pool_maxsize=self.poolstorrelse )
+                self._sesjon.mount( 'https://', adapter )
+                self._sesjon.mount( 'http://', adapter )
+                if self.auth:
+                    self._sesjon.auth = HTTPBasicAuth( *self.auth )
+        return self._sesjon
+
+    async def lukk( self ):
+        if self._sesjon is not None:
+            if self.brukAiohttp:
+                await self._sesjon.close()
+            else:
+                self._sesjon.close()
+            self._sesjon = None
+
+    async def _forsok( self, metode:str, url:str, headers:dict, data, params, timeout ):
+        """
+        Ett enkelt HTTP-forsøk. Returnerer ferdig lest respons, nettverksfeil kommer som requests-unntak
+        """
+        sesjon = self._sesjonen()
+        if not self.brukAiohttp:
+            return await asyncio.to_thread( sesjon.request, metode, url, headers=headers, data=data, params=params, timeout=timeout )
+
+        if data is not None and not isinstance( data, ( bytes, bytearray, str )) and not hasattr( data, 'read' ):
+            data = _asynkIterator( data )
+        try:
+            async with sesjon.request( metode, url, headers=headers, data=data, params=params,
+                                       timeout=aiohttp.ClientTimeout( sock_connect=timeout[0], sock_read=timeout[1] )) as r:
+                innhold = await r.read()
+                return Respons( metode, str( r.url ), r.status, r.headers, innhold, reason=r.reason )
+        except ( aiohttp.ClientError, asyncio.TimeoutError ) as e:
+            raise _somRequestsFeil( e ) from e
+
+    async def _headere( self, headers, medToken:bool ):
+        alle = dict( self.headers )
+        if self.tokenHandterer is not None and medToken:
+            # TokenHandterer er synkron, og logger inn med requests hvis token må fornyes
+            alle.update( await asyncio.to_thread( self.tokenHandterer.header ))
+        alle.update( headers or { } )
+        return alle
+
+    async def request( self, metode:str, url:str, headers=None, data=None, json=None, params=None, retry=None, medToken=True ):
+        """
+        HTTP-kall med nye forsøk etter RetryPolicy, som dfklient.DatafangstKlient.request. json=dict sendes som data
+
+        RETURNS
+            Respons (eller requests.Response uten aiohttp), også når statuskoden er en feilkode
+        """
+        if json is not None:
+            data = dfjson.dumps( json )
+            headers = dict( headers or { } )
+            headers.setdefault( 'Content-Type', 'application/json' )
+
+        spol = dfklient._tilbakespoling( data )
+        alle = await self._headere( headers, medToken )
+        r = await self._request( metode, url, alle, data, params, retry )
+        if r.status_code == 401 and self.tokenHandterer is not None and medToken:
+            if spol is not None:
+                print( f"HTTP 401 fra {url}, henter nytt token og prøver på ny" )
+                await asyncio.to_thread( self.tokenHandterer.ugyldiggjor, alle.get( 'Authorization' ))
+                spol()
+                r = await self._request( metode, url, await self._headere( headers, medToken ), data, params, retry )
+        return r
+
+    async def _request( self, metode:str, url:str, headers:dict, data, params, retry ):
+        regel = retry if retry is not None else self.retry
+        spol = dfklient._tilbakespoling( data )
+        self._sesjonen()
+        t0 = time.monotonic()
+        forsok = 0
+        ventetid = 0
+        # Tiden i kø på semaforen regnes ikke med i sekunder, bare selve forsøkene og ventetiden mellom dem
+        iKall = 0
+        while True:
+            forsok += 1
+            r = None
+            unntak = None
+            async with self._semafor:
+                t1 = time.monotonic()
+                try:
+                    r = await self._forsok( metode, url, headers, data, params, regel.timeout( self.timeout, time.monotonic() - t0 ))
+                except requests.exceptions.RequestException as e:
+                    unntak = e
+                iKall += time.monotonic() - t1
+
+            if unntak is None and r.status_code not in regel.retryStatus:
+                break
+
+            if spol is None or not regel.kanGjenta( metode, forsok, respons=r, unntak=unntak ):
+                break
+
+            vent = regel.ventetid( forsok, respons=r )
+            if time.monotonic() - t0 + vent > regel.frist:
+                print( f"Gir opp {metode} {url} etter {forsok} forsøk, neste forsøk ville gått over fristen på {regel.frist} sekund")
+                break
+
+            if r is not None:
+                print( f"{metode}-kall feilet: HTTP {r.status_code} {r.text[0:500]}, prøver på ny om {vent:.1f} sekund")
+            else:
+                print( f"{metode}-kall feilet: {unntak}, prøver på ny om {vent:.1f} sekund")
+            await asyncio.sleep( vent )
+            ventetid += vent
+            spol()
+
+        if dfmetrikk.harLyttere( self ):
+            dfmetrikk.send( { 'type'      : 'http',
+                              'tidspunkt' : round( time.time(), 3 ),
+                              'metode'    : metode,
+                              'url'       : url,
+                              'endepunkt' : dfmetrikk.endepunkt( url ),
+                              'status'    : r.status_code if r is not None else None,
+                              'bytesUt'   : dfmetrikk.bytesUt( { 'data' : data } ),
+                              'bytesInn'  : dfmetrikk.bytesInn( r ),
+                              'sekunder'  : round( iKall + ventetid, 4 ),
+                              'forsok'    : forsok,
+                              'retries'   : forsok - 1,
+                              'ventetid'  : round( ventetid, 3 ),
+                              'feil'      : str( unntak ) if unntak is not None else None }, klient=self )
+
+        if unntak is not None:
+            raise dfklient.DatafangstHttpFeil( f"{metode} {url} feilet etter {forsok} forsøk: {unntak}",
+                                                url=url, metode=metode, forsok=forsok ) from unntak
+        return r
+
+    async def get( self, url:str, **kwargs ):
+        return await self.request( 'GET', url, **kwargs )
+
+    async def post( self, url:str, **kwargs ):
+        return await self.request( 'POST', url, **kwargs )
+
+    async def put( self, url:str, **kwargs ):
+        return await self.request( 'PUT', url, **kwargs )
+
+    async def patch( self, url:str, **kwargs ):
+        return await self.request( 'PATCH', url, **kwargs )
+
+    def _api( self, api ):
+        api = api or self.api
+        if not api:
+            raise ValueError( "Mangler api, oppgi api= til klienten eller funksjonen" )
+        return api
+
+    # ---------------------------------------------------------------- Datafangst 1.0, se df10
+
+    async def get_data( self, url:str, geojson=False ):
+        """
+        Som df10.get_data
+        """
+        headers = { 'Content-Type' : 'application/geo+json', 'Accept' : 'application/geo+json' if geojson else 'application/json' }
+        r = await self.get( url, headers=headers )
+        if r.ok:
+            return dfjson.loads( r.content )
+        raise dfklient.DatafangstHttpFeil.fraRespons( r, melding='GET-kall feilet' )
+
+    async def alleKontrakter( self, url=None ):
+        """
+        Som df10.alleKontrakter
+        """
+        return await self.get_data( self._api( url ))
+
+    async def alleFeaturecollections( self, contractId:str, api=None ):
+        """
+        Som df10.alleFeaturecollections
+        """
+        return await self.get_data( self._api( api ) + contractId + '/featurecollection' )
+
+    async def sjekkstatusFeatureCollection( self, contractId:str, featurecollectionId:str, api=None ):
+        """
+        Som df10.sjekkstatusFeatureCollection, returnerer statusinformasjon (dict)
+        """
+        return await self.get_data( self._api( api ) + contractId + '/featurecollection/' + featurecollectionId + '/status' )
+
+    async def sjekkResponsStatus( self, DF10Respons:dict ):
+        """
+        Som df10.sjekkResponsStatus: følger status-lenken i responsen fra postFeatureCollection / putFeatureCollection
+        """
+        statusElement = [ x for x in DF10Respons.get( 'resources' ) or [] if x.get( 'rel' ) == 'status' and 'src' in x ]
+        if not statusElement:
+            raise ValueError( f"Finner ikke statuselement i responsen for {DF10Respons.get( 'featureCollectionId' )}" )
+        return await self.get_data( statusElement[0]['src'] )
+
+    async def _sendFeatureCollection( self, metode:str, url:str, contractId:str, data:dict, utm33:bool ):
+        rapport = None
+        if utm33:
+            data, rapport = await asyncio.to_thread( koordinater.forInnsending, data )
+        headers = { 'Content-Type' : 'application/geo+json', 'Accept' : 'application/json' }
+        r = await self.request( metode, url, headers=headers, data=dfjson.dumps( data ))
+        if r.ok:
+            apiRespons = dfjson.loads( r.content )
+            if rapport is not None:
+                apiRespons['koordinatrapport'] = rapport
+            print( f"Vellykket innsending av geojson på kontrakt {contractId} HTTP {metode.lower()} {r.status_code}, FeatureCollection ID: {apiRespons['featureCollectionId']}" )
+            return apiRespons
+        print( f"Innsending av geojson http {metode} feilet {r.status_code} {r.text[0:500]}")
+        raise dfklient.DatafangstHttpFeil.fraRespons( r, melding='Innsending av geojson feilet' )
+
+    async def postFeatureCollection( self, contractId:str, data:dict, api=None, utm33=False ):
+        """
+        Som df10.postFeatureCollection
+        """
+        return await self._sendFeatureCollection( 'POST', self._api( api ) + contractId + '/featurecollection', contractId, data, utm33 )
+
+    async def putFeatureCollection( self, contractId:str, featureCollectionID:str, data:dict, api=None, utm33=False ):
+        """
+        Som df10.putFeatureCollection
+        """
+        return await self._sendFeatureCollection( 'PUT', self._api( api ) + contractId + '/featurecollection/' + featureCollectionID,
+                                                    contractId, data, utm33 )
+
+    # ---------------------------------------------------------------- Datafangst 2.0, se df20
+
+    async def login( self, username:str, pw:str, brukertype='ANSATT', miljo='TEST', authapi=None ):
+        """
+        Som df20.login. Token-headeren legges på klienten og brukes i alle senere kall
+
+        RETURNS
+            http header med token, eller None hvis innloggingen feilet
+        """
+        authapi = authapi or df20._authapi( miljo )
+        r = await self.post( authapi, json={ 'brukernavn' : username, 'brukertype' : brukertype, 'passord' : pw }, medToken=False )
+        if not r.ok:
+            print( f"Innlogging feilet: http {r.status_code} {r.text}" )
+            return None
+        print( "SUKSESS, vi er logget inn")
+        # MERK MELLOMROM mellom 'Bearer' og id_token
+        df_headers = { 'X-Client': 'LtGlahn python', 'Authorization' : 'Bearer' + ' ' + dfjson.loads( r.content )['id_token'] }
+        self.headers.update( df_headers )
+        return df_headers
+
+    async def lastOppGeojson( self, myGeoJson, kontrakt:str, filnavn:str, destination='NVDB', apiUrl=None, gzip=False, utm33=False,
+                                koordinatrapport=None ):
+        """
+        Som df20.lastOppGeojson. myGeoJson kan være dict, filnavn, filobjekt eller bytes
+
+        RETURNS
+            True hvis opplastingen lyktes
+        """
+        if utm33:
+            myGeoJson, rapport = await asyncio.to_thread( koordinater.forInnsending, myGeoJson )
+            if koordinatrapport is not None:
+                koordinatrapport.update( rapport )
+        url = self._api( apiUrl ) + 'kontrakter/' + kontrakt + '/filer/kropp'
+        headers = { 'Content-Type' : 'application/geojson', 'X-FILNAVN' : filnavn }
+        kropp, aapnet, ekstraHeadere = df20._kropp( myGeoJson, gzip=gzip )
+        headers.update( ekstraHeadere )
+        try:
+            r = await self.post( url, data=kropp, params={ 'destination' : destination }, headers=headers )
+        finally:
+            if aapnet is not None:
+                aapnet.close()
+        if r.ok:
+            print( f"Lastet opp {filnavn} til kontrakt {kontrakt}" )
+        else:
+            print( f"Opplasting av {filnavn} feilet: HTTP {r.status_code} {r.text[0:500]}" )
+        return r.ok
+
+    async def godkjennFiler( self, kontrakt:str, filnavn, apiUrl=None ):
+        """
+        Som df20.godkjennFiler. filnavn er kommaseparert tekst eller liste
+
+        RETURNS
+            True hvis godkjenningen lyktes
+        """
+        payload = filnavn.split( ',' ) if isinstance( filnavn, str ) else list( filnavn )
+        url = self._api( apiUrl ) + 'kontrakter/' + kontrakt + '/filer/godkjenn'
+        r = await self.patch( url, data=dfjson.dumps( payload ), headers={ 'Content-Type' : 'application/json' } )
+        if r.ok:
+            print( f"Godkjente filer: {','.join( payload )} på kontrakt {kontrakt}")
+        else:
+            print( f"Godkjenning av filer feiler: HTTP {r.status_code} {r.text}")
+        return r.ok
+
@@ -0,0 +1,139 @@
+"""
+Felles JSON-lag med raskeste tilgjengelige backend: orjson, msgspec eller standardbiblioteket json
+
+Parsing og serialisering av store featureCollections og datakatalogen er det som koster mest CPU. orjson
+og msgspec er flere ganger raskere enn json, og koder rett til UTF-8 bytes (det vi uansett sender over
+nettet). Uten noen av dem brukes json, med samme resultat. Backend velges automatisk ved import, eller med
+velgBackend (f.eks for å sammenligne, se benchmark/jsonBenchmark.py), eller miljøvariabelen DATAFANGST_JSON.
+
+dumps gir alltid kompakt JSON uten ASCII-escaping, som json.dumps( ..., ensure_ascii=False, separators=(',', ':') ).
+Innrykk (indent=4) lager vi fortsatt med json, det støtter ikke orjson.
+
+Verdier som rask backend ikke takler (NaN i input, heltall over 64 bit, ukjente typer) går automatisk via json.
+NaN og Infinity skrives som null av alle backender (orjson og msgspec gjør det selv, json gjør vi likt), så
+resultatet er gyldig JSON og uavhengig av hva som er installert. Ved lesing godtas NaN og Infinity fortsatt.
+
+Eksempel
+    data = dfjson.loads( r.content )
+    klient.post( url, data=dfjson.dumps( data ), headers=... )
+"""
+import json
+import math
+import os
+
+BACKENDER = ( 'orjson', 'msgspec', 'json' )
+
+BACKEND = None
+_loads = None
+_dumps = None
+_feil = ( ValueError, TypeError, OverflowError )
+
+
+def _jsonLoads( data ):
+    return json.loads( data )
+
+
+def _utenNaN( obj ):
+    """
+    Kopi der NaN og Infinity er byttet ut med None, som orjson og msgspec gjør
+    """
+    if isinstance( obj, float ):
+        return obj if math.isfinite( obj ) else None
+    if isinstance( obj, dict ):
+        return { navn : _utenNaN( verdi ) for navn, verdi in obj.items() }
+    if isinstance( obj, ( list, tuple )):
+        return [ _utenNaN( verdi ) for verdi in obj ]
+    return obj
+
+
+def _jsonDumps( obj ):
+    try:
+        tekst = json.dumps( obj, ensure_ascii=False, separators=( ',', ':' ), allow_nan=False )
+    except ValueError:
+        # Sjelden: bare data med NaN eller Infinity går den langsomme veien
+        tekst = json.dumps( _utenNaN( obj ), ensure_ascii=False, separators=( ',', ':' ), allow_nan=False )
+    return tekst.encode( 'utf-8' )
+
+
+def velgBackend( navn=None ):
+    """
+    Velger JSON-backend. navn=None gir den raskeste som er installert
+
+    RETURNS
+        navnet på backend som er i bruk
+    """
+    global BACKEND, _loads, _dumps, _feil
+    kandidater = BACKENDER if navn is None else ( navn, )
+    for kandidat in kandidater:
+        if kandidat == 'orjson':
+            try:
+                import orjson
+            except ImportError:
+                if navn is not None:
+                    raise
+                continue
+            _loads, _dumps = orjson.loads, orjson.dumps
+            _feil = ( ValueError, TypeError, OverflowError )
+        elif kandidat == 'msgspec':
+            try:
+                import msgspec
+            except ImportError:
+                if navn is not None:
+                    raise
+                continue
+            _loads, _dumps = msgspec.json.decode, msgspec.json.Encoder().encode
+            _feil = ( ValueError, TypeError, OverflowError, msgspec.DecodeError, msgspec.EncodeError )
+        elif kandidat == 'json':
+            _loads, _dumps = _jsonLoads, _jsonDumps
+            _feil = ( ValueError, TypeError, OverflowError )
+        else:
+            raise ValueError( f"Ukjent JSON-backend {kandidat}, må være en av {BACKENDER}" )
+        BACKEND = kandidat
+        return BACKEND
+
+
+def loads( data ):
+    """
+    Parser JSON fra bytes eller str
+    """
+    try:
+        return _loads( data )
+    except _feil:
+        if BACKEND == 'json':
+            raise
+        # json godtar bl.a NaN og Infinity, som datafangst-data av og til har
+        return json.loads( data )
+
+
+def dumps( obj ):
+    """
+    Kompakt JSON som UTF-8 bytes
+    """
+    try:
+        return _dumps( obj )
+    except _feil:
+        if BACKEND == 'json':
+            raise
+        return _jsonDumps( obj )
+
+
+def dumpsTekst( obj ):
+    """
+    Som dumps, men returnerer str
+    """
+    return dumps( obj ).decode( 'utf-8' )
+
+
+def lesRespons( r ):
+    """
+    Parser JSON fra requests.Response, raskere enn r.json() for store svar
+    """
+    return loads( r.content )
+
+
+def lesFil( filnavn:str ):
+    with open( filnavn, 'rb' ) as fp:
+        return loads( fp.read() )
+
+
+velgBackend( os.environ.get( 'DATAFANGST_JSON' ) or None )
@@ -0,0 +1,510 @@
+"""
+Felles HTTP-lag for df10 og df20.
+
+En DatafangstKlient holder en requests.Session med connection pool og keep-alive, slik at gjentatte kall
+mot samme server slipper ny TCP+TLS-handshake hver gang. Lag en klient per miljø og send den inn som
+klient=... til funksjonene i df10 og df20. Uten klient brukes en felles, delt klient uten innlogging.
+
+Klienten prøver på ny ved forbigående feil etter en RetryPolicy (eksponentiell backoff med jitter, 
+respekterer Retry-After og har en absolutt tidsfrist). Gir den opp kommer DatafangstHttpFeil. 
+
+Hvert kall sender en hendelse med endepunkt, status, bytes, tidsbruk og antall forsøk til lytterne i dfmetrikk. 
+
+Med begrenser=Hastighetsbegrenser(...) deler mange tråder og klienter én grense for kall per sekund og samtidige 
+kall per server. 
+"""
+import threading
+import random
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from requests.auth import HTTPBasicAuth
+
+import dfmetrikk
+
+# Datafangst 1.0 (gamle datafangst)
+DF10_API = { 'PROD' : 'https://datafangst.vegvesen.no/api/v1/contract/' }
+
+# Datafangst 2.0 (nye datafangst)
+DF20_API = { 'TEST' : 'https://datafangst-api-gateway.test.atlas.vegvesen.no/api/v2/',
+             'PROD' : 'https://datafangst-api-gateway.atlas.vegvesen.no/api/v2/',
+             'UTV'  : 'https://datafangst-api-gateway.utv.atlas.vegvesen.no/api/v2/' }
+
+_miljoAlias = { 'ATM' : 'TEST', 'PRODUKSJON' : 'PROD', 'STM' : 'UTV', 'UTVIKLING' : 'UTV' }
+
+
+def _finnApi( miljo:str, apiListe:dict ):
+    miljo = _miljoAlias.get( miljo.upper(), miljo.upper() )
+    if miljo not in apiListe:
+        raise NotImplementedError(f"Har ikke implementert støtte for miljø {miljo} ennå")
+    return apiListe[miljo]
+
+
+class DatafangstHttpFeil( Exception ):
+    """
+    HTTP-kall mot Datafangst feilet, eventuelt etter at RetryPolicy har gitt opp 
+
+    Attributter: status_code (None ved nettverksfeil), url, metode, forsok (antall forsøk) og respons (requests.Response eller None)
+    """
+    def __init__( self, melding:str, status_code=None, url=None, metode=None, forsok=1, respons=None ):
+        super().__init__( melding )
+        self.status_code = status_code
+        self.url = url
+        self.metode = metode
+        self.forsok = forsok
+        self.respons = respons
+
+    @classmethod
+    def fraRespons( cls, r, melding='HTTP-kall feilet', forsok=1 ):
+        return cls( f"{melding}: {r.request.method} {r.url} HTTP {r.status_code} {r.text[0:500]}",
+                    status_code=r.status_code, url=r.url, metode=r.request.method, forsok=forsok, respons=r )
+
+
+class RetryPolicy:
+    """
+    Regler for når og hvor lenge et HTTP-kall skal prøves på ny 
+
+    KEYWORDS
+        maksForsok : int, default 5. Totalt antall forsøk, inkludert det første. maksForsok=1 slår av nye forsøk
+
+        basisVentetid : float, default 0.5 sekund. Ventetid før andre forsøk, dobles for hvert nye forsøk
+
+        maksVentetid : float, default 30 sekund. Øvre grense for én enkelt ventetid
+
+        jitter : bool, default True. Tilfeldig ventetid mellom 0 og beregnet backoff ("full jitter"), slik at 
+                 mange parallelle klienter ikke treffer serveren i takt 
+
+        frist : float, default 120 sekund. Absolutt tidsfrist fra første forsøk. Vi venter aldri forbi fristen, og timeout
+                for hvert forsøk begrenses til tiden som er igjen (se timeout)
+
+        retryStatus : HTTP statuskoder som regnes som forbigående
+
+        retryPost : bool, default False. POST er ikke idempotent (et nytt forsøk kan gi dobbel innsending), og 
+                    prøves derfor kun på ny når serveren beviselig ikke behandlet kallet: nettverksfeil før 
+                    forbindelsen ble opprettet, 429 eller 503. Sett retryPost=True for å behandle POST som PUT
+    """
+
+    idempotente = ( 'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE' )
+    ikkeBehandlet = ( 429, 503 )
+
+    def __init__( self, maksForsok=5, basisVentetid=0.5, maksVentetid=30, jitter=True, frist=120,
+                  retryStatus=( 429, 500, 502, 503, 504 ), retryPost=False ):
+        self.maksForsok = maksForsok
+        self.basisVentetid = basisVentetid
+        self.maksVentetid = maksVentetid
+        self.jitter = jitter
+        self.frist = frist
+        self.retryStatus = set( retryStatus )
+        self.retryPost = retryPost
+
+    def kanGjenta( self, metode:str, forsok:int, respons=None, unntak=None ):
+        """
+        True hvis kallet kan prøves på ny etter forsok antall forsøk 
+        """
+        if forsok >= self.maksForsok:
+            return False
+
+        idempotent = metode.upper() in self.idempotente or self.retryPost
+
+        if unntak is not None:
+            if isinstance( unntak, requests.exceptions.ConnectTimeout ):
+                return True
+            if not isinstance( unntak, ( requests.exceptions.ConnectionError, requests.exceptions.Timeout )):
+                return False
+            if idempotent:
+                return True
+            # Uten respons vet vi ikke om en POST kom fram, med mindre forbindelsen aldri ble opprettet
+            return 'NewConnectionError' in repr( unntak ) or 'NameResolutionError' in repr( unntak )
+
+        if respons is None or respons.status_code not in self.retryStatus:
+            return False
+
+        return idempotent or respons.status_code in self.ikkeBehandlet
+
+    def timeout( self, timeout, brukt:float ):
+        """
+        timeout (sekund eller ( connect, read )) for neste forsøk, begrenset til det som er igjen av fristen etter brukt sekunder.
+        Read timeout i requests gjelder hver lesing fra socketen, så et forsøk som henger stopper ved fristen, mens en
+        overføring som går jevnt kan fortsette
+        """
+        igjen = max( self.frist - brukt, 0.001 )
+        if timeout is None:
+            return igjen
+        if isinstance( timeout, ( tuple, list )):
+            return tuple( igjen if x is None else min( x, igjen ) for x in timeout )
+        return min( timeout, igjen )
+
+    def ventetid( self, forsok:int, respons=None ):
+        """
+        Sekunder vi skal vente før neste forsøk. Retry-After fra serveren går foran egen backoff 
+        """
+        if respons is not None and 'Retry-After' in respons.headers:
+            retryAfter = _lesRetryAfter( respons.headers['Retry-After'] )
+            if retryAfter is not None:
+                return retryAfter
+
+        backoff = min( self.maksVentetid, self.basisVentetid * 2 ** ( forsok - 1 ))
+        if self.jitter:
+            return random.uniform( 0, backoff )
+        return backoff
+
+
+def _lesRetryAfter( verdi:str ):
+    """
+    Retry-After kan være antall sekunder eller en HTTP-dato
+    """
+    verdi = verdi.strip()
+    if verdi.isdigit():
+        return float( verdi )
+    try:
+        tidspunkt = parsedate_to_datetime( verdi )
+    except ( TypeError, ValueError ):
+        return None
+    if tidspunkt.tzinfo is None:
+        tidspunkt = tidspunkt.replace( tzinfo=timezone.utc )
+    return max( 0.0, ( tidspunkt - datetime.now( timezone.utc )).total_seconds() )
+
+
+INGEN_RETRY = RetryPolicy( maksForsok=1 )
+
+
+def _tilbakespoling( data ):
+    """
+    Funksjon som spoler request-body tilbake før et nytt forsøk, eller None hvis body ikke kan sendes på nytt (generator o.l.)
+    """
+    if data is None or isinstance( data, ( str, bytes, bytearray, dict, list, tuple )):
+        return lambda: None
+    if hasattr( data, 'seek' ) and hasattr( data, 'tell' ):
+        try:
+            posisjon = data.tell()
+        except ( OSError, ValueError ):
+            return None
+        return lambda: data.seek( posisjon )
+    if hasattr( data, '__iter__' ) and iter( data ) is not data:
+        # Itererbart objekt som lager ny iterator for hvert forsøk, f.eks df20._GzipKropp
+        return lambda: None
+    return None
+
+
+class Hastighetsbegrenser:
+    """
+    Felles grense for antall kall per sekund og antall samtidige kall, per server (host)
+
+    Deles av alle tråder (og klienter) som får den inn som begrenser=..., slik at en stor jobb med mange tråder
+    ikke overbelaster serveren. Kallene slippes til med jevn avstand (1/perSekund sekund), og maks maksSamtidige
+    kall kan være i gang samtidig mot samme server. Strømmende responser (stream=True) holder på plassen sin
+    til responsen lukkes.
+
+    KEYWORDS
+        perSekund : float, maks antall kall som startes per sekund per server. None (default) gir ingen grense
+
+        maksSamtidige : int, maks antall samtidige kall per server. None (default) gir ingen grense
+    """
+
+    def __init__( self, perSekund=None, maksSamtidige=None ):
+        if perSekund is not None and perSekund <= 0:
+            raise ValueError( f"perSekund må være større enn 0, ikke {perSekund}" )
+        if maksSamtidige is not None and maksSamtidige < 1:
+            raise ValueError( f"maksSamtidige må være minst 1, ikke {maksSamtidige}" )
+        self.perSekund = perSekund
+        self.maksSamtidige = maksSamtidige
+        self._laas = threading.Lock()
+        self._servere = { }
+
+    def _server( self, host:str ):
+        with self._laas:
+            server = self._servere.get( host )
+            if server is None:
+                semafor = threading.BoundedSemaphore( self.maksSamtidige ) if self.maksSamtidige else None
+                server = self._servere[host] = { 'semafor' : semafor, 'neste' : 0.0, 'kall' : 0, 'ventetid' : 0.0 }
+            return server
+
+    def ta( self, url:str ):
+        """
+        Venter til kall mot serveren i url er tillatt. Returnerer funksjon som gir plassen tilbake (trygg å kalle flere ganger)
+        """
+        server = self._server( urlsplit( url ).netloc )
+        t0 = time.monotonic()
+        if server['semafor'] is not None:
+            server['semafor'].acquire()
+
+        if self.perSekund:
+            with self._laas:
+                naa = time.monotonic()
+                start = max( naa, server['neste'] )
+                server['neste'] = start + 1.0 / self.perSekund
+            if start > naa:
+                time.sleep( start - naa )
+
+        with self._laas:
+            server['kall'] += 1
+            server['ventetid'] += time.monotonic() - t0
+
+        if server['semafor'] is None:
+            return lambda: None
+
+        sluppet = [ False ]
+        def slipp( ):
+            with self._laas:
+                if sluppet[0]:
+                    return
+                sluppet[0] = True
+            server['semafor'].release()
+        return slipp
+
+    def statistikk( self ):
+        """
+        dict host => antall kall og samlet ventetid (sekund) i begrenseren
+        """
+        with self._laas:
+            return { host : { 'kall' : server['kall'], 'ventetid' : round( server['ventetid'], 3 ) } for host, server in self._servere.items() }
+
+
+def _slippVedLukking( r, slipp ):
+    """
+    Strømmende respons holder plassen i begrenseren til den lukkes (også via with ... as r)
+    """
+    lukk = r.close
+    def close( ):
+        try:
+            lukk()
+        finally:
+            slipp()
+    r.close = close
+
+
+class DatafangstKlient:
+    """
+    Gjenbrukbar HTTP-sesjon (connection pool, keep-alive) mot ett Datafangst-miljø
+
+    ARGUMENTS
+        N/A
+
+    KEYWORDS
+        api : str, rot-URL til API'et klienten skal snakke med. Kun til informasjon og som default for funksjoner som trenger det
+
+        user, pw : str, brukernavn og passord for Basic Auth (DF1.0). Settes én gang på sesjonen
+
+        header_med_token : dict med http header fra df20.login (DF2.0). Legges på alle kall
+
+        poolstorrelse : int, default 10. Antall gjenbrukbare forbindelser per server. Bør være minst like
+                        stort som antall tråder som bruker klienten samtidig.
+
+        retry : RetryPolicy, default RetryPolicy(). Bruk dfklient.INGEN_RETRY for å slå av nye forsøk
+
+        timeout : (connect, read) timeout i sekunder for hvert enkelt kall, default (10, 300)
+
+        tokenHandterer : df20.TokenHandterer. Gir gyldig token til hvert kall (fornyes før det går ut), og ved 
+                         HTTP 401 hentes nytt token og kallet prøves én gang til
+
+        lyttere : liste med funksjoner som får en hendelse (dict) for hvert kall, f.eks dfmetrikk.Metrikker(). 
+                  Kommer i tillegg til globale lyttere, se dfmetrikk
+
+        begrenser : Hastighetsbegrenser, felles grense for kall per sekund og samtidige kall per server. Gjelder 
+                    hvert enkelt forsøk, også nye forsøk etter RetryPolicy
+    """
+
+    def __init__( self, api=None, user=None, pw=None, header_med_token=None, poolstorrelse=10, retry=None, timeout=( 10, 300 ), tokenHandterer=None,
+                    lyttere=None, begrenser=None ):
+        self.api = api
+        self.begrenser = begrenser
+        self.tokenHandterer = tokenHandterer
+        self.lyttere = list( lyttere or [] )
+        self.poolstorrelse = poolstorrelse
+        self.retry = retry if retry is not None else RetryPolicy()
+        self.timeout = timeout
+        self.sesjon = requests.Session()
+        adapter = HTTPAdapter( pool_connections=poolstorrelse, pool_maxsize=poolstorrelse )
+        self.sesjon.mount( 'https://', adapter )
+        self.sesjon.mount( 'http://', adapter )
+        self.sesjon.headers.update( { 'X-Client' : 'LtGlahn python' } )
+
+        if isinstance( user, str) and isinstance( pw, str):
+            self.sesjon.auth = HTTPBasicAuth( user, pw )
+
+        if header_med_token:
+            self.sesjon.headers.update( header_med_token )
+
+    def harInnlogging( self ):
+        """
+        True hvis sesjonen har brukernavn/passord eller token, og kallene kan gjøres uten å spørre etter passord
+        """
+        return self.sesjon.auth is not None or 'Authorization' in self.sesjon.headers or self.tokenHandterer is not None
+
+    def request( self, metode:str, url:str, retry=None, medToken=True, **kwargs ):
+        """
+        Gjør HTTP-kall med nye forsøk etter RetryPolicy. 
+
+        Returnerer requests.Response, også når statuskoden er en feilkode (siste forsøk). Nettverksfeil
+        som ikke kan eller ikke lenger skal prøves på ny gir DatafangstHttpFeil. 
+
+        medToken=False gjør kallet uten token fra tokenHandterer (brukes av selve innloggingen)
+        """
+        if self.tokenHandterer is not None and medToken:
+            spol = _tilbakespoling( kwargs.get( 'data' ))
+            medToken = self._medToken( kwargs )
+            r = self._request( metode, url, retry=retry, **medToken )
+            if r.status_code != 401 or spol is None:
+                return r
+            print( f"HTTP 401 fra {url}, henter nytt token og prøver på ny" )
+            r.close()
+            self.tokenHandterer.ugyldiggjor( medToken['headers'].get( 'Authorization' ))
+            spol()
+            return self._request( metode, url, retry=retry, **self._medToken( kwargs ))
+
+        return self._request( metode, url, retry=retry, **kwargs )
+
+    def _medToken( self, kwargs:dict ):
+        kwargs = dict( kwargs )
+        headers = dict( kwargs.get( 'headers' ) or { } )
+        headers.update( self.tokenHandterer.header() )
+        kwargs['headers'] = headers
+        return kwargs
+
+    def _request( self, metode:str, url:str, retry=None, **kwargs ):
+        regel = retry if retry is not None else self.retry
+        timeout = kwargs.pop( 'timeout', self.timeout )
+        spol = _tilbakespoling( kwargs.get( 'data' ))
+        t0 = time.monotonic()
+        forsok = 0
+        ventetid = 0
+        while True:
+            forsok += 1
+            r = None
+            unntak = None
+            slipp = self.begrenser.ta( url ) if self.begrenser is not None else None
+            try:
+                r = self.sesjon.request( metode, url, timeout=regel.timeout( timeout, time.monotonic() - t0 ), **kwargs )
+            except requests.exceptions.RequestException as e:
+                unntak = e
+            finally:
+                if slipp is not None:
+                    if r is not None and kwargs.get( 'stream' ):
+                        _slippVedLukking( r, slipp )
+                    else:
+                        slipp()
+
+            if unntak is None and r.status_code not in regel.retryStatus:
+                break
+
+            if spol is None or not regel.kanGjenta( metode, forsok, respons=r, unntak=unntak ):
+                break
+
+            vent = regel.ventetid( forsok, respons=r )
+            if time.monotonic() - t0 + vent > regel.frist:
+                print( f"Gir opp {metode} {url} etter {forsok} forsøk, neste forsøk ville gått over fristen på {regel.frist} sekund")
+                break
+
+            if r is not None:
+                print( f"{metode}-kall feilet: HTTP {r.status_code} {r.text[0:500]}, prøver på ny om {vent:.1f} sekund")
+                r.close()
+            else:
+                print( f"{metode}-kall feilet: {unntak}, prøver på ny om {vent:.1f} sekund")
+            time.sleep( vent )
+            ventetid += vent
+            spol()
+
+        if dfmetrikk.harLyttere( self ):
+            dfmetrikk.send( { 'type'      : 'http',
+                              'tidspunkt' : round( time.time(), 3 ),
+                              'metode'    : metode,
+                              'url'       : url,
+                              'endepunkt' : dfmetrikk.endepunkt( url ),
+                              'status'    : r.status_code if r is not None else None,
+                              'bytesUt'   : dfmetrikk.bytesUt( kwargs ),
+                              'bytesInn'  : dfmetrikk.bytesInn( r, strom=kwargs.get( 'stream', False )),
+                              'sekunder'  : round( time.monotonic() - t0, 4 ),
+                              'forsok'    : forsok,
+                              'retries'   : forsok - 1,
+                              'ventetid'  : round( ventetid, 3 ),
+                              'feil'      : str( unntak ) if unntak is not None else None }, klient=self )
+
+        if unntak is not None:
+            raise DatafangstHttpFeil( f"{metode} {url} feilet etter {forsok} forsøk: {unntak}",
+                                        url=url, metode=metode, forsok=forsok ) from unntak
+        return r
+
+    def get( self, url:str, **kwargs ):
+        return self.request( 'GET', url, **kwargs )
+
+    def post( self, url:str, **kwargs ):
+        return self.request( 'POST', url, **kwargs )
+
+    def put( self, url:str, **kwargs ):
+        return self.request( 'PUT', url, **kwargs )
+
+    def patch( self, url:str, **kwargs ):
+        return self.request( 'PATCH', url, **kwargs )
+
+    def lukk( self ):
+        self.sesjon.close()
+
+    def __enter__( self ):
+        return self
+
+    def __exit__( self, *args ):
+        self.lukk()
+
+
+def df10Klient( miljo='PROD', user=None, pw=None, poolstorrelse=10, lyttere=None, begrenser=None ):
+    """
+    Lager klient mot gamle datafangst (DF1.0) med Basic Auth på sesjonen
+
+    KEYWORDS
+        miljo : str, default 'PROD'
+
+        user, pw : str, brukernavn og passord. Kan utelates, da må du oppgi dem til hver funksjon du kaller
+
+        poolstorrelse : int, default 10. Se DatafangstKlient
+
+        lyttere : liste med lyttere for målinger, se DatafangstKlient og dfmetrikk
+
+        begrenser : Hastighetsbegrenser, se DatafangstKlient
+
+    RETURNS
+        DatafangstKlient
+    """
+    return DatafangstKlient( api=_finnApi( miljo, DF10_API), user=user, pw=pw, poolstorrelse=poolstorrelse, lyttere=lyttere, begrenser=begrenser )
+
+
+def df20Klient( header_med_token=None, miljo='TEST', poolstorrelse=10, tokenHandterer=None, lyttere=None, begrenser=None ):
+    """
+    Lager klient mot nye datafangst (DF2.0) med token-header fra df20.login på sesjonen
+
+    KEYWORDS
+        header_med_token : dict, fås fra df20.login
+
+        tokenHandterer : df20.TokenHandterer. Bedre enn header_med_token for lange jobber, token fornyes automatisk
+
+        miljo : str, default 'TEST'
+
+        poolstorrelse : int, default 10. Se DatafangstKlient
+
+        lyttere : liste med lyttere for målinger, se DatafangstKlient og dfmetrikk
+
+        begrenser : Hastighetsbegrenser, se DatafangstKlient
+
+    RETURNS
+        DatafangstKlient
+    """
+    return DatafangstKlient( api=_finnApi( miljo, DF20_API), header_med_token=header_med_token, poolstorrelse=poolstorrelse,
+                                tokenHandterer=tokenHandterer, lyttere=lyttere, begrenser=begrenser )
+
+
+_fellesKlient = None
+_fellesLaas = threading.Lock()
+
+def fellesKlient( ):
+    """
+    Delt klient uten innlogging som brukes når funksjonene i df10 og df20 kalles uten klient=...
+
+    Gjør at også gamle skript får gjenbruk av forbindelser uten å endre noe.
+    """
+    global _fellesKlient
+    with _fellesLaas:
+        if _fellesKlient is None:
+            _fellesKlient = DatafangstKlient( poolstorrelse=20 )
+    return _fellesKlient
@@ -0,0 +1,288 @@
+"""
+Målinger av HTTP-kall mot datafangst: endepunkt, metode, status, bytes, tidsbruk, nye forsøk og ventetid på validering
+
+Hvert kall gjennom en dfklient.DatafangstKlient (og dermed alle funksjonene i df10 og df20) sender en hendelse
+(dict) til lytterne som er registrert, enten globalt med leggTilLytter eller på klienten med lyttere=[...].
+statuspoller sender i tillegg én hendelse per featureCollection med hvor lenge vi ventet på endelig valideringsstatus.
+Uten lyttere koster dette ingenting.
+
+Lyttere
+    Metrikker  : tellere og histogrammer i minnet, med oppsummering i konsoll og Prometheus tekstformat
+    LoggLytter : én linje JSON per hendelse til logging (logger 'datafangst.http')
+    Alle funksjoner som tar én dict kan brukes som lytter
+
+Hendelse for HTTP-kall (type 'http')
+    tidspunkt, metode, url, endepunkt (url-sti der ID'er er byttet ut med {id}), status (None ved nettverksfeil),
+    bytesUt, bytesInn (None hvis ukjent), sekunder (inkludert nye forsøk), forsok, retries, ventetid (sekund i backoff), feil
+
+Hendelse for validering (type 'validering')
+    tidspunkt, featureCollectionId, endepunkt, validationStatus, sekunder, tidsavbrudd
+
+Eksempel
+    metrikker = dfmetrikk.Metrikker()
+    dfmetrikk.leggTilLytter( metrikker )
+    df10.lagreFeatureCollections( kontrakt, 'dump', maksParallelle=8, klient=klient )
+    metrikker.oppsummer()
+    open( 'datafangst.prom', 'w' ).write( metrikker.prometheus() )
+"""
+import json
+import logging
+import os
+import re
+import threading
+from urllib.parse import urlsplit
+
+BUCKETS = ( 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300 )
+VALIDERING_BUCKETS = ( 1, 2, 5, 10, 30, 60, 120, 300, 600, 1800, 3600 )
+
+_ID = re.compile( r'^(?:[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}|\d+)$' )
+
+# Segmentet etter disse i URL-stien er alltid en ID
+_FORAN_ID = ( 'contract', 'featurecollection', 'kontrakter' )
+
+_lyttere = []
+_lytterLas = threading.Lock()
+
+
+def endepunkt( url:str ):
+    """
+    URL-sti der ID'er (UUID, tall og segmentet etter f.eks /contract/) er byttet ut med {id}, slik at alle kall mot
+    samme endepunkt grupperes sammen
+    """
+    deler = urlsplit( url ).path.split( '/' )
+    return '/'.join( '{id}' if x and ( _ID.match( x ) or ( i > 0 and deler[i-1] in _FORAN_ID )) else x for i, x in enumerate( deler ))
+
+
+def bytesUt( kwargs:dict ):
+    """
+    Størrelse på request body, eller None hvis den ikke er kjent på forhånd (strømmet body)
+    """
+    data = kwargs.get( 'data' )
+    if data is None and kwargs.get( 'json' ) is not None:
+        return None
+    if data is None:
+        return 0
+    if isinstance( data, str ):
+        return len( data.encode( 'utf-8' ))
+    if isinstance( data, ( bytes, bytearray )):
+        return len( data )
+    if hasattr( data, 'fileno' ):
+        try:
+            return os.fstat( data.fileno() ).st_size
+        except ( OSError, ValueError ):
+            return None
+    return None
+
+
+def bytesInn( r, strom=False ):
+    """
+    Størrelse på response body. For strømmede svar brukes Content-Length hvis den finnes
+    """
+    if r is None:
+        return None
+    if not strom:
+        return len( r.content or b'' )
+    lengde = r.headers.get( 'Content-Length' )
+    return int( lengde ) if lengde and lengde.isdigit() else None
+
+
+def leggTilLytter( lytter ):
+    """
+    Registrerer global lytter som får alle hendelser, fra alle klienter
+    """
+    with _lytterLas:
+        _lyttere.append( lytter )
+    return lytter
+
+
+def fjernLytter( lytter ):
+    with _lytterLas:
+        if lytter in _lyttere:
+            _lyttere.remove( lytter )
+
+
+def harLyttere( klient=None ):
+    return bool( _lyttere ) or bool( klient is not None and getattr( klient, 'lyttere', None ))
+
+
+def send( hendelse:dict, klient=None ):
+    """
+    Sender hendelse til globale lyttere og lytterne på klienten. Feil i en lytter stopper aldri selve API-kallet
+    """
+    lyttere = list( _lyttere )
+    if klient is not None:
+        lyttere.extend( getattr( klient, 'lyttere', None ) or [] )
+    for lytter in lyttere:
+        try:
+            lytter( hendelse )
+        except Exception as e:
+            print( f"Lytter {lytter} feilet: {e}" )
+
+
+class _Histogram:
+    __slots__ = ( 'grenser', 'antall', 'sum', 'maks' )
+
+    def __init__( self, grenser ):
+        self.grenser = grenser
+        self.antall = [ 0 ] * ( len( grenser ) + 1 )
+        self.sum = 0.0
+        self.maks = 0.0
+
+    def legg( self, verdi:float ):
+        i = 0
+        while i < len( self.grenser ) and verdi > self.grenser[i]:
+            i += 1
+        self.antall[i] += 1
+        self.sum += verdi
+        self.maks = max( self.maks, verdi )
+
+    @property
+    def totalt( self ):
+        return sum( self.antall )
+
+    def kvantil( self, q:float ):
+        """
+        Omtrentlig kvantil: øvre grense for bøtta kvantilen havner i
+        """
+        grense = q * self.totalt
+        akkumulert = 0
+        for i, antall in enumerate( self.antall ):
+            akkumulert += antall
+            if akkumulert >= grense and antall > 0:
+                return min( self.grenser[i], self.maks ) if i < len( self.grenser ) else self.maks
+        return 0.0
+
+
+def _etiketter( **verdier ):
+    def escape( verdi ):
+        return str( verdi ).replace( '\\', '\\\\' ).replace( '"', '\\"' ).replace( '\n', '\\n' )
+    return ','.join( f'{k}="{escape( v )}"' for k, v in verdier.items() )
+
+
+class Metrikker:
+    """
+    Lytter som samler tellere og histogrammer per endepunkt og metode
+
+    KEYWORDS
+        buckets : grenser (sekund) for histogrammet over tidsbruk per kall
+
+        valideringBuckets : grenser (sekund) for histogrammet over ventetid på validering
+    """
+
+    def __init__( self, buckets=BUCKETS, valideringBuckets=VALIDERING_BUCKETS ):
+        self.buckets = tuple( buckets )
+        self.valideringBuckets = tuple( valideringBuckets )
+        self._las = threading.Lock()
+        self.nullstill()
+
+    def nullstill( self ):
+        with self._las:
+            self.kall = { }            # ( endepunkt, metode, status ) => antall
+            self.tid = { }             # ( endepunkt, metode ) => _Histogram
+            self.retries = { }         # ( endepunkt, metode ) => antall nye forsøk
+            self.ventetid = { }        # ( endepunkt, metode ) => sekund brukt i backoff
+            self.bytesUt = { }         # ( endepunkt, metode ) => bytes
+            self.bytesInn = { }        # ( endepunkt, metode ) => bytes
+            self.validering = { }      # validationStatus => _Histogram
+
+    def __call__( self, hendelse:dict ):
+        with self._las:
+            if hendelse.get( 'type' ) == 'validering':
+                status = 'TIDSAVBRUDD' if hendelse.get( 'tidsavbrudd' ) else hendelse.get( 'validationStatus' )
+                if status not in self.validering:
+                    self.validering[status] = _Histogram( self.valideringBuckets )
+                self.validering[status].legg( hendelse['sekunder'] )
+                return
+
+            nokkel = ( hendelse['endepunkt'], hendelse['metode'] )
+            statusnokkel = nokkel + ( hendelse['status'] if hendelse['status'] is not None else 'feil', )
+            self.kall[statusnokkel] = self.kall.get( statusnokkel, 0 ) + 1
+            if nokkel not in self.tid:
+                self.tid[nokkel] = _Histogram( self.buckets )
+            self.tid[nokkel].legg( hendelse['sekunder'] )
+            self.retries[nokkel] = self.retries.get( nokkel, 0 ) + hendelse['retries']
+            self.ventetid[nokkel] = self.ventetid.get( nokkel, 0 ) + hendelse['ventetid']
+            self.bytesUt[nokkel] = self.bytesUt.get( nokkel, 0 ) + ( hendelse['bytesUt'] or 0 )
+            self.bytesInn[nokkel] = self.bytesInn.get( nokkel, 0 ) + ( hendelse['bytesInn'] or 0 )
+
+    def tabell( self ):
+        """
+        Én rad (dict) per endepunkt og metode: antall, feil, retries, snitt, p50, p95, maks (sekund), bytesUt, bytesInn.
+        Sortert med mest samlet tidsbruk først
+        """
+        with self._las:
+            rader = []
+            for nokkel, histogram in self.tid.items():
+                feil = sum( antall for ( e, m, s ), antall in self.kall.items() if ( e, m ) == nokkel and ( s == 'feil' or s >= 400 ))
+                rader.append( { 'endepunkt' : nokkel[0], 'metode' : nokkel[1], 'antall' : histogram.totalt, 'feil' : feil,
+                                'retries' : self.retries[nokkel], 'ventetid' : round( self.ventetid[nokkel], 3 ),
+                                'sekunderTotalt' : round( histogram.sum, 3 ),
+                                'snitt' : round( histogram.sum / histogram.totalt, 3 ), 'p50' : histogram.kvantil( 0.5 ),
+                                'p95' : histogram.kvantil( 0.95 ), 'maks' : round( histogram.maks, 3 ),
+                                'bytesUt' : self.bytesUt[nokkel], 'bytesInn' : self.bytesInn[nokkel] } )
+            for status, histogram in self.validering.items():
+                rader.append( { 'endepunkt' : 'validering', 'metode' : status, 'antall' : histogram.totalt, 'feil' : 0, 'retries' : 0,
+                                'ventetid' : 0, 'sekunderTotalt' : round( histogram.sum, 3 ),
+                                'snitt' : round( histogram.sum / histogram.totalt, 3 ), 'p50' : histogram.kvantil( 0.5 ),
+                                'p95' : histogram.kvantil( 0.95 ), 'maks' : round( histogram.maks, 3 ), 'bytesUt' : 0, 'bytesInn' : 0 } )
+        return sorted( rader, key=lambda x: -x['sekunderTotalt'] )
+
+    def oppsummer( self, utskrift=True ):
+        """
+        Skriver tabell med tidsbruk per endepunkt til konsoll. Returnerer tabell(), se der
+        """
+        rader = self.tabell()
+        if utskrift:
+            print( f"{'metode':<10} {'endepunkt':<60} {'antall':>7} {'feil':>5} {'retry':>5} {'snitt':>7} {'p95':>7} {'maks':>7} {'MB inn':>8}" )
+            for rad in rader:
+                print( f"{rad['metode']:<10} {rad['endepunkt'][-60:]:<60} {rad['antall']:>7} {rad['feil']:>5} {rad['retries']:>5} "
+                       f"{rad['snitt']:>7.2f} {rad['p95']:>7.2f} {rad['maks']:>7.2f} {rad['bytesInn']/1e6:>8.1f}" )
+        return rader
+
+    def prometheus( self, prefiks='datafangst' ):
+        """
+        Alle målingene i Prometheus tekstformat (f.eks til node_exporter textfile collector)
+        """
+        linjer = []
+        with self._las:
+            linjer.append( f"# TYPE {prefiks}_http_requests_total counter" )
+            for ( e, m, s ), antall in sorted( self.kall.items(), key=str ):
+                linjer.append( f"{prefiks}_http_requests_total{{{_etiketter( endpoint=e, method=m, status=s )}}} {antall}" )
+
+            for navn, tabell in ( ( 'http_retries_total', self.retries ), ( 'http_backoff_seconds_total', self.ventetid ),
+                                  ( 'http_request_bytes_total', self.bytesUt ), ( 'http_response_bytes_total', self.bytesInn )):
+                linjer.append( f"# TYPE {prefiks}_{navn} counter" )
+                for ( e, m ), verdi in sorted( tabell.items() ):
+                    linjer.append( f"{prefiks}_{navn}{{{_etiketter( endpoint=e, method=m )}}} {verdi}" )
+
+            for navn, tabell, etikett in ( ( 'http_request_duration_seconds', self.tid, lambda k: { 'endpoint' : k[0], 'method' : k[1] } ),
+                                           ( 'validation_wait_seconds', self.validering, lambda k: { 'status' : k } )):
+                linjer.append( f"# TYPE {prefiks}_{navn} histogram" )
+                for nokkel, histogram in sorted( tabell.items(), key=str ):
+                    etiketter = etikett( nokkel )
+                    akkumulert = 0
+                    for grense, antall in zip( list( histogram.grenser ) + [ '+Inf' ], histogram.antall ):
+                        akkumulert += antall
+                        linjer.append( f"{prefiks}_{navn}_bucket{{{_etiketter( **etiketter, le=grense )}}} {akkumulert}" )
+                    linjer.append( f"{prefiks}_{navn}_sum{{{_etiketter( **etiketter )}}} {histogram.sum}" )
+                    linjer.append( f"{prefiks}_{navn}_count{{{_etiketter( **etiketter )}}} {histogram.totalt}" )
+        return '\n'.join( linjer ) + '\n'
+
+
+class LoggLytter:
+    """
+    Lytter som skriver hver hendelse som én linje JSON til logging
+
+    KEYWORDS
+        logger : logging.Logger, default logging.getLogger( 'datafangst.http' )
+
+        niva : int, default logging.INFO. Kall med HTTP-feil eller nettverksfeil logges som WARNING
+    """
+
+    def __init__( self, logger=None, niva=logging.INFO ):
+        self.logger = logger or logging.getLogger( 'datafangst.http' )
+        self.niva = niva
+
+    def __call__( self, hendelse:dict ):
+        feilet = hendelse.get( 'feil' ) or ( hendelse.get( 'status' ) or 0 ) >= 400
+        self.logger.log( logging.WARNING if feilet else self.niva, json.dumps( hendelse, ensure_ascii=False, default=str ))
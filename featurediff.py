@@ -0,0 +1,271 @@
+"""
+Sammenligning av lokal FeatureCollection mot kopien på serveren, feature for feature, og innsending av kun endringene
+
+putFeatureCollection erstatter hele featureCollection, og serveren validerer alt på nytt, selv om vi bare har rettet
+én egenskap på ett vegobjekt. Her matcher vi features på id og sammenligner hash av geometri og hver egenskap
+(attributes per egenskapstype, og de andre properties hver for seg). Resultatet viser nøyaktig hvilke features som er
+nye, endret eller borte, og hvilke deler av hvert feature som er endret.
+
+Serverkopien leses strømmende (geojsonstrom) og vi tar bare vare på hashene, så den kan være stor. Den kan også
+leses fra en lokal speiling (df10.lagreFeatureCollections / speiling.synkroniserKontrakt) i stedet for fra serveren.
+
+sendEndringer kan så
+    modus='endringer' : sende kun nye og endrede features (med assosierte features) som en ny, mindre featureCollection (postFeatureCollection)
+    modus='erstatt'   : erstatte hele featureCollection (putFeatureCollection), men bare hvis noe faktisk er endret
+
+Eksempel
+    diff = featurediff.sammenlign( minGeojson, featurediff.hentFingeravtrykk( kontrakt, fcId, user='jajens', pw=pw ))
+    featurediff.oppsummer( diff )
+    resultat = featurediff.sendEndringer( kontrakt, fcId, minGeojson, user='jajens', pw=pw, modus='endringer' )
+"""
+import hashlib
+import json
+
+import bulkopplasting
+import df10
+import dfjson
+import geojsonstrom
+
+# Egenskaper som lagreFeatureCollections og serveren legger på, og som ikke er en del av det vi sender inn
+IGNORER = ( 'validationStatus', )
+
+MODUSER = ( 'endringer', 'erstatt' )
+
+
+def _hash( verdi ):
+    tekst = json.dumps( verdi, sort_keys=True, ensure_ascii=False, separators=( ',', ':' ))
+    return hashlib.blake2b( tekst.encode( 'utf-8' ), digest_size=8 ).digest()
+
+
+def featureId( feature:dict ):
+    """
+    ID vi matcher features på: feature['id'], evt properties['id']. None hvis feature mangler ID
+    """
+    fid = feature.get( 'id' )
+    if fid is None:
+        fid = ( feature.get( 'properties' ) or { } ).get( 'id' )
+    return None if fid is None else str( fid )
+
+
+def fingeravtrykk( feature:dict, ignorer=IGNORER ):
+    """
+    Hash av hver del av et feature
+
+    RETURNS
+        dict med 'geometry', 'attributes.<egenskapstypeId>' og navnet på øvrige properties => hash (bytes)
+    """
+    avtrykk = { 'geometry' : _hash( feature.get( 'geometry' )) }
+    for navn, verdi in ( feature.get( 'properties' ) or { } ).items():
+        if navn in ignorer:
+            continue
+        if navn == 'attributes' and isinstance( verdi, dict ):
+            for egenskap, egenskapverdi in verdi.items():
+                avtrykk['attributes.' + str( egenskap )] = _hash( egenskapverdi )
+        else:
+            avtrykk[navn] = _hash( verdi )
+    return avtrykk
+
+
+def _features( kilde ):
+    """
+    Gir fra seg features fra dict (FeatureCollection), liste med features eller filnavn (.geojson eller .geojsonl)
+    """
+    if isinstance( kilde, dict ):
+        yield from kilde.get( 'features' ) or []
+    elif isinstance( kilde, str ):
+        with open( kilde, 'rb' ) as fp:
+            if kilde.lower().endswith( geojsonstrom.FILENDELSE['ndjson'] ):
+                for linje in fp:
+                    if linje.strip():
+                        yield dfjson.loads( linje )
+            else:
+                yield from geojsonstrom.lesFeatures( iter( lambda: fp.read( 1 << 16 ), b'' ))
+    else:
+        yield from kilde
+
+
+def lesFingeravtrykk( kilde, ignorer=IGNORER ):
+    """
+    Fingeravtrykk for alle features i kilde
+
+    ARGUMENTS
+        kilde : dict (FeatureCollection), liste med features eller filnavn (.geojson eller .geojsonl, f.eks fra lokal speiling)
+
+    RETURNS
+        dict featureId => fingeravtrykk. Features uten ID telles under nøkkelen None
+    """
+    avtrykk = { }
+    utenId = 0
+    for feature in _features( kilde ):
+        fid = featureId( feature )
+        if fid is None:
+            utenId += 1
+            continue
+        avtrykk[fid] = fingeravtrykk( feature, ignorer=ignorer )
+    if utenId:
+        avtrykk[None] = utenId
+    return avtrykk
+
+
+def hentFingeravtrykk( contractId:str, featureCollectionId:str, api='https://datafangst.vegvesen.no/api/v1/contract/', user='jajens', pw=None,
+                        klient=None, ignorer=IGNORER ):
+    """
+    Som lesFingeravtrykk, men for featureCollection på serveren. Leses strømmende, kun hashene holdes i minnet
+    """
+    url = api + contractId + '/featurecollection/' + featureCollectionId
+    with df10.get_stream( url, user=user, pw=pw, geojson=True, klient=klient ) as r:
+        return lesFingeravtrykk( geojsonstrom.lesFeatures( r.iter_content( chunk_size=1 << 16 )), ignorer=ignorer )
+
+
+def sammenlign( lokal, server, ignorer=IGNORER ):
+    """
+    Sammenligner lokal FeatureCollection med serverkopien
+
+    ARGUMENTS
+        lokal : dict (FeatureCollection), liste med features eller filnavn
+
+        server : fingeravtrykk fra hentFingeravtrykk / lesFingeravtrykk, eller samme typer som lokal
+
+    RETURNS
+        dict med
+            nye      : liste med featureId som ikke finnes på serveren (og antall lokale features uten ID under utenId)
+            endret   : dict featureId => liste med deler som er endret, f.eks [ 'geometry', 'attributes.5293' ]
+            slettet  : liste med featureId som bare finnes på serveren
+            uendret  : antall features som er like
+    """
+    if not ( isinstance( server, dict ) and server.get( 'type' ) != 'FeatureCollection' ):
+        server = lesFingeravtrykk( server, ignorer=ignorer )
+
+    diff = { 'nye' : [], 'endret' : { }, 'slettet' : [], 'uendret' : 0, 'utenId' : 0 }
+    sett = set()
+    for feature in _features( lokal ):
+        fid = featureId( feature )
+        if fid is None:
+            diff['utenId'] += 1
+            continue
+        sett.add( fid )
+        serveravtrykk = server.get( fid )
+        if serveravtrykk is None:
+            diff['nye'].append( fid )
+            continue
+        avtrykk = fingeravtrykk( feature, ignorer=ignorer )
+        if avtrykk == serveravtrykk:
+            diff['uendret'] += 1
+        else:
+            diff['endret'][fid] = sorted( navn for navn in avtrykk.keys() | serveravtrykk.keys() if avtrykk.get( navn ) != serveravtrykk.get( navn ))
+
+    diff['slettet'] = [ fid for fid in server if fid is not None and fid not in sett ]
+    return diff
+
+
+def harEndringer( diff:dict ):
+    """
+    True hvis lokal og serverkopi er ulike
+    """
+    return bool( diff['nye'] or diff['endret'] or diff['slettet'] or diff['utenId'] )
+
+
+def endredeFeatures( lokal, diff:dict, medNye=True, medAssosierte=True ):
+    """
+    Ny FeatureCollection med kun de features som er endret (og nye, hvis medNye=True). Øvrige toppnivå-elementer (crs ...) kopieres
+
+    Med medAssosierte=True (default) tas også uendrede features som henger sammen med et av disse via properties['associations']
+    med, begge veier og i flere ledd (som bulkopplasting holder sammen), så featureCollection ikke peker på featureId som mangler
+    """
+    if isinstance( lokal, str ):
+        lokal = _lesFeatureCollection( lokal )
+    elif not isinstance( lokal, dict ):
+        lokal = { 'type' : 'FeatureCollection', 'features' : list( lokal ) }
+
+    ta = set( diff['endret'] )
+    if medNye:
+        ta.update( diff['nye'] )
+    data = { navn : verdi for navn, verdi in lokal.items() if navn != 'features' }
+    features = lokal.get( 'features' ) or []
+    valgt = [ featureId( f ) in ta or ( medNye and featureId( f ) is None ) for f in features ]
+    if medAssosierte:
+        for gruppe in bulkopplasting._sammenhengendeGrupper( features ):
+            if len( gruppe ) > 1 and any( valgt[i] for i in gruppe ):
+                for i in gruppe:
+                    valgt[i] = True
+    data['features'] = [ f for f, ja in zip( features, valgt ) if ja ]
+    return data
+
+
+def _lesFeatureCollection( filnavn:str ):
+    if filnavn.lower().endswith( geojsonstrom.FILENDELSE['ndjson'] ):
+        return { 'type' : 'FeatureCollection', 'features' : list( _features( filnavn )) }
+    return dfjson.lesFil( filnavn )
+
+
+def oppsummer( diff:dict ):
+    """
+    Skriver oversikt over endringene, og hvilke deler som er endret oftest
+    """
+    print( f"{len( diff['nye'] )} nye, {len( diff['endret'] )} endret, {len( diff['slettet'] )} slettet og {diff['uendret']} uendrede features" )
+    if diff['utenId']:
+        print( f"{diff['utenId']} lokale features uten id, kan ikke sammenlignes og regnes som nye" )
+    deler = { }
+    for endringer in diff['endret'].values():
+        for navn in endringer:
+            deler[navn] = deler.get( navn, 0 ) + 1
+    for navn, antall in sorted( deler.items(), key=lambda x: -x[1] )[0:10]:
+        print( f"\t{antall:>7} {navn}" )
+
+
+def sendEndringer( contractId:str, featureCollectionId:str, lokal, server=None, modus='endringer', api='https://datafangst.vegvesen.no/api/v1/contract/',
+                    user='jajens', pw=None, klient=None, ignorer=IGNORER, **kwargs ):
+    """
+    Sammenligner lokal FeatureCollection med featureCollectionId på serveren, og sender inn bare hvis noe er endret
+
+    ARGUMENTS
+        contractId, featureCollectionId : str
+
+        lokal : dict (Datafangst 1.0 geojson) eller filnavn
+
+    KEYWORDS
+        server : None (default, hentes fra serveren), fingeravtrykk eller kilde til serverkopien, f.eks fil fra lokal speiling
+
+        modus : 'endringer' (default) sender kun nye og endrede features, og de features de henger sammen med via assosiasjoner,
+                som ny featureCollection med postFeatureCollection.
+                Vegobjekter som er fjernet lokalt blir da ikke fjernet på serveren, de står i resultatet under diff['slettet'].
+                'erstatt' erstatter hele featureCollection med putFeatureCollection
+
+        Ellers som df10.postFeatureCollection
+
+    RETURNS
+        dict med diff (se sammenlign), antall features som ble sendt og respons fra API (None hvis ingenting ble sendt)
+    """
+    if modus not in MODUSER:
+        raise ValueError( f"Ukjent modus {modus}, må være en av {MODUSER}" )
+
+    user, pw = df10._brukerOgPassord( user, pw, api, klient=klient )
+    if isinstance( lokal, str ):
+        lokal = _lesFeatureCollection( lokal )
+    if server is None:
+        server = hentFingeravtrykk( contractId, featureCollectionId, api=api, user=user, pw=pw, klient=klient, ignorer=ignorer )
+
+    diff = sammenlign( lokal, server, ignorer=ignorer )
+    resultat = { 'diff' : diff, 'sendt' : 0, 'respons' : None }
+    oppsummer( diff )
+
+    if modus == 'erstatt':
+        if not harEndringer( diff ):
+            print( f"Ingen endringer, featureCollection {featureCollectionId} sendes ikke på nytt" )
+            return resultat
+        resultat['sendt'] = len( lokal.get( 'features' ) or [] )
+        resultat['respons'] = df10.putFeatureCollection( contractId, featureCollectionId, lokal, api=api, user=user, pw=pw, klient=klient, **kwargs )
+        return resultat
+
+    data = endredeFeatures( lokal, diff )
+    if not data['features']:
+        print( f"Ingen nye eller endrede features, featureCollection {featureCollectionId} sendes ikke på nytt" )
+        return resultat
+    if diff['slettet']:
+        print( f"{len( diff['slettet'] )} features er fjernet lokalt, det blir ikke sendt til serveren med modus='endringer'" )
+    assosierte = len( data['features'] ) - len( diff['endret'] ) - len( diff['nye'] ) - diff['utenId']
+    if assosierte > 0:
+        print( f"Sender også {assosierte} uendrede features som henger sammen med endringene via assosiasjoner" )
+    resultat['sendt'] = len( data['features'] )
+    resultat['respons'] = df10.postFeatureCollection( contractId, data, api=api, user=user, pw=pw, klient=klient, **kwargs )
+    return resultat
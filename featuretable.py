@@ -0,0 +1,467 @@
+"""
+Kolonnevis representasjon av store FeatureCollections i minnet (numpy), med konvertering til og fra Datafangst geojson
+
+En FeatureCollection som nøstede dicts koster flere kilobyte per feature, og løkker over properties er trege. FeatureTable
+lagrer i stedet features som kolonner: id, typeId, alle koordinater i én numpy-buffer (med offset-tabeller for deler,
+ringer og punkter), og én kolonne per property og per egenskapstype under attributes. Massiv retting, filtrering og
+statistikk blir da numpy-operasjoner på hele kolonner, og tilGeojson / features gir Datafangst 1.0 / 2.0 geojson tilbake
+(samme format i begge), klar for df10.postFeatureCollection eller df20.lastOppGeojson.
+
+Kolonnetyper
+    Tall blir float64 (NaN der verdien mangler), eller int64 når alle har heltall. Heltallskolonner der noen mangler
+    lagres som float64, men skrives ut som heltall igjen. Tekst og annet blir object-kolonner med None der verdien mangler,
+    og like tekstverdier deler samme objekt. Manglende og null-verdier skrives ikke ut igjen.
+
+    Koordinatene lagres som float64 med 3 dimensjoner (z = NaN for 2D-geometri), så heltallskoordinater kommer ut som flyttall.
+    GeometryCollection og ukjente geometrityper tas vare på som de er, utenom koordinatbufferen.
+
+Eksempel
+    tabell = featuretable.FeatureTable.fraFil( 'speil/minkontrakt/abc.geojson' )
+    tabell.antallPerType()
+    bomstasjoner = tabell[ tabell.typeId == 45 ]
+    bomstasjoner.settKolonne( 'attributes.9390', 'Bomstasjon' )
+    df10.postFeatureCollection( kontrakt, bomstasjoner.tilGeojson(), user='jajens', pw=pw )
+"""
+from array import array
+import numbers
+
+import numpy as np
+
+import dfjson
+import geojsonstrom
+
+GEOMETRITYPER = ( None, 'Point', 'LineString', 'Polygon', 'MultiPoint', 'MultiLineString', 'MultiPolygon' )
+ANNEN = 255     # geometritype som lagres som den er (GeometryCollection o.l.)
+
+_KODE = { navn : kode for kode, navn in enumerate( GEOMETRITYPER ) }
+
+
+def _kolonne( verdier:list ):
+    """
+    Lager numpy-kolonne av en liste med verdier (None = mangler). Returnerer ( kolonne, heltall )
+    """
+    tall = [ x for x in verdier if x is not None ]
+    if tall and all( isinstance( x, numbers.Real ) and not isinstance( x, bool ) for x in tall ):
+        heltall = all( isinstance( x, numbers.Integral ) for x in tall )
+        if heltall and len( tall ) == len( verdier ):
+            return np.array( verdier, dtype=np.int64 ), False
+        return np.array( [ np.nan if x is None else x for x in verdier ], dtype=np.float64 ), heltall
+
+    kolonne = np.empty( len( verdier ), dtype=object )
+    felles = { }
+    for nr, verdi in enumerate( verdier ):
+        if isinstance( verdi, str ):
+            verdi = felles.setdefault( verdi, verdi )
+        kolonne[nr] = verdi
+    return kolonne, False
+
+
+def _utvalgOffset( start:np.ndarray, rader:np.ndarray ):
+    """
+    Nye offset og indeksene til elementene på nivået under, for et utvalg av rader
+    """
+    lengder = start[rader + 1] - start[rader]
+    nyStart = np.zeros( len( rader ) + 1, dtype=np.int64 )
+    np.cumsum( lengder, out=nyStart[1:] )
+    indekser = np.repeat( start[rader] - nyStart[:-1], lengder ) + np.arange( nyStart[-1], dtype=np.int64 )
+    return nyStart, indekser
+
+
+class _Bygger:
+    """
+    Samler features en og en i kompakte buffere, og lager FeatureTable til slutt
+    """
+    def __init__( self ):
+        self.antall = 0
+        self.id = []
+        self.typeId = []
+        self.geometritype = array( 'B' )
+        self.dimensjon = array( 'B' )
+        self.delStart = array( 'q', [ 0 ] )
+        self.ringStart = array( 'q', [ 0 ] )
+        self.punktStart = array( 'q', [ 0 ] )
+        self.koordinater = array( 'd' )
+        self.andreGeometrier = { }
+        self.harAttributter = array( 'B' )
+        self._harZ = False
+        self.egenskaper = { }
+        self.attributter = { }
+        self.rekkefolge = { }
+
+    def _ring( self, punkter ):
+        for punkt in punkter:
+            if len( punkt ) > 2 and punkt[2] is not None:
+                self.koordinater.extend( ( punkt[0], punkt[1], punkt[2] ))
+                self._harZ = True
+            else:
+                self.koordinater.extend( ( punkt[0], punkt[1], np.nan ))
+        self.punktStart.append( len( self.koordinater ) // 3 )
+
+    def _del( self, ringer ):
+        for ring in ringer:
+            self._ring( ring )
+        self.ringStart.append( len( self.punktStart ) - 1 )
+
+    def _geometri( self, geometri ):
+        # Multigeometri kan ha z på noen deler og ikke andre, dimensjon 3 hvis minst ett punkt har z
+        self._harZ = False
+        kode = _KODE.get( geometri.get( 'type' )) if geometri else 0
+        koordinater = geometri.get( 'coordinates' ) if geometri else None
+        if kode is None or ( kode and koordinater is None ):
+            self.andreGeometrier[self.antall] = geometri
+            kode = ANNEN
+        elif kode == 1:
+            self._del( [ [ koordinater ] ] )
+        elif kode == 2:
+            self._del( [ koordinater ] )
+        elif kode == 3:
+            self._del( koordinater )
+        elif kode == 4:
+            for punkt in koordinater:
+                self._del( [ [ punkt ] ] )
+        elif kode == 5:
+            for linje in koordinater:
+                self._del( [ linje ] )
+        elif kode == 6:
+            for polygon in koordinater:
+                self._del( polygon )
+
+        self.geometritype.append( kode )
+        self.dimensjon.append( 3 if self._harZ else 2 )
+        self.delStart.append( len( self.ringStart ) - 1 )
+
+    def _sett( self, kolonner:dict, navn, verdi ):
+        kolonne = kolonner.get( navn )
+        if kolonne is None:
+            kolonne = kolonner[navn] = [ None ] * self.antall
+        kolonne.append( verdi )
+
+    def leggTil( self, feature:dict ):
+        self.id.append( feature.get( 'id' ))
+        self._geometri( feature.get( 'geometry' ))
+        properties = feature.get( 'properties' ) or { }
+        typeId = properties.get( 'typeId' )
+        self.typeId.append( -1 if typeId is None else int( typeId ))
+        attributter = properties.get( 'attributes' )
+        self.harAttributter.append( isinstance( attributter, dict ))
+        for navn, verdi in properties.items():
+            self.rekkefolge.setdefault( navn, None )
+            if navn == 'typeId' or ( navn == 'attributes' and isinstance( verdi, dict )):
+                continue
+            self._sett( self.egenskaper, navn, verdi )
+        for navn, verdi in ( attributter or { } ).items() if isinstance( attributter, dict ) else ():
+            self._sett( self.attributter, str( navn ), verdi )
+        self.antall += 1
+        for kolonner in ( self.egenskaper, self.attributter ):
+            for kolonne in kolonner.values():
+                if len( kolonne ) < self.antall:
+                    kolonne.append( None )
+
+    def tabell( self, metadata=None ):
+        tabell = FeatureTable( )
+        tabell.metadata = metadata or { }
+        tabell.id = np.empty( self.antall, dtype=object )
+        tabell.id[:] = self.id
+        tabell.typeId = np.array( self.typeId, dtype=np.int64 )
+        tabell.geometritype = np.frombuffer( self.geometritype, dtype=np.uint8 ).copy()
+        tabell.dimensjon = np.frombuffer( self.dimensjon, dtype=np.uint8 ).copy()
+        tabell.delStart = np.frombuffer( self.delStart, dtype=np.int64 ).copy()
+        tabell.ringStart = np.frombuffer( self.ringStart, dtype=np.int64 ).copy()
+        tabell.punktStart = np.frombuffer( self.punktStart, dtype=np.int64 ).copy()
+        tabell.koordinater = np.frombuffer( self.koordinater, dtype=np.float64 ).copy().reshape( -1, 3 )
+        tabell.andreGeometrier = self.andreGeometrier
+        tabell.harAttributter = np.frombuffer( self.harAttributter, dtype=np.uint8 ).astype( bool )
+        for navn, verdier in self.egenskaper.items():
+            tabell.egenskaper[navn], heltall = _kolonne( verdier )
+            if heltall:
+                tabell.heltall.add( navn )
+        for navn, verdier in self.attributter.items():
+            tabell.attributter[navn], heltall = _kolonne( verdier )
+            if heltall:
+                tabell.heltall.add( 'attributes.' + navn )
+        tabell.rekkefolge = list( self.rekkefolge )
+        return tabell
+
+
+class FeatureTable:
+    """
+    FeatureCollection lagret kolonnevis. Lages med fraGeojson, fraFeatures eller fraFil
+
+    Kolonner
+        id, typeId (-1 der typeId mangler), geometritype (kode i GEOMETRITYPER), dimensjon (2 eller 3)
+
+        koordinater : float64 ( antall punkter, 3 ). delStart, ringStart og punktStart er offset-tabeller:
+                      feature i har delene delStart[i]:delStart[i+1], del j ringene ringStart[j]:ringStart[j+1] og
+                      ring k punktene punktStart[k]:punktStart[k+1]
+
+        egenskaper : dict navn => kolonne for properties utenom typeId og attributes (tag, comment, dataCatalogVersion ...)
+
+        attributter : dict egenskapstypeId (str) => kolonne
+    """
+
+    def __init__( self ):
+        self.metadata = { }
+        self.id = np.empty( 0, dtype=object )
+        self.typeId = np.empty( 0, dtype=np.int64 )
+        self.geometritype = np.empty( 0, dtype=np.uint8 )
+        self.dimensjon = np.empty( 0, dtype=np.uint8 )
+        self.delStart = np.zeros( 1, dtype=np.int64 )
+        self.ringStart = np.zeros( 1, dtype=np.int64 )
+        self.punktStart = np.zeros( 1, dtype=np.int64 )
+        self.koordinater = np.empty( ( 0, 3 ), dtype=np.float64 )
+        self.andreGeometrier = { }
+        self.harAttributter = np.empty( 0, dtype=bool )
+        self.egenskaper = { }
+        self.attributter = { }
+        self.heltall = set()
+        self.rekkefolge = []
+
+    @classmethod
+    def fraFeatures( cls, features, metadata=None ):
+        """
+        FeatureTable fra en iterable med features, f.eks geojsonstrom.lesFeatures. Features holdes aldri i minnet samtidig
+        """
+        bygger = _Bygger()
+        for feature in features:
+            bygger.leggTil( feature )
+        return bygger.tabell( metadata=metadata )
+
+    @classmethod
+    def fraGeojson( cls, data:dict ):
+        """
+        FeatureTable fra FeatureCollection (dict). Toppnivå-elementer utenom features (crs ...) tas vare på i metadata
+        """
+        return cls.fraFeatures( data.get( 'features' ) or [], metadata={ navn : verdi for navn, verdi in data.items() if navn != 'features' } )
+
+    @classmethod
+    def fraFil( cls, filnavn:str ):
+        """
+        FeatureTable fra geojson- eller geojsonl-fil, lest strømmende
+        """
+        with open( filnavn, 'rb' ) as fp:
+            if filnavn.lower().endswith( geojsonstrom.FILENDELSE['ndjson'] ):
+                return cls.fraFeatures( ( dfjson.loads( linje ) for linje in fp if linje.strip() ), metadata={ 'type' : 'FeatureCollection' } )
+            metadata = { }
+            bygger = _Bygger()
+            for slag, navn, verdi in geojsonstrom.lesFeatureCollection( iter( lambda: fp.read( 1 << 16 ), b'' )):
+                if slag == 'feature':
+                    bygger.leggTil( verdi )
+                elif navn != 'features':
+                    metadata[navn] = verdi
+            return bygger.tabell( metadata=metadata )
+
+    def __len__( self ):
+        return len( self.typeId )
+
+    def __repr__( self ):
+        return f"FeatureTable( {len( self )} features, {len( self.koordinater )} punkter, {len( self.egenskaper )} egenskaper, {len( self.attributter )} attributter )"
+
+    @property
+    def x( self ):
+        return self.koordinater[:, 0]
+
+    @property
+    def y( self ):
+        return self.koordinater[:, 1]
+
+    @property
+    def z( self ):
+        return self.koordinater[:, 2]
+
+    def _kolonner( self, navn:str ):
+        if navn.startswith( 'attributes.' ):
+            return self.attributter, navn[len( 'attributes.' ):]
+        return self.egenskaper, navn
+
+    def kolonne( self, navn:str ):
+        """
+        Kolonne for 'id', 'typeId', en property (f.eks 'tag') eller 'attributes.<egenskapstypeId>'. Manglende kolonne gir KeyError
+        """
+        if navn in ( 'id', 'typeId' ):
+            return getattr( self, navn )
+        kolonner, nokkel = self._kolonner( navn )
+        return kolonner[nokkel]
+
+    def settKolonne( self, navn:str, verdier, rader=None ):
+        """
+        Setter verdier i en kolonne, for alle rader eller rader (maske eller indekser). Ny kolonne lages ved behov
+
+        ARGUMENTS
+            navn : str, se kolonne
+
+            verdier : én verdi for alle rader, eller liste / numpy-array med én verdi per rad. None fjerner verdien
+        """
+        if navn in ( 'id', 'typeId' ):
+            kolonne = getattr( self, navn )
+        else:
+            kolonner, nokkel = self._kolonner( navn )
+            if nokkel not in kolonner:
+                kolonner[nokkel] = np.full( len( self ), None, dtype=object )
+                rekkefolge = 'attributes' if navn.startswith( 'attributes.' ) else nokkel
+                if rekkefolge not in self.rekkefolge:
+                    self.rekkefolge.append( rekkefolge )
+            kolonne = kolonner[nokkel]
+            if verdier is None and kolonne.dtype.kind in 'iu':
+                kolonne = kolonner[nokkel] = kolonne.astype( np.float64 )
+                self.heltall.add( navn )
+            if verdier is None and kolonne.dtype.kind == 'f':
+                verdier = np.nan
+            elif kolonne.dtype != object and not np.can_cast( np.asarray( verdier ).dtype, kolonne.dtype, casting='same_kind' ):
+                # Via _verdi, så NaN (mangler) blir None og heltall fortsatt er int
+                heltall = navn in self.heltall
+                objekter = np.empty( len( kolonne ), dtype=object )
+                objekter[:] = [ self._verdi( kolonne, rad, heltall ) for rad in range( len( kolonne )) ]
+                kolonne = kolonner[nokkel] = objekter
+                self.heltall.discard( navn )
+        if rader is None:
+            kolonne[:] = verdier
+        else:
+            kolonne[rader] = verdier
+        if navn.startswith( 'attributes.' ) and verdier is not None:
+            if rader is None:
+                self.harAttributter[:] = True
+            else:
+                self.harAttributter[rader] = True
+
+    def _punktStartPerFeature( self ):
+        return self.punktStart[self.ringStart[self.delStart]]
+
+    def bbox( self ):
+        """
+        float64 ( antall features, 4 ) med minx, miny, maxx, maxy per feature. NaN for features uten koordinater
+        """
+        start = self._punktStartPerFeature()
+        boks = np.full( ( len( self ), 4 ), np.nan )
+        harPunkter = start[1:] > start[:-1]
+        if len( self.koordinater ):
+            indekser = start[:-1][harPunkter]
+            boks[harPunkter, 0:2] = np.minimum.reduceat( self.koordinater[:, 0:2], indekser )
+            boks[harPunkter, 2:4] = np.maximum.reduceat( self.koordinater[:, 0:2], indekser )
+        return boks
+
+    def antallPunkter( self ):
+        """
+        Antall koordinatpunkter per feature
+        """
+        return np.diff( self._punktStartPerFeature() )
+
+    def antallPerType( self ):
+        """
+        dict typeId => antall features, flest først
+        """
+        typer, antall = np.unique( self.typeId, return_counts=True )
+        return { int( t ) : int( n ) for t, n in sorted( zip( typer, antall ), key=lambda x: -x[1] ) }
+
+    def __getitem__( self, rader ):
+        return self.utvalg( rader )
+
+    def utvalg( self, rader ):
+        """
+        Ny FeatureTable med et utvalg av rader (bool-maske, indekser eller slice)
+        """
+        rader = np.arange( len( self ), dtype=np.int64 )[rader]
+        if rader.ndim == 0:
+            rader = rader.reshape( 1 )
+        ny = FeatureTable()
+        ny.metadata = dict( self.metadata )
+        ny.id = self.id[rader]
+        ny.typeId = self.typeId[rader]
+        ny.geometritype = self.geometritype[rader]
+        ny.dimensjon = self.dimensjon[rader]
+        ny.harAttributter = self.harAttributter[rader]
+        ny.delStart, deler = _utvalgOffset( self.delStart, rader )
+        ny.ringStart, ringer = _utvalgOffset( self.ringStart, deler )
+        ny.punktStart, punkter = _utvalgOffset( self.punktStart, ringer )
+        ny.koordinater = self.koordinater[punkter]
+        if self.andreGeometrier:
+            nyRad = { int( gammel ) : nr for nr, gammel in enumerate( rader ) }
+            ny.andreGeometrier = { nyRad[rad] : geometri for rad, geometri in self.andreGeometrier.items() if rad in nyRad }
+        ny.egenskaper = { navn : kolonne[rader] for navn, kolonne in self.egenskaper.items() }
+        ny.attributter = { navn : kolonne[rader] for navn, kolonne in self.attributter.items() }
+        ny.heltall = set( self.heltall )
+        ny.rekkefolge = list( self.rekkefolge )
+        return ny
+
+    def _verdi( self, kolonne, rad:int, heltall:bool ):
+        verdi = kolonne[rad]
+        if kolonne.dtype == object:
+            return None if isinstance( verdi, float ) and verdi != verdi else verdi
+        if kolonne.dtype.kind == 'f':
+            if np.isnan( verdi ):
+                return None
+            return int( verdi ) if heltall else float( verdi )
+        return verdi.item()
+
+    def _geometri( self, rad:int ):
+        kode = int( self.geometritype[rad] )
+        if kode == ANNEN:
+            return self.andreGeometrier.get( rad )
+        if kode == 0:
+            return None
+        dimensjon = int( self.dimensjon[rad] )
+        deler = []
+        for d in range( self.delStart[rad], self.delStart[rad + 1] ):
+            ringer = []
+            for r in range( self.ringStart[d], self.ringStart[d + 1] ):
+                blokk = self.koordinater[self.punktStart[r]:self.punktStart[r + 1], 0:dimensjon]
+                punkter = blokk.tolist()
+                if dimensjon == 3 and np.isnan( blokk[:, 2] ).any():
+                    punkter = [ p if p[2] == p[2] else p[0:2] for p in punkter ]
+                ringer.append( punkter )
+            deler.append( ringer )
+        if kode == 1:
+            koordinater = deler[0][0][0]
+        elif kode == 2:
+            koordinater = deler[0][0]
+        elif kode == 3:
+            koordinater = deler[0]
+        elif kode == 4:
+            koordinater = [ del_[0][0] for del_ in deler ]
+        elif kode == 5:
+            koordinater = [ del_[0] for del_ in deler ]
+        else:
+            koordinater = deler
+        return { 'type' : GEOMETRITYPER[kode], 'coordinates' : koordinater }
+
+    def features( self ):
+        """
+        Gir fra seg ett og ett feature som Datafangst geojson (dict)
+        """
+        egenskaper = [ ( navn, kolonne, navn in self.heltall ) for navn, kolonne in self.egenskaper.items() ]
+        attributter = [ ( navn, kolonne, 'attributes.' + navn in self.heltall ) for navn, kolonne in self.attributter.items() ]
+        rekkefolge = list( self.rekkefolge )
+        for navn in ( 'typeId', 'attributes' ):
+            if navn not in rekkefolge:
+                rekkefolge.append( navn )
+
+        for rad in range( len( self )):
+            verdier = { navn : self._verdi( kolonne, rad, heltall ) for navn, kolonne, heltall in egenskaper }
+            properties = { }
+            for navn in rekkefolge:
+                if navn == 'typeId':
+                    if self.typeId[rad] >= 0:
+                        properties['typeId'] = int( self.typeId[rad] )
+                elif navn == 'attributes' and self.harAttributter[rad]:
+                    properties['attributes'] = { }
+                    for attributt, kolonne, heltall in attributter:
+                        verdi = self._verdi( kolonne, rad, heltall )
+                        if verdi is not None:
+                            properties['attributes'][attributt] = verdi
+                elif verdier.get( navn ) is not None:
+                    properties[navn] = verdier[navn]
+
+            feature = { 'type' : 'Feature' }
+            if self.id[rad] is not None:
+                feature['id'] = self.id[rad]
+            feature['geometry'] = self._geometri( rad )
+            feature['properties'] = properties
+            yield feature
+
+    def tilGeojson( self ):
+        """
+        FeatureCollection (dict) for df10.postFeatureCollection / putFeatureCollection og df20.lastOppGeojson
+        """
+        data = { 'type' : 'FeatureCollection' }
+        data.update( self.metadata )
+        data['features'] = list( self.features() )
+        return data
@@ -0,0 +1,229 @@
+"""
+Lokal forhåndsvalidering av Datafangst 1.0 geojson mot datakatalogen, før opplasting
+
+Mange av valideringsmeldingene fra datafangst kan vi finne selv, på sekunder i stedet for en runde med
+POST og asynkron validering. Datakatalogen leses fra dumpen som lages av datakatalogendring/dumpDatakatalog.lagreDakat,
+og gjøres om til oppslagstabeller per vegobjekttype én gang. Selve valideringen er da bare dict-oppslag per egenskap.
+
+Koder som sjekkes (samme kode og alvorlighetsgrad som datafangst bruker der vi kjenner dem)
+    MANGLER_PÅKREVDE_EGENSKAPER       ERROR    egenskaper med viktighet 'påkrevd, absolutt' mangler
+    MANGLER_ANBEFALTE_EGENSKAPER      WARNING  egenskaper med viktighet 'påkrevd, ikke absolutt' mangler
+    STØRRE_ENN_ANBEFALT_MAKSIMUM      WARNING  tallverdi over anbefalt maksimum
+    MINDRE_ENN_ANBEFALT_MINIMUM       WARNING  tallverdi under anbefalt minimum
+    UGYLDIG_ENUMVERDI                 ERROR    verdien finnes ikke blant tillatte verdier
+    UKJENT_VEGOBJEKTTYPE              ERROR    typeId finnes ikke i datakatalogen
+    UKJENT_EGENSKAPSTYPE              ERROR    egenskapstypen finnes ikke for vegobjekttypen
+    DATACATALOG_VERSION_NOT_LATEST    WARNING  dataCatalogVersion er eldre enn datakatalogen vi validerer mot
+
+Eksempel
+    katalog = forhandsvalidering.Datakatalog.fraFil( 'datakatalog-PROD-2_36-2024-05-02.json' )
+    meldinger = forhandsvalidering.valider( minGeojson, katalog )
+    forhandsvalidering.oppsummer( meldinger )
+"""
+from collections import Counter
+import os
+import re
+
+import dfjson
+
+
+def _versjonSomTuppel( versjon ):
+    try:
+        return tuple( int( x ) for x in str( versjon ).replace( '_', '.' ).split( '.' ))
+    except ValueError:
+        return None
+
+
+class _Typeindeks:
+    """
+    Forhåndsberegnede oppslag for én vegobjekttype
+    """
+    __slots__ = ( 'id', 'navn', 'egenskapsnavn', 'pakrevd', 'anbefalt', 'enumverdier', 'maksAnbefalt', 'minAnbefalt' )
+
+    def __init__( self, vegobjekttype:dict ):
+        self.id = vegobjekttype['id']
+        self.navn = vegobjekttype.get( 'navn', str( self.id ))
+        self.egenskapsnavn = { }
+        self.pakrevd = []
+        self.anbefalt = []
+        self.enumverdier = { }
+        self.maksAnbefalt = { }
+        self.minAnbefalt = { }
+
+        for eg in vegobjekttype.get( 'egenskapstyper', [] ):
+            egId = str( eg['id'] )
+            self.egenskapsnavn[egId] = eg.get( 'navn', egId )
+
+            viktighet = str( eg.get( 'viktighet', '' )).upper()
+            if viktighet == 'PÅKREVD_ABSOLUTT':
+                self.pakrevd.append( egId )
+            elif viktighet == 'PÅKREVD_IKKE_ABSOLUTT':
+                self.anbefalt.append( egId )
+
+            if eg.get( 'tillatte_verdier' ):
+                gyldige = set()
+                for verdi in eg['tillatte_verdier']:
+                    if 'verdi' in verdi:
+                        gyldige.add( str( verdi['verdi'] ))
+                    if 'id' in verdi:
+                        gyldige.add( str( verdi['id'] ))
+                self.enumverdier[egId] = gyldige
+
+            for nokkel in ( 'max_anbefalt', 'maks_anbefalt' ):
+                if eg.get( nokkel ) is not None:
+                    self.maksAnbefalt[egId] = eg[nokkel]
+            if eg.get( 'min_anbefalt' ) is not None:
+                self.minAnbefalt[egId] = eg['min_anbefalt']
+
+    def beskriv( self, egIder ):
+        return '[' + ', '.join( f"{self.egenskapsnavn[x]} ({x})" for x in egIder ) + ']'
+
+
+class Datakatalog:
+    """
+    Datakatalog med forhåndsberegnede oppslag per vegobjekttype, til bruk i valider
+
+    ARGUMENTS
+        vegobjekttyper : liste med vegobjekttyper fra NVDB api LES /vegobjekttyper?inkluder=alle
+
+    KEYWORDS
+        versjon : str, datakatalogversjon, f.eks '2.36'. Uten versjon sjekkes ikke DATACATALOG_VERSION_NOT_LATEST
+    """
+
+    def __init__( self, vegobjekttyper:list, versjon=None ):
+        self.versjon = versjon
+        self.typer = { str( t['id'] ) : _Typeindeks( t ) for t in vegobjekttyper }
+
+    @classmethod
+    def fraFil( cls, filnavn:str, versjon=None ):
+        """
+        Leser datakatalog-dump fra dumpDatakatalog.lagreDakat. Versjonen hentes fra filnavnet hvis den ikke er oppgitt
+        """
+        if versjon is None:
+            treff = re.match( r'datakatalog-[^-]+-(\d+_\d+(?:_\d+)?)-', os.path.basename( filnavn ))
+            if treff:
+                versjon = treff.group( 1 ).replace( '_', '.' )
+        return cls( dfjson.lesFil( filnavn ), versjon=versjon )
+
+
+def _melding( severity:str, code:str, message:str, lineNo:int, feature:dict, featureTypeId=None, attributeTypeId=None ):
+    location = { 'lineNo' : lineNo }
+    if feature.get( 'id' ) is not None:
+        location['featureId'] = feature['id']
+    if attributeTypeId is not None:
+        location['attributeTypeId'] = int( attributeTypeId )
+    if featureTypeId is not None:
+        location['featureTypeId'] = int( featureTypeId )
+    tag = ( feature.get( 'properties' ) or { } ).get( 'tag' )
+    if tag:
+        location['featureAlias'] = tag
+    return { 'severity' : severity, 'code' : code, 'message' : message, 'location' : location }
+
+
+def validerFeature( feature:dict, katalog:Datakatalog, lineNo=0 ):
+    """
+    Validerer ett Datafangst 1.0 feature mot datakatalogen. Returnerer liste med meldinger (samme form som validationIssues)
+    """
+    meldinger = []
+    properties = feature.get( 'properties' ) or { }
+    typeId = str( properties.get( 'typeId' ))
+    attributter = properties.get( 'attributes' ) or { }
+
+    if katalog.versjon and properties.get( 'dataCatalogVersion' ):
+        featureVersjon = _versjonSomTuppel( properties['dataCatalogVersion'] )
+        katalogVersjon = _versjonSomTuppel( katalog.versjon )
+        if featureVersjon and katalogVersjon and featureVersjon < katalogVersjon:
+            meldinger.append( _melding( 'WARNING', 'DATACATALOG_VERSION_NOT_LATEST',
+                                        f"Ikke siste datakatalogversjon ({properties['dataCatalogVersion']} < {katalog.versjon})", lineNo, feature ))
+
+    indeks = katalog.typer.get( typeId )
+    if indeks is None:
+        meldinger.append( _melding( 'ERROR', 'UKJENT_VEGOBJEKTTYPE', f"Vegobjekttype {typeId} finnes ikke i datakatalog {katalog.versjon}", lineNo, feature ))
+        return meldinger
+
+    for egId, verdi in attributter.items():
+        egId = str( egId )
+        if egId not in indeks.egenskapsnavn:
+            meldinger.append( _melding( 'ERROR', 'UKJENT_EGENSKAPSTYPE', f"Egenskapstype {egId} finnes ikke for {indeks.navn} ({indeks.id})",
+                                        lineNo, feature, featureTypeId=indeks.id, attributeTypeId=egId ))
+            continue
+        if verdi is None:
+            continue
+
+        gyldige = indeks.enumverdier.get( egId )
+        if gyldige is not None and str( verdi ) not in gyldige:
+            meldinger.append( _melding( 'ERROR', 'UGYLDIG_ENUMVERDI',
+                                        f"Verdien {verdi} er ikke en tillatt verdi for egenskapstype {indeks.egenskapsnavn[egId]} ({egId})",
+                                        lineNo, feature, featureTypeId=indeks.id, attributeTypeId=egId ))
+            continue
+
+        if egId in indeks.maksAnbefalt or egId in indeks.minAnbefalt:
+            try:
+                tall = float( verdi )
+            except ( TypeError, ValueError ):
+                continue
+            maks = indeks.maksAnbefalt.get( egId )
+            mini = indeks.minAnbefalt.get( egId )
+            if maks is not None and tall > maks:
+                meldinger.append( _melding( 'WARNING', 'STØRRE_ENN_ANBEFALT_MAKSIMUM',
+                                            f"Verdien {verdi} for egenskapstype {indeks.egenskapsnavn[egId]} ({egId}) er større enn anbefalt maksimumsverdi: {maks}",
+                                            lineNo, feature, featureTypeId=indeks.id, attributeTypeId=egId ))
+            elif mini is not None and tall < mini:
+                meldinger.append( _melding( 'WARNING', 'MINDRE_ENN_ANBEFALT_MINIMUM',
+                                            f"Verdien {verdi} for egenskapstype {indeks.egenskapsnavn[egId]} ({egId}) er mindre enn anbefalt minimumsverdi: {mini}",
+                                            lineNo, feature, featureTypeId=indeks.id, attributeTypeId=egId ))
+
+    mangler = [ x for x in indeks.pakrevd if attributter.get( x ) is None ]
+    if mangler:
+        meldinger.append( _melding( 'ERROR', 'MANGLER_PÅKREVDE_EGENSKAPER',
+                                    f"Objektet, av typen {indeks.navn} ({indeks.id}), mangler egenskaper med viktighet 'påkrevd, absolutt': {indeks.beskriv( mangler )}",
+                                    lineNo, feature, featureTypeId=indeks.id ))
+
+    mangler = [ x for x in indeks.anbefalt if attributter.get( x ) is None ]
+    if mangler:
+        meldinger.append( _melding( 'WARNING', 'MANGLER_ANBEFALTE_EGENSKAPER',
+                                    f"Objektet, av typen {indeks.navn} ({indeks.id}), mangler egenskaper med viktighet 'påkrevd, ikke absolutt': {indeks.beskriv( mangler )}",
+                                    lineNo, feature, featureTypeId=indeks.id ))
+
+    return meldinger
+
+
+def valider( data:dict, katalog:Datakatalog ):
+    """
+    Validerer alle features i en Datafangst 1.0 FeatureCollection mot datakatalogen
+
+    ARGUMENTS
+        data : dict, Datafangst 1.0 geojson
+
+        katalog : Datakatalog
+
+    RETURNS
+        liste med meldinger på samme form som validationIssues fra datafangst ( severity, code, message, location )
+    """
+    meldinger = []
+    for lineNo, feature in enumerate( data['features'] ):
+        meldinger.extend( validerFeature( feature, katalog, lineNo=lineNo ))
+    return meldinger
+
+
+def harBlokkerendeFeil( meldinger:list ):
+    """
+    True hvis noen av meldingene har alvorlighetsgrad ERROR
+    """
+    return any( x['severity'] == 'ERROR' for x in meldinger )
+
+
+def oppsummer( meldinger:list, utskrift=True ):
+    """
+    Teller meldinger per alvorlighetsgrad og kode
+
+    RETURNS
+        collections.Counter med ( severity, code ) => antall
+    """
+    telling = Counter( ( x['severity'], x['code'] ) for x in meldinger )
+    if utskrift:
+        if len( telling ) == 0:
+            print( "Ingen valideringsmeldinger" )
+        for ( severity, code ), antall in telling.most_common():
+            print( f"\t{severity:<9} {code:<35} {antall}" )
+    return telling
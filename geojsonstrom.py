@@ -0,0 +1,296 @@
+"""
+Strømmende lesing og skriving av store GeoJSON FeatureCollections
+
+Leser en FeatureCollection bit for bit (f.eks fra requests.Response.iter_content) og gir fra seg ett og ett
+feature, slik at hele samlingen aldri ligger i minnet. Brukes av df10.lagreFeatureCollections for å kopiere
+features rett fra responsen til disk, med ekstra egenskaper (validationStatus) lagt på underveis.
+
+Formater ved skriving
+    'innrykk' : Som json.dump( ..., indent=4 ), slik lagreFeatureCollections alltid har gjort
+    'kompakt' : Uten mellomrom og linjeskift, vesentlig mindre filer
+    'ndjson'  : Newline-delimited GeoJSON, ett feature per linje og ingen FeatureCollection rundt
+"""
+import codecs
+import json
+
+import dfjson
+
+FORMATER = ( 'innrykk', 'kompakt', 'ndjson' )
+FILENDELSE = { 'innrykk' : '.geojson', 'kompakt' : '.geojson', 'ndjson' : '.geojsonl' }
+
+_dekoder = json.JSONDecoder()
+_blanke = ' \t\n\r'
+
+
+class _Leser:
+    """
+    Holder en tekstbuffer over en strøm av bytes, og fyller på ved behov
+    """
+    def __init__( self, biter, minsteBit=1 << 16, plassering=False ):
+        self.biter = iter( biter )
+        self.tekstdekoder = codecs.getincrementaldecoder( 'utf-8' )()
+        self.buffer = ''
+        self.pos = 0
+        self.tom = False
+        self.minsteBit = minsteBit
+        # Med plassering=True holder vi rede på byteposisjonen i kilden: byteMerke er posisjonen til buffer[merke]
+        self.plassering = plassering
+        self.merke = 0
+        self.byteMerke = 0
+
+    def bytePos( self ):
+        """
+        Byteposisjon (UTF-8) i kilden for buffer[pos]. Hvert tegn telles bare én gang
+        """
+        if self.pos > self.merke:
+            tekst = self.buffer[self.merke:self.pos]
+            self.byteMerke += len( tekst ) if tekst.isascii() else len( tekst.encode( 'utf-8' ))
+            self.merke = self.pos
+        return self.byteMerke
+
+    def fyll( self, minstLengde=0 ):
+        """
+        Leser mer fra strømmen. Returnerer False når strømmen er tom
+        """
+        if self.tom:
+            return False
+        if self.pos > 0:
+            if self.plassering:
+                self.bytePos()
+                self.merke = 0
+            self.buffer = self.buffer[self.pos:]
+            self.pos = 0
+        lest = []
+        lengde = len( self.buffer )
+        maal = max( minstLengde, lengde + 1 )
+        while lengde < maal:
+            try:
+                bit = next( self.biter )
+            except StopIteration:
+                lest.append( self.tekstdekoder.decode( b'', final=True ))
+                self.tom = True
+                break
+            if isinstance( bit, str ):
+                bit = bit.encode( 'utf-8' )
+            tekst = self.tekstdekoder.decode( bit )
+            lest.append( tekst )
+            lengde += len( tekst )
+        self.buffer += ''.join( lest )
+        return True
+
+    def hoppOverBlanke( self ):
+        while True:
+            while self.pos < len( self.buffer ) and self.buffer[self.pos] in _blanke:
+                self.pos += 1
+            if self.pos < len( self.buffer ) or not self.fyll():
+                return
+
+    def tegn( self ):
+        self.hoppOverBlanke()
+        if self.pos >= len( self.buffer ):
+            raise ValueError( 'Uventet slutt på GeoJSON-strømmen' )
+        return self.buffer[self.pos]
+
+    def forvent( self, tegn:str ):
+        if self.tegn() != tegn:
+            raise ValueError( f"Ugyldig GeoJSON: Forventet '{tegn}', fant '{self.buffer[self.pos:self.pos+20]}'" )
+        self.pos += 1
+
+    def verdi( self ):
+        """
+        Leser én komplett JSON-verdi. Fyller bufferet til verdien kan dekodes
+        """
+        self.hoppOverBlanke()
+        if self.plassering:
+            self.bytePos()
+        while True:
+            try:
+                verdi, slutt = _dekoder.raw_decode( self.buffer, self.pos )
+            except json.JSONDecodeError:
+                # Dobler bufferet før neste forsøk, så store verdier ikke dekodes om og om igjen
+                if not self.fyll( minstLengde=max( self.minsteBit, 2 * ( len( self.buffer ) - self.pos ))):
+                    raise
+                continue
+            # Tall kan være avkuttet midt i, må se tegnet etter før vi stoler på verdien
+            if slutt >= len( self.buffer ) and not self.tom:
+                self.fyll( minstLengde=len( self.buffer ) - self.pos + 1 )
+                continue
+            self.pos = slutt
+            return verdi
+
+
+def lesFeatureCollection( biter, plassering=False ):
+    """
+    Leser en GeoJSON FeatureCollection fra en strøm og gir fra seg elementene etter hvert som de blir lest
+
+    ARGUMENTS
+        biter : iterable med bytes (eller str), f.eks requests.Response.iter_content( chunk_size=65536 ) eller en åpen fil
+
+    KEYWORDS
+        plassering : bool, default False. Med True er feature-elementene ( 'feature', indeks, feature, ( start, lengde )),
+                     der start og lengde er bytes i kilden (UTF-8), slik at featuret kan leses direkte med seek
+
+    YIELDS
+        ( 'medlem', navn, verdi ) for toppnivå-elementer utenom features (type, crs, ...)
+
+        ( 'feature', indeks, feature ) for hvert feature i features-lista
+
+        ( 'medlem', 'features', [] ) hvis features-lista er tom, der den står i kilden
+    """
+    leser = _Leser( biter, plassering=plassering )
+    leser.forvent( '{' )
+    if leser.tegn() == '}':
+        return
+    while True:
+        navn = leser.verdi()
+        leser.forvent( ':' )
+        if navn == 'features' and leser.tegn() == '[':
+            leser.forvent( '[' )
+            indeks = 0
+            if leser.tegn() == ']':
+                leser.pos += 1
+                yield ( 'medlem', navn, [] )
+            else:
+                while True:
+                    if plassering:
+                        feature = leser.verdi()
+                        start = leser.byteMerke
+                        yield ( 'feature', indeks, feature, ( start, leser.bytePos() - start ))
+                    else:
+                        yield ( 'feature', indeks, leser.verdi() )
+                    indeks += 1
+                    if leser.tegn() == ',':
+                        leser.pos += 1
+                        continue
+                    leser.forvent( ']' )
+                    break
+        else:
+            yield ( 'medlem', navn, leser.verdi() )
+
+        if leser.tegn() == ',':
+            leser.pos += 1
+            continue
+        leser.forvent( '}' )
+        return
+
+
+def lesFeatures( biter ):
+    """
+    Gir fra seg ett og ett feature fra en GeoJSON FeatureCollection i en strøm, se lesFeatureCollection
+    """
+    for slag, _, verdi in lesFeatureCollection( biter ):
+        if slag == 'feature':
+            yield verdi
+
+
+def lesFeaturesMedPlassering( biter ):
+    """
+    Som lesFeatures, men gir fra seg ( feature, ( start, lengde )) med byteposisjon i kilden, se lesFeatureCollection
+    """
+    for element in lesFeatureCollection( biter, plassering=True ):
+        if element[0] == 'feature':
+            yield element[2], element[3]
+
+
+def _dumps( data, format:str ):
+    if format == 'innrykk':
+        return json.dumps( data, indent=4, ensure_ascii=False )
+    return dfjson.dumpsTekst( data )
+
+
+def _rykkInn( tekst:str, antall:int ):
+    return tekst.replace( '\n', '\n' + ' ' * antall )
+
+
+def skrivFeatureCollection( biter, fp, ekstraEgenskaper=None, format='innrykk', hvertFeature=None ):
+    """
+    Kopierer en FeatureCollection fra en strøm til en åpen tekstfil, ett feature av gangen
+
+    ARGUMENTS
+        biter : iterable med bytes, se lesFeatureCollection
+
+        fp : fil åpnet for skriving i tekstmodus
+
+    KEYWORDS
+        ekstraEgenskaper : dict, default None. Legges til properties på hvert feature underveis
+
+        format : 'innrykk' (default), 'kompakt' eller 'ndjson'. Se beskrivelse øverst i modulen
+
+        hvertFeature : funksjon, default None. Kalles med ( indeks, feature, ( start, lengde )) for hvert feature som er skrevet,
+                        der start og lengde er bytes (UTF-8) i fila, f.eks for å bygge romlig indeks underveis (se romligindeks).
+                        Forutsetter at fp er en ny fil uten oversetting av linjeskift
+
+    RETURNS
+        antall features som ble skrevet
+    """
+    if format not in FORMATER:
+        raise ValueError( f"Ukjent format {format}, må være en av {FORMATER}" )
+
+    antall = 0
+    forsteMedlem = True
+    iFeatures = False
+    harFeatures = False
+    nl = '\n' if format == 'innrykk' else ''
+    innrykk = '    ' if format == 'innrykk' else ''
+    kolon = ': ' if format == 'innrykk' else ':'
+
+    # Teller bytes som er skrevet når vi trenger plasseringen til hvert feature
+    skrevet = 0
+    def skriv( tekst ):
+        nonlocal skrevet
+        fp.write( tekst )
+        if hvertFeature is not None:
+            skrevet += len( tekst ) if tekst.isascii() else len( tekst.encode( 'utf-8' ))
+
+    if format != 'ndjson':
+        skriv( '{' )
+
+    for slag, navn, verdi in lesFeatureCollection( biter ):
+        if slag == 'feature':
+            harFeatures = True
+            if ekstraEgenskaper:
+                if not isinstance( verdi.get( 'properties' ), dict ):
+                    verdi['properties'] = { }
+                verdi['properties'].update( ekstraEgenskaper )
+
+            if format == 'ndjson':
+                tekst = _dumps( verdi, format )
+                start = skrevet
+                skriv( tekst )
+                lengde = skrevet - start
+                skriv( '\n' )
+            else:
+                if not iFeatures:
+                    skriv( ( '' if forsteMedlem else ',' ) + nl + innrykk + json.dumps( 'features' ) + kolon + '[' )
+                    forsteMedlem = False
+                    iFeatures = True
+                skriv( ( '' if antall == 0 else ',' ) + nl + innrykk * 2 )
+                start = skrevet
+                skriv( _rykkInn( _dumps( verdi, format ), 8 if nl else 0 ))
+                lengde = skrevet - start
+            if hvertFeature is not None:
+                hvertFeature( antall, verdi, ( start, lengde ))
+            antall += 1
+            continue
+
+        if iFeatures:
+            skriv( nl + innrykk + ']' )
+            iFeatures = False
+
+        if navn == 'features':
+            # Tom features-liste, skrives der den står i kilden
+            harFeatures = True
+
+        if format != 'ndjson':
+            skriv( ( '' if forsteMedlem else ',' ) + nl + innrykk + json.dumps( navn, ensure_ascii=False ) + kolon +
+                        _rykkInn( _dumps( verdi, format ), 4 if nl else 0 ))
+            forsteMedlem = False
+
+    if format != 'ndjson':
+        if iFeatures:
+            skriv( nl + innrykk + ']' )
+        elif not harFeatures:
+            skriv( ( '' if forsteMedlem else ',' ) + nl + innrykk + '"features"' + kolon + '[]' )
+        skriv( nl + '}' )
+
+    return antall
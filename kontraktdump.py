@@ -0,0 +1,298 @@
+"""
+Nedlasting av mange DF1.0-kontrakter i parallell, med felles hastighetsbegrensning og sjekkpunkt
+
+df10.lagreFeatureCollections tar én kontrakt. Her fordeles featureCollections fra alle kontraktene på én felles
+trådpool, og alle kall går gjennom én dfklient.Hastighetsbegrenser (kall per sekund og samtidige kall per server),
+så serveren ikke får mer enn vi har bestemt uansett hvor mange kontrakter og tråder som er i sving.
+
+Hver kontrakt lagres i sin egen mappe (mappenavn/<kontrakt-ID>, med kontrakt.json og én fil per featureCollection).
+Fremdriften skrives fortløpende til en journal (sjekkpunkt.jsonl i mappenavn), én linje per ferdig featureCollection
+og per ferdig kontrakt. Blir jobben avbrutt, kjører du den på nytt med samme mappenavn, og den fortsetter der den
+slapp: ferdige kontrakter og featureCollections hoppes over, resten lastes ned. Kontrakter der noe feilet blir ikke
+merket som ferdige, og prøves på nytt neste gang.
+
+Eksempel
+    resultat = kontraktdump.dumpKontrakter( 'snapshot/2024-06-01', user='jajens', pw=pw, maksParallelle=8, perSekund=20, maksSamtidige=6 )
+"""
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime
+import json
+import os
+import threading
+
+import df10
+import dfklient
+import geojsonstrom
+import romligindeks
+
+SJEKKPUNKT = 'sjekkpunkt.jsonl'
+KONTRAKTFIL = 'kontrakt.json'
+
+
+class Sjekkpunkt:
+    """
+    Journal over ferdige featureCollections og kontrakter, append-only JSON lines i mappenavn/sjekkpunkt.jsonl
+
+    Hver linje skrives og flushes så snart en featureCollection er lagret, så et avbrudd mister høyst det som var
+    under nedlasting. En halvskrevet siste linje (avbrudd midt i skrivingen) ignoreres ved lesing.
+
+    ARGUMENTS
+        mappenavn : str, rotmappe for nedlastingen
+
+    KEYWORDS
+        format : str, filformat for nedlastingen. Fortsetter vi en jobb med et annet format blir det ValueError
+
+        nyStart : bool, default False. True sletter eksisterende journal, og alt lastes ned på nytt
+    """
+
+    def __init__( self, mappenavn:str, format='innrykk', nyStart=False ):
+        self.filnavn = os.path.join( mappenavn, SJEKKPUNKT )
+        self.format = format
+        self.featureCollections = { }
+        self.ferdige = { }
+        self._laas = threading.Lock()
+
+        if nyStart and os.path.exists( self.filnavn ):
+            os.remove( self.filnavn )
+
+        nyFil = not os.path.exists( self.filnavn )
+        if not nyFil:
+            self._les()
+        self._fp = open( self.filnavn, 'a', encoding='utf-8' )
+        if nyFil:
+            self._skriv( { 'format' : format, 'startet' : str( datetime.now() )[0:19] } )
+
+    def _les( self ):
+        with open( self.filnavn, encoding='utf-8' ) as fp:
+            for linje in fp:
+                try:
+                    rad = json.loads( linje )
+                except ValueError:
+                    continue
+                if 'format' in rad and rad['format'] != self.format:
+                    raise ValueError( f"Journalen {self.filnavn} er for format {rad['format']}, ikke {self.format}. Bruk samme format, annen mappe eller nyStart=True" )
+                kontrakt = rad.get( 'kontrakt' )
+                if kontrakt is None:
+                    continue
+                if 'featureCollection' in rad:
+                    self.featureCollections.setdefault( kontrakt, { } )[rad['featureCollection']] = rad['antall']
+                elif rad.get( 'ferdig' ):
+                    self.ferdige[kontrakt] = rad
+
+    def _skriv( self, rad:dict ):
+        rad['tid'] = str( datetime.now() )[0:19]
+        with self._laas:
+            self._fp.write( json.dumps( rad, ensure_ascii=False ) + '\n' )
+            self._fp.flush()
+
+    def erFerdig( self, contractId:str ):
+        return contractId in self.ferdige
+
+    def ferdigeFeatureCollections( self, contractId:str ):
+        """
+        dict featureCollection ID => antall vegobjekter for det som allerede er lagret på kontrakten
+        """
+        return dict( self.featureCollections.get( contractId, { } ))
+
+    def featureCollectionFerdig( self, contractId:str, featureCollectionId:str, antall:int ):
+        self.featureCollections.setdefault( contractId, { } )[featureCollectionId] = antall
+        self._skriv( { 'kontrakt' : contractId, 'featureCollection' : featureCollectionId, 'antall' : antall } )
+
+    def kontraktFerdig( self, contractId:str, antall:int ):
+        rad = { 'kontrakt' : contractId, 'ferdig' : True, 'antall' : antall }
+        self.ferdige[contractId] = rad
+        self._skriv( rad )
+
+    def lukk( self ):
+        self._fp.close()
+
+    def __enter__( self ):
+        return self
+
+    def __exit__( self, *args ):
+        self.lukk()
+
+
+def _kontraktIder( kontrakter ):
+    """
+    Liste med kontrakt-ID fra contractList (dict fra df10.alleKontrakter), kontraktkatalog.Kontraktkatalog,
+    eller liste med ID'er og/eller kontrakt-dict
+    """
+    if hasattr( kontrakter, 'contractList' ):
+        kontrakter = kontrakter.contractList
+    if isinstance( kontrakter, dict ):
+        kontrakter = kontrakter['contracts']
+    if isinstance( kontrakter, str ):
+        kontrakter = [ kontrakter ]
+    ider = [ str( x['id'] ) if isinstance( x, dict ) else str( x ) for x in kontrakter ]
+    return list( dict.fromkeys( ider ))
+
+
+def _hentKontrakt( contractId:str, mappenavn:str, api:str, klient ):
+    """
+    Metadata og liste med featureCollections for én kontrakt. Metadata lagres i kontrakt.json
+    """
+    metadata = df10.get_data( api + contractId, klient=klient )
+    featureCollections = df10.alleFeaturecollections( contractId, api=api, klient=klient )['featureCollections']
+    os.makedirs( mappenavn, exist_ok=True )
+    filnavn = os.path.join( mappenavn, KONTRAKTFIL )
+    with open( filnavn + '.tmp', 'w', encoding='utf-8' ) as fp:
+        json.dump( metadata, fp, indent=4, ensure_ascii=False )
+    os.replace( filnavn + '.tmp', filnavn )
+    return metadata, featureCollections
+
+
+def dumpKontrakter( mappenavn:str, kontrakter=None, api='https://datafangst.vegvesen.no/api/v1/contract/', user='jajens', pw=None, klient=None,
+                    maksParallelle=8, perSekund=None, maksSamtidige=None, format='innrykk', romligIndeks=False, nyStart=False ):
+    """
+    Laster ned alle featureCollections på mange kontrakter i parallell, med felles hastighetsbegrensning og sjekkpunkt
+
+    Kan avbrytes (Ctrl-C, kill, nettverksbrudd) og kjøres på nytt med samme mappenavn, da fortsetter den der den slapp.
+
+    ARGUMENTS
+        mappenavn : str, rotmappe. Hver kontrakt lagres i mappenavn/<kontrakt-ID>, journalen i mappenavn/sjekkpunkt.jsonl
+
+    KEYWORDS
+        kontrakter : None (default, alle kontrakter du har tilgang til, fra df10.alleKontrakter), contractList,
+                     kontraktkatalog.Kontraktkatalog eller liste med kontrakt-ID
+
+        maksParallelle : int, default 8. Antall tråder, deles av alle kontraktene
+
+        perSekund : float, maks antall kall per sekund mot serveren, summert over alle tråder. Default ingen grense
+
+        maksSamtidige : int, maks antall kall som er i gang samtidig mot serveren. Default ingen grense utover maksParallelle
+
+        klient : dfklient.DatafangstKlient. Uten klient lages en klient med innlogging og poolstorrelse >= maksParallelle.
+                 Med perSekund eller maksSamtidige settes begrenser på klienten hvis den ikke har en fra før
+
+        format : 'innrykk' (default), 'kompakt' eller 'ndjson', se df10.lagreFeatureCollections
+
+        romligIndeks : bool, default False. Bygger romlig indeks i mappen til hver kontrakt, se romligindeks
+
+        nyStart : bool, default False. True ignorerer (sletter) journalen fra forrige kjøring og laster ned alt på nytt
+
+    RETURNS
+        dict med
+            kontrakter : antall kontrakter i jobben
+            ferdig     : liste med kontrakt-ID som ble ferdige i denne kjøringen
+            hoppetOver : liste med kontrakt-ID som var ferdige fra før (sjekkpunkt)
+            feilet     : dict kontrakt-ID => liste med featureCollection ID som feilet (tom liste hvis selve kontrakten feilet)
+            features   : dict kontrakt-ID => dict featureCollection ID => antall vegobjekter (også fra tidligere kjøringer)
+            begrenser  : antall kall og samlet ventetid i hastighetsbegrenseren per server
+    """
+    t0 = datetime.now()
+
+    if format not in geojsonstrom.FORMATER:
+        raise ValueError( f"Ukjent format {format}, må være en av {geojsonstrom.FORMATER}")
+
+    if klient is None:
+        user, pw = df10._brukerOgPassord( user, pw, api )
+        klient = dfklient.DatafangstKlient( api=api, user=user, pw=pw, poolstorrelse=max( 10, maksParallelle ))
+    elif not klient.harInnlogging():
+        raise ValueError( "Klienten må ha innlogging (user og pw på DatafangstKlient), trådene kan ikke spørre etter passord" )
+
+    if klient.begrenser is None and ( perSekund or maksSamtidige ):
+        klient.begrenser = dfklient.Hastighetsbegrenser( perSekund=perSekund, maksSamtidige=maksSamtidige )
+
+    if kontrakter is None:
+        kontrakter = df10.alleKontrakter( url=api, klient=klient )
+    kontrakter = _kontraktIder( kontrakter )
+
+    os.makedirs( mappenavn, exist_ok=True )
+    sjekkpunkt = Sjekkpunkt( mappenavn, format=format, nyStart=nyStart )
+
+    resultat = { 'kontrakter' : len( kontrakter ), 'ferdig' : [], 'hoppetOver' : [], 'feilet' : { }, 'features' : { }, 'begrenser' : { } }
+    gjenstaar = [ ]
+    for contractId in kontrakter:
+        if sjekkpunkt.erFerdig( contractId ):
+            resultat['hoppetOver'].append( contractId )
+            resultat['features'][contractId] = sjekkpunkt.ferdigeFeatureCollections( contractId )
+        else:
+            gjenstaar.append( contractId )
+
+    print( f"{len( kontrakter )} kontrakter lagres til {mappenavn}, {len( resultat['hoppetOver'] )} er ferdige fra før og hoppes over" )
+    if klient.begrenser is not None:
+        print( f"Hastighetsbegrensning: {klient.begrenser.perSekund or 'ubegrenset'} kall per sekund og "
+               f"{klient.begrenser.maksSamtidige or 'ubegrenset'} samtidige kall per server" )
+
+    # Per kontrakt: featureCollections som ikke er ferdige ennå, og de som har feilet
+    aapne = { }
+    indekser = { }
+
+    def _kontraktMappe( contractId ):
+        return os.path.join( mappenavn, contractId )
+
+    def _avslutt( contractId ):
+        tilstand = aapne.pop( contractId )
+        if contractId in indekser:
+            indekser.pop( contractId ).lukk()
+        if tilstand['feilet']:
+            resultat['feilet'][contractId] = tilstand['feilet']
+            print( f"Kontrakt {contractId}: {len( tilstand['feilet'] )} av {tilstand['antall']} feature collections feilet, prøves på nytt neste gang" )
+        else:
+            sjekkpunkt.kontraktFerdig( contractId, tilstand['antall'] )
+            resultat['ferdig'].append( contractId )
+            print( f"Kontrakt {tilstand['navn']} {contractId} ferdig, {tilstand['antall']} feature collections. "
+                   f"{len( resultat['ferdig'] ) + len( resultat['feilet'] )} av {len( gjenstaar )} kontrakter, tidsbruk så langt: {datetime.now()-t0}" )
+
+    pool = ThreadPoolExecutor( max_workers=maksParallelle )
+    jobber = { pool.submit( _hentKontrakt, contractId, _kontraktMappe( contractId ), api, klient ) : ( contractId, None ) for contractId in gjenstaar }
+    try:
+        while jobber:
+            ferdige, _ = wait( jobber, return_when=FIRST_COMPLETED )
+            for jobb in ferdige:
+                contractId, col = jobber.pop( jobb )
+                try:
+                    svar = jobb.result()
+                except Exception as e:
+                    if col is None:
+                        resultat['feilet'][contractId] = []
+                        print( f"\t-> Feilet for kontrakt {contractId}: {e}" )
+                        continue
+                    aapne[contractId]['feilet'].append( col['id'] )
+                    print( f"\t-> Feilet for feature collection {col['id']} på kontrakt {contractId}: {e}" )
+                else:
+                    if col is None:
+                        metadata, featureCollections = svar
+                        tidligere = sjekkpunkt.ferdigeFeatureCollections( contractId )
+                        mappe = _kontraktMappe( contractId )
+                        nye = [ x for x in featureCollections if not ( x['id'] in tidligere and
+                                        os.path.exists( os.path.join( mappe, x['id'] + geojsonstrom.FILENDELSE[format] ))) ]
+                        resultat['features'][contractId] = { x['id'] : tidligere[x['id']] for x in featureCollections if x['id'] in tidligere }
+                        aapne[contractId] = { 'navn' : metadata.get( 'name', '' ), 'antall' : len( featureCollections ), 'igjen' : len( nye ), 'feilet' : [] }
+                        print( f"Kontrakt {metadata.get( 'name', '' )} {contractId}: {len( featureCollections )} feature collections, "
+                               f"{len( featureCollections ) - len( nye )} ferdige fra før" )
+                        if nye and romligIndeks:
+                            indekser[contractId] = romligindeks.Romligindeks( mappe )
+                        for nyCol in nye:
+                            jobber[pool.submit( df10._lagreEnFeatureCollection, nyCol, mappe, klient=klient, format=format,
+                                                indeks=indekser.get( contractId ))] = ( contractId, nyCol )
+                        if not nye:
+                            _avslutt( contractId )
+                        continue
+
+                    sjekkpunkt.featureCollectionFerdig( contractId, col['id'], svar )
+                    resultat['features'][contractId][col['id']] = svar
+
+                aapne[contractId]['igjen'] -= 1
+                if aapne[contractId]['igjen'] == 0:
+                    _avslutt( contractId )
+
+    except BaseException:
+        print( f"Avbrutt, {len( resultat['ferdig'] )} kontrakter ble ferdige. Kjør på nytt med samme mappe for å fortsette" )
+        pool.shutdown( wait=True, cancel_futures=True )
+        raise
+
+    finally:
+        pool.shutdown( wait=True )
+        for indeks in indekser.values():
+            indeks.lukk()
+        sjekkpunkt.lukk()
+
+    if klient.begrenser is not None:
+        resultat['begrenser'] = klient.begrenser.statistikk()
+
+    if resultat['feilet']:
+        print( f"{len( resultat['feilet'] )} av {len( kontrakter )} kontrakter feilet helt eller delvis: {list( resultat['feilet'] )}" )
+    print( f"Tidsbruk totalt: {datetime.now()-t0}" )
+    return resultat
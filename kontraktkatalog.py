@@ -0,0 +1,181 @@
+"""
+Hurtigbufret og indeksert kontraktliste fra DF1.0 contract-endepunktet
+
+df10.alleKontrakter henter hele listen hver gang, og df10.searchContracts kopierer den og leter gjennom alle
+navnene for hvert søk. Kontraktkatalog henter listen én gang, gjenbruker den i ttl sekunder, og bygger et
+oppslag på ID og en n-gram-indeks (3 tegn) over normaliserte kontraktnavn. Et søk slår da opp i noen få
+mengder i stedet for å gå gjennom alle kontraktene. Treffene er de samme dict-objektene som i listen fra API,
+ingenting blir kopiert.
+
+Eksempel
+    katalog = kontraktkatalog.hentKatalog( user='jajens', pw=pw )
+    katalog.sok( 'trafikkspeil' )
+    katalog.sok( 'E6', status='ACTIVE' )
+    katalog.hent( kontraktId )
+"""
+import hashlib
+import threading
+import time
+import unicodedata
+
+import df10
+
+NGRAM = 3
+
+
+def normaliser( tekst ):
+    """
+    Normalisert tekst for søk: små bokstaver (casefold), NFC og mellomrom slått sammen
+    """
+    return ' '.join( unicodedata.normalize( 'NFC', str( tekst )).casefold().split() )
+
+
+def _ngrammer( tekst:str ):
+    return { tekst[i:i+NGRAM] for i in range( len( tekst ) - NGRAM + 1 ) }
+
+
+class Kontraktkatalog:
+    """
+    Kontraktliste med TTL og søkeindeks
+
+    KEYWORDS
+        url, user, pw, klient : som for df10.alleKontrakter. Mangler brukernavn eller passord spør vi én gang her,
+                                ikke ved hver fornying (som kan skje i en annen tråd)
+
+        ttl : sekund, default 900. Hvor lenge listen gjenbrukes før den hentes på nytt. None = aldri på nytt
+
+        contractList : dict fra df10.alleKontrakter. Gir katalog uten nettverkskall (og uten automatisk fornying)
+    """
+
+    def __init__( self, url='https://datafangst.vegvesen.no/api/v1/contract/', user='jajens', pw=None, klient=None, ttl=900, contractList=None ):
+        self.url = url
+        self.klient = klient
+        self.ttl = ttl
+        self._las = threading.Lock()
+        self.hentet = None
+        if contractList is not None:
+            self.user, self.pw = user, pw
+            self.ttl = None
+            self._bygg( contractList )
+        else:
+            self.user, self.pw = df10._brukerOgPassord( user, pw, url, klient=klient )
+
+    def _bygg( self, contractList:dict ):
+        kontrakter = contractList['contracts']
+        navn = [ normaliser( x.get( 'name', '' )) for x in kontrakter ]
+        indeks = { }
+        for nr, etNavn in enumerate( navn ):
+            for ngram in _ngrammer( etNavn ):
+                indeks.setdefault( ngram, set() ).add( nr )
+
+        # Bytter ut alt samtidig, så andre tråder aldri ser en halvferdig indeks
+        self._data = ( contractList, kontrakter, navn, indeks, { str( x['id'] ) : x for x in kontrakter } )
+        self.hentet = time.monotonic()
+
+    def _gyldig( self ):
+        if self.hentet is None:
+            return False
+        return self.ttl is None or time.monotonic() - self.hentet < self.ttl
+
+    def oppdater( self ):
+        """
+        Henter kontraktlisten på nytt og bygger indeksen
+        """
+        with self._las:
+            self._bygg( df10.alleKontrakter( url=self.url, user=self.user, pw=self.pw, klient=self.klient ))
+        return self
+
+    def _hentData( self ):
+        if not self._gyldig():
+            with self._las:
+                if not self._gyldig():
+                    self._bygg( df10.alleKontrakter( url=self.url, user=self.user, pw=self.pw, klient=self.klient ))
+        return self._data
+
+    @property
+    def contractList( self ):
+        """
+        dict slik den kom fra API (med listen i contractList['contracts'])
+        """
+        return self._hentData()[0]
+
+    @property
+    def kontrakter( self ):
+        return self._hentData()[1]
+
+    def __len__( self ):
+        return len( self.kontrakter )
+
+    def hent( self, kontraktId ):
+        """
+        Kontrakt med gitt ID, eller None
+        """
+        return self._hentData()[4].get( str( kontraktId ))
+
+    def _kandidater( self, tekst:str, navn:list, indeks:dict ):
+        """
+        Indekser til kontrakter der tekst (normalisert) er en del av navnet
+        """
+        if len( tekst ) < NGRAM:
+            return [ nr for nr, etNavn in enumerate( navn ) if tekst in etNavn ]
+
+        # Starter med den minste mengden, og sjekker til slutt at hele teksten faktisk finnes i navnet
+        mengder = sorted( ( indeks.get( x, set() ) for x in _ngrammer( tekst )), key=len )
+        kandidater = set.intersection( *mengder ) if mengder else set()
+        return sorted( nr for nr in kandidater if tekst in navn[nr] )
+
+    def sok( self, tekst=None, **metadata ):
+        """
+        Finner kontrakter der tekst er en del av navnet og/eller metadata stemmer
+
+        ARGUMENTS
+            tekst : str, del av kontraktnavnet (uavhengig av store/små bokstaver). None = alle kontrakter
+
+        KEYWORDS
+            metadata : felt i kontrakten med ønsket verdi, f.eks status='ACTIVE'. Verdien kan også være
+                       en funksjon som returnerer True for treff, eller liste/mengde med godkjente verdier
+
+        RETURNS
+            liste med kontrakter (de samme dict-objektene som i kontraktlisten) i samme rekkefølge som fra API
+        """
+        _, kontrakter, navn, indeks, _ = self._hentData()
+        if tekst is None:
+            treff = kontrakter
+        else:
+            treff = [ kontrakter[nr] for nr in self._kandidater( normaliser( tekst ), navn, indeks ) ]
+
+        for felt, onsket in metadata.items():
+            if callable( onsket ):
+                treff = [ x for x in treff if onsket( x.get( felt )) ]
+            elif isinstance( onsket, ( list, tuple, set, frozenset )):
+                treff = [ x for x in treff if x.get( felt ) in onsket ]
+            else:
+                treff = [ x for x in treff if x.get( felt ) == onsket ]
+        return treff
+
+    def __repr__( self ):
+        antall = len( self._data[1] ) if self.hentet is not None else 'ikke hentet'
+        return f"Kontraktkatalog( {self.url}, {antall} kontrakter )"
+
+
+_kataloger = { }
+_katalogLas = threading.Lock()
+
+
+def hentKatalog( url='https://datafangst.vegvesen.no/api/v1/contract/', user='jajens', pw=None, klient=None, ttl=900 ):
+    """
+    Felles Kontraktkatalog per url, bruker, passord og klient, slik at alle søk i samme prosess bruker samme liste og indeks
+
+    Passord og klient er med i nøkkelen, så et kall med annet (f.eks rettet) passord eller annen klient får egen katalog
+    i stedet for å arve innloggingen til den som kalte først. ttl er ikke med i nøkkelen, den felles katalogen får ttl fra
+    siste kall
+    """
+    # Hash i stedet for selve passordet i nøkkelen. Katalogen holder på klienten, så id( klient ) gjenbrukes ikke
+    pwHash = hashlib.sha256( pw.encode( 'utf-8' )).hexdigest() if isinstance( pw, str ) else None
+    nokkel = ( url, user, pwHash, id( klient ) if klient is not None else None )
+    with _katalogLas:
+        if nokkel not in _kataloger:
+            _kataloger[nokkel] = Kontraktkatalog( url=url, user=user, pw=pw, klient=klient, ttl=ttl )
+        else:
+            _kataloger[nokkel].ttl = ttl
+        return _kataloger[nokkel]
@@ -0,0 +1,291 @@
+"""
+Transformasjon av koordinater til UTM sone 33 (EPSG:25833) på klientsiden, før innsending
+
+Nesten alle innsendinger får valideringsmeldingen KOORDINATER_TRANSFORMERT ("Koordinater ble transformert til UTM33N"),
+dvs serveren projiserer om dataene våre hver gang. Her finner vi koordinatsystemet (crs-elementet, eller gjetning ut fra
+koordinatene), og transformerer alle koordinater i hele FeatureCollection i én vektorisert operasjon (numpy), før
+df10.postFeatureCollection / df20.lastOppGeojson. Resultatet har crs EPSG:25833.
+
+Med pyproj installert brukes den, og da støttes alle koordinatsystem pyproj kjenner. Uten pyproj bruker vi Krügers
+formler for transversal Mercator (Karney 2011, 6. orden, nøyaktighet langt under millimeteren) for geografiske
+koordinater (EPSG:4326, 4258, CRS84) og UTM sone 32, 33 og 35 (EUREF89 / WGS84, også med NN2000-høyde som 5972, 5973, 5975).
+EUREF89 og WGS84 regnes da som like, de skiller i dag omtrent en meter. Det tas med i rapportert nøyaktighet.
+
+Høyder (z) endres ikke.
+
+Eksempel
+    data, rapport = koordinater.tilUtm33( minGeojson )
+    df10.postFeatureCollection( kontrakt, data, user='jajens', pw=pw )
+"""
+import math
+import re
+
+try:
+    import numpy as np
+except ImportError:
+    # df10, df20 og dfasync importerer modulen, numpy trengs bare når vi faktisk transformerer
+    np = None
+
+import dfjson
+
+try:
+    import pyproj
+except ImportError:
+    pyproj = None
+
+UTM33 = 25833
+
+# Geografiske koordinatsystem vi kan regne på uten pyproj, og sentralmeridian for UTM-sonene
+GEOGRAFISKE = ( 4326, 4258, 'CRS84' )
+UTMSONER = { 25832 : 9, 25833 : 15, 25835 : 27, 5972 : 9, 5973 : 15, 5975 : 27, 32632 : 9, 32633 : 15, 32635 : 27 }
+
+# GRS80, som i praksis er lik WGS84
+_A = 6378137.0
+_F = 1 / 298.257222101
+_K0 = 0.9996
+_FALSK_OST = 500000.0
+
+
+def _krugerKoeffisienter():
+    n = _F / ( 2 - _F )
+    n2, n3, n4, n5, n6 = n**2, n**3, n**4, n**5, n**6
+    A = _A / ( 1 + n ) * ( 1 + n2 / 4 + n4 / 64 + n6 / 256 )
+    alfa = ( n / 2 - 2 * n2 / 3 + 5 * n3 / 16 + 41 * n4 / 180 - 127 * n5 / 288 + 7891 * n6 / 37800,
+             13 * n2 / 48 - 3 * n3 / 5 + 557 * n4 / 1440 + 281 * n5 / 630 - 1983433 * n6 / 1935360,
+             61 * n3 / 240 - 103 * n4 / 140 + 15061 * n5 / 26880 + 167603 * n6 / 181440,
+             49561 * n4 / 161280 - 179 * n5 / 168 + 6601661 * n6 / 7257600,
+             34729 * n5 / 80640 - 3418889 * n6 / 1995840,
+             212378941 * n6 / 319334400 )
+    beta = ( n / 2 - 2 * n2 / 3 + 37 * n3 / 96 - n4 / 360 - 81 * n5 / 512 + 96199 * n6 / 604800,
+             n2 / 48 + n3 / 15 - 437 * n4 / 1440 + 46 * n5 / 105 - 1118711 * n6 / 3870720,
+             17 * n3 / 480 - 37 * n4 / 840 - 209261 * n5 / 4838400 + 5569 * n6 / 90720,
+             4397 * n4 / 161280 - 11 * n5 / 504 - 830251 * n6 / 7257600,
+             4583 * n5 / 161280 - 108847 * n6 / 3991680,
+             20648693 * n6 / 638668800 )
+    return A, alfa, beta
+
+
+_A_REKTIFISERT, _ALFA, _BETA = _krugerKoeffisienter()
+_E = math.sqrt( _F * ( 2 - _F ))
+
+
+def tilUtm( lon, lat, sentralmeridian:float ):
+    """
+    Geografiske koordinater (grader, numpy-array) til UTM med gitt sentralmeridian (grader)
+    """
+    phi = np.radians( lat )
+    lam = np.radians( lon - sentralmeridian )
+    tau = np.tan( phi )
+    sigma = np.sinh( _E * np.arctanh( _E * tau / np.sqrt( 1 + tau**2 )))
+    tauMerket = tau * np.sqrt( 1 + sigma**2 ) - sigma * np.sqrt( 1 + tau**2 )
+    xiMerket = np.arctan2( tauMerket, np.cos( lam ))
+    etaMerket = np.arcsinh( np.sin( lam ) / np.sqrt( tauMerket**2 + np.cos( lam )**2 ))
+    xi, eta = xiMerket.copy(), etaMerket.copy()
+    for j, a in enumerate( _ALFA, start=1 ):
+        xi += a * np.sin( 2 * j * xiMerket ) * np.cosh( 2 * j * etaMerket )
+        eta += a * np.cos( 2 * j * xiMerket ) * np.sinh( 2 * j * etaMerket )
+    return _FALSK_OST + _K0 * _A_REKTIFISERT * eta, _K0 * _A_REKTIFISERT * xi
+
+
+def fraUtm( x, y, sentralmeridian:float ):
+    """
+    UTM med gitt sentralmeridian (grader) til geografiske koordinater ( lon, lat ) i grader
+    """
+    xi = y / ( _K0 * _A_REKTIFISERT )
+    eta = ( x - _FALSK_OST ) / ( _K0 * _A_REKTIFISERT )
+    xiMerket, etaMerket = xi.copy(), eta.copy()
+    for j, b in enumerate( _BETA, start=1 ):
+        xiMerket -= b * np.sin( 2 * j * xi ) * np.cosh( 2 * j * eta )
+        etaMerket -= b * np.cos( 2 * j * xi ) * np.sinh( 2 * j * eta )
+    tauMerket = np.sin( xiMerket ) / np.sqrt( np.sinh( etaMerket )**2 + np.cos( xiMerket )**2 )
+    lam = np.arctan2( np.sinh( etaMerket ), np.cos( xiMerket ))
+
+    # Newton-iterasjon fra konform til geodetisk breddegrad
+    e2 = _E**2
+    tau = tauMerket.copy()
+    for _ in range( 5 ):
+        sigma = np.sinh( _E * np.arctanh( _E * tau / np.sqrt( 1 + tau**2 )))
+        tauI = tau * np.sqrt( 1 + sigma**2 ) - sigma * np.sqrt( 1 + tau**2 )
+        tau += ( tauMerket - tauI ) / np.sqrt( 1 + tauI**2 ) * ( 1 + ( 1 - e2 ) * tau**2 ) / ( ( 1 - e2 ) * np.sqrt( 1 + tau**2 ))
+    return np.degrees( lam ) + sentralmeridian, np.degrees( np.arctan( tau ))
+
+
+def lesCrs( data:dict ):
+    """
+    EPSG-kode (int) fra crs-elementet i en FeatureCollection, 'CRS84' for urn:ogc:def:crs:OGC:1.3:CRS84, None hvis det mangler
+    """
+    navn = ( ( data.get( 'crs' ) or { } ).get( 'properties' ) or { } ).get( 'name' )
+    if not navn:
+        return None
+    if navn.upper().endswith( 'CRS84' ):
+        return 'CRS84'
+    treff = re.search( r'EPSG:+(?:[\d.]*:)?(\d+)$', navn, flags=re.IGNORECASE )
+    if not treff:
+        raise ValueError( f"Forstår ikke koordinatsystemet {navn}" )
+    return int( treff.group( 1 ))
+
+
+def _koordinatlister( geometri, ut:list ):
+    """
+    Samler alle punkter (lister med x, y [, z]) i en geometri, i rekkefølge
+    """
+    if not geometri:
+        return
+    if geometri.get( 'type' ) == 'GeometryCollection':
+        for enGeometri in geometri.get( 'geometries' ) or []:
+            _koordinatlister( enGeometri, ut )
+        return
+
+    def samle( koordinater ):
+        if koordinater and isinstance( koordinater[0], ( int, float )):
+            ut.append( koordinater )
+        else:
+            for del_ in koordinater or []:
+                samle( del_ )
+    samle( geometri.get( 'coordinates' ))
+
+
+def gjettCrs( x, y ):
+    """
+    Gjetter koordinatsystem ut fra koordinatene: geografiske hvis alle ligger innenfor lengde- og breddegrad, ellers UTM33
+    """
+    if len( x ) and np.all( np.abs( x ) <= 180 ) and np.all( np.abs( y ) <= 90 ):
+        return 4326
+    return UTM33
+
+
+def _erGeografisk( crs ):
+    return crs in GEOGRAFISKE
+
+
+def _erWgs84( crs ):
+    return crs in ( 4326, 'CRS84' ) or 32600 < crs < 32661
+
+
+def transformer( x, y, fraCrs, tilCrs=UTM33 ):
+    """
+    Transformerer koordinater (numpy-array) fra fraCrs til tilCrs
+
+    RETURNS
+        ( x, y, metode, noyaktighet ), der noyaktighet er anslått nøyaktighet i meter (None hvis ukjent)
+    """
+    if fraCrs == tilCrs:
+        return x, y, 'ingen', 0.0
+
+    if pyproj is not None:
+        fra = 'OGC:CRS84' if fraCrs == 'CRS84' else f"EPSG:{fraCrs}"
+        transformasjon = pyproj.Transformer.from_crs( fra, f"EPSG:{tilCrs}", always_xy=True )
+        nyX, nyY = transformasjon.transform( x, y )
+        noyaktighet = transformasjon.accuracy if transformasjon.accuracy >= 0 else None
+        return np.asarray( nyX ), np.asarray( nyY ), 'pyproj ' + transformasjon.description, noyaktighet
+
+    if tilCrs not in UTMSONER or not ( _erGeografisk( fraCrs ) or fraCrs in UTMSONER ):
+        raise ValueError( f"Transformasjon fra {fraCrs} til {tilCrs} krever pyproj (pip install pyproj)" )
+
+    if _erGeografisk( fraCrs ):
+        lon, lat = x, y
+    else:
+        lon, lat = fraUtm( x, y, UTMSONER[fraCrs] )
+    nyX, nyY = tilUtm( lon, lat, UTMSONER[tilCrs] )
+
+    # Nøyaktighet: største avvik når vi regner tilbake, pluss forskjellen på EUREF89 og WGS84 hvis vi bytter mellom dem
+    tilbakeLon, tilbakeLat = fraUtm( nyX, nyY, UTMSONER[tilCrs] )
+    if _erGeografisk( fraCrs ):
+        tilbakeX, tilbakeY = tilUtm( tilbakeLon, tilbakeLat, UTMSONER[tilCrs] )
+        avvik = np.hypot( tilbakeX - nyX, tilbakeY - nyY )
+    else:
+        tilbakeX, tilbakeY = tilUtm( tilbakeLon, tilbakeLat, UTMSONER[fraCrs] )
+        avvik = np.hypot( tilbakeX - x, tilbakeY - y )
+    noyaktighet = float( np.max( avvik )) if len( avvik ) else 0.0
+    if _erWgs84( fraCrs ) != _erWgs84( tilCrs ):
+        noyaktighet += 1.0
+    return nyX, nyY, 'Krüger transversal Mercator', noyaktighet
+
+
+def tilUtm33( data, fraCrs=None, desimaler=3, kopi=True, utskrift=True ):
+    """
+    Transformerer alle geometrier i en FeatureCollection til EPSG:25833 i én operasjon
+
+    ARGUMENTS
+        data : dict (Datafangst geojson) eller featuretable.FeatureTable
+
+    KEYWORDS
+        fraCrs : EPSG-kode, default None (fra crs-elementet, ellers gjettet ut fra koordinatene)
+
+        desimaler : int, default 3 (millimeter). None gir ingen avrunding
+
+        kopi : bool, default True. Med kopi=False endres data direkte
+
+        utskrift : bool, default True
+
+    RETURNS
+        ( data, rapport ), der rapport er dict med fraCrs, tilCrs, antatt (True hvis fraCrs er gjettet), antallPunkter,
+        metode og noyaktighet (anslått nøyaktighet i meter)
+    """
+    tabell = None if isinstance( data, dict ) else data
+    metadata = data if tabell is None else tabell.metadata
+
+    punkter = []
+    if tabell is None:
+        if kopi:
+            # Rundtur via JSON er mye raskere enn deepcopy for store FeatureCollections
+            data = dfjson.loads( dfjson.dumps( data ))
+            metadata = data
+        for feature in data.get( 'features' ) or []:
+            _koordinatlister( feature.get( 'geometry' ), punkter )
+        x = np.array( [ p[0] for p in punkter ], dtype=np.float64 )
+        y = np.array( [ p[1] for p in punkter ], dtype=np.float64 )
+    else:
+        if kopi:
+            tabell = tabell.utvalg( slice( None ))
+            metadata = tabell.metadata
+            data = tabell
+        if tabell.andreGeometrier:
+            # GeometryCollection o.l. ligger som geojson ved siden av koordinatmatrisen, og deles med originalen etter utvalg
+            if kopi:
+                tabell.andreGeometrier = { rad : dfjson.loads( dfjson.dumps( geometri )) for rad, geometri in tabell.andreGeometrier.items() }
+            for rad in sorted( tabell.andreGeometrier ):
+                _koordinatlister( tabell.andreGeometrier[rad], punkter )
+        x = np.concatenate( [ tabell.x, np.array( [ p[0] for p in punkter ], dtype=np.float64 ) ] )
+        y = np.concatenate( [ tabell.y, np.array( [ p[1] for p in punkter ], dtype=np.float64 ) ] )
+
+    antatt = False
+    if fraCrs is None:
+        fraCrs = lesCrs( metadata )
+    if fraCrs is None:
+        fraCrs = gjettCrs( x, y )
+        antatt = True
+
+    nyX, nyY, metode, noyaktighet = transformer( x, y, fraCrs, UTM33 )
+    if desimaler is not None:
+        nyX, nyY = np.round( nyX, desimaler ), np.round( nyY, desimaler )
+
+    iTabell = 0 if tabell is None else len( tabell.koordinater )
+    for punkt, verdiX, verdiY in zip( punkter, nyX[iTabell:].tolist(), nyY[iTabell:].tolist() ):
+        punkt[0] = verdiX
+        punkt[1] = verdiY
+    if tabell is not None:
+        tabell.koordinater[:, 0] = nyX[:iTabell]
+        tabell.koordinater[:, 1] = nyY[:iTabell]
+    metadata['crs'] = { 'type' : 'name', 'properties' : { 'name' : f"EPSG:{UTM33}" } }
+
+    rapport = { 'fraCrs' : fraCrs, 'tilCrs' : UTM33, 'antatt' : antatt, 'antallPunkter' : len( x ), 'metode' : metode,
+                'noyaktighet' : noyaktighet }
+    if utskrift and fraCrs != UTM33:
+        print( f"Transformerte {len( x )} punkter fra {'antatt ' if antatt else ''}{fraCrs} til EPSG:{UTM33} med {metode}, "
+               f"nøyaktighet {'ukjent' if noyaktighet is None else f'{noyaktighet:.3f} m'}" )
+    return data, rapport
+
+
+def forInnsending( data ):
+    """
+    Felles for utm33=True i df10, df20 og dfasync: Kopi av data transformert til EPSG:25833, og rapporten fra tilUtm33
+
+    RETURNS
+        ( data, rapport ), se tilUtm33
+    """
+    if np is None:
+        raise ImportError( "utm33=True krever numpy" )
+    if not isinstance( data, dict ):
+        raise ValueError( "utm33=True krever at geojson er dict" )
+    return tilUtm33( data )
@@ -0,0 +1,402 @@
+"""
+Romlig indeks over featureCollections som er lagret til disk, for bbox-, nærmeste- og vegobjekttype-søk
+
+Når en kontrakt er lagret med df10.lagreFeatureCollections (eller speiling.synkroniserKontrakt) måtte vi før lese
+og gå gjennom alle filene for å finne "alle features innenfor dette området" eller "alle bomstasjoner nær dette
+punktet". Her lagres bbox, featureId og typeId for hvert feature i en SQLite-fil (romligindeks.sqlite) ved siden av
+filene, med R-tre (SQLite rtree) over bbox. Søk over alle featureCollections tar da millisekunder. Indeksen har også
+byteposisjon og lengde for hvert feature i fila, så hentFeatures leser bare inn de features som traff (seek).
+
+Indeksen bygges underveis i nedlastingen med lagreFeatureCollections( ..., romligIndeks=True ), eller i ettertid for en
+eksisterende mappe med Romligindeks.oppdater, som bare leser filer som er nye eller endret siden sist.
+
+Koordinatene er de som står i fila, søkene må bruke samme koordinatsystem (normalt EPSG:25833).
+
+Eksempel
+    df10.lagreFeatureCollections( kontrakt, 'speil/minkontrakt', user='jajens', pw=pw, romligIndeks=True )
+    with romligindeks.Romligindeks( 'speil/minkontrakt' ) as indeks:
+        treff = indeks.finn( bbox=( 260000, 6640000, 270000, 6650000 ), typeId=45 )
+        bomstasjoner = list( indeks.hentFeatures( treff ))
+        naermeste = indeks.naermeste( 262000, 6645000, antall=5, typeId=45 )
+"""
+import math
+import os
+import sqlite3
+import threading
+
+import dfjson
+import geojsonstrom
+
+FILNAVN = 'romligindeks.sqlite'
+
+_SKJEMA = """
+create table if not exists fil (
+    id integer primary key,
+    filnavn text unique not null,
+    featureCollectionId text,
+    endret real,
+    storrelse integer,
+    antall integer );
+create table if not exists feature (
+    id integer primary key,
+    filId integer not null,
+    indeks integer not null,
+    featureId text,
+    typeId integer,
+    minx real, miny real, maxx real, maxy real,
+    start integer,
+    lengde integer );
+create index if not exists feature_fil on feature( filId, indeks );
+create index if not exists feature_type on feature( typeId );
+create index if not exists feature_id on feature( featureId );
+"""
+
+_SELECT = "select fil.filnavn, fil.featureCollectionId, f.indeks, f.featureId, f.typeId, f.minx, f.miny, f.maxx, f.maxy, f.start, f.lengde"
+
+# R-treet lagrer 32 bits flyttall avrundet utover, så vi filtrerer grovt på boks og så eksakt på feature
+_OVERLAPP = ( "b.minx <= ? and b.maxx >= ? and b.miny <= ? and b.maxy >= ? "
+              "and f.minx <= ? and f.maxx >= ? and f.miny <= ? and f.maxy >= ?" )
+
+
+def _harRtree( db ):
+    try:
+        db.execute( "create virtual table temp._proveRtree using rtree( id, minx, maxx, miny, maxy )" )
+        db.execute( "drop table temp._proveRtree" )
+        return True
+    except sqlite3.OperationalError:
+        return False
+
+
+def _utvid( koordinater, boks ):
+    if not koordinater:
+        return
+    if isinstance( koordinater[0], ( int, float )):
+        x, y = koordinater[0], koordinater[1]
+        if x < boks[0]: boks[0] = x
+        if y < boks[1]: boks[1] = y
+        if x > boks[2]: boks[2] = x
+        if y > boks[3]: boks[3] = y
+        return
+    for del_ in koordinater:
+        _utvid( del_, boks )
+
+
+def bbox( geometri ):
+    """
+    ( minx, miny, maxx, maxy ) for en GeoJSON-geometri, None hvis geometri mangler eller er tom
+    """
+    if not geometri:
+        return None
+    boks = [ math.inf, math.inf, -math.inf, -math.inf ]
+    if geometri.get( 'type' ) == 'GeometryCollection':
+        for enGeometri in geometri.get( 'geometries' ) or []:
+            enBoks = bbox( enGeometri )
+            if enBoks:
+                _utvid( [ enBoks[0:2], enBoks[2:4] ], boks )
+    else:
+        _utvid( geometri.get( 'coordinates' ), boks )
+    if boks[0] == math.inf:
+        return None
+    return tuple( boks )
+
+
+def _featureId( feature:dict ):
+    fid = feature.get( 'id' )
+    return None if fid is None else str( fid )
+
+
+def _typeId( feature:dict ):
+    typeId = ( feature.get( 'properties' ) or { } ).get( 'typeId' )
+    try:
+        return int( typeId ) if typeId is not None else None
+    except ( TypeError, ValueError ):
+        return None
+
+
+class Samler:
+    """
+    Samler indeksrader for én fil mens den skrives, brukes som hvertFeature i geojsonstrom.skrivFeatureCollection
+    """
+    def __init__( self ):
+        self.rader = []
+
+    def __call__( self, indeks:int, feature:dict, plassering=None ):
+        self.rader.append( ( indeks, _featureId( feature ), _typeId( feature ), bbox( feature.get( 'geometry' )), plassering ))
+
+
+class Romligindeks:
+    """
+    Romlig indeks (SQLite med R-tre) over geojson-filene i en mappe
+
+    ARGUMENTS
+        mappenavn : str, mappe med featureCollections lagret av df10.lagreFeatureCollections eller speiling
+
+    KEYWORDS
+        filnavn : str, default romligindeks.sqlite i mappenavn
+    """
+
+    def __init__( self, mappenavn:str, filnavn=None ):
+        self.mappenavn = mappenavn
+        self.filnavn = filnavn or os.path.join( mappenavn, FILNAVN )
+        self.db = sqlite3.connect( self.filnavn, check_same_thread=False )
+        self.db.executescript( _SKJEMA )
+        kolonner = [ rad[1] for rad in self.db.execute( "pragma table_info( feature )" ) ]
+        if 'start' not in kolonner:
+            # Indeks laget før vi lagret byteposisjon, hentFeatures leser disse filene fra starten til de er indeksert på nytt
+            self.db.executescript( "alter table feature add column start integer; alter table feature add column lengde integer;" )
+        self.rtree = _harRtree( self.db )
+        if self.rtree:
+            self.db.execute( "create virtual table if not exists boks using rtree( id, minx, maxx, miny, maxy )" )
+        else:
+            # Uten rtree-modul blir det vanlig tabell med indeks, samme spørringer men tregere
+            self.db.executescript( """create table if not exists boks ( id integer primary key, minx real, maxx real, miny real, maxy real );
+                                      create index if not exists boks_x on boks( minx, maxx );""" )
+        self._las = threading.Lock()
+
+    def __enter__( self ):
+        return self
+
+    def __exit__( self, *args ):
+        self.lukk()
+
+    def lukk( self ):
+        self.db.close()
+
+    def _slettFil( self, filId:int ):
+        self.db.execute( "delete from boks where id in ( select id from feature where filId = ? )", ( filId, ))
+        self.db.execute( "delete from feature where filId = ?", ( filId, ))
+        self.db.execute( "delete from fil where id = ?", ( filId, ))
+
+    def leggTilFil( self, filnavn:str, rader, featureCollectionId=None ):
+        """
+        Legger inn (eller erstatter) indeksen for én fil
+
+        ARGUMENTS
+            filnavn : str, geojson-fil i mappen
+
+            rader : liste med ( indeks, featureId, typeId, bbox, ( start, lengde ) ), f.eks Samler.rader. Plasseringen
+                    (bytes i fila) kan være None
+        """
+        navn = os.path.basename( filnavn )
+        sti = os.path.join( self.mappenavn, navn )
+        if featureCollectionId is None:
+            featureCollectionId = os.path.splitext( navn )[0]
+        endret, storrelse = ( os.path.getmtime( sti ), os.path.getsize( sti )) if os.path.exists( sti ) else ( None, None )
+
+        with self._las, self.db:
+            gammel = self.db.execute( "select id from fil where filnavn = ?", ( navn, )).fetchone()
+            if gammel:
+                self._slettFil( gammel[0] )
+            filId = self.db.execute( "insert into fil ( filnavn, featureCollectionId, endret, storrelse, antall ) values ( ?, ?, ?, ?, ? )",
+                                     ( navn, featureCollectionId, endret, storrelse, len( rader ))).lastrowid
+            forste = self.db.execute( "select coalesce( max( id ), 0 ) + 1 from feature" ).fetchone()[0]
+            self.db.executemany( "insert into feature ( id, filId, indeks, featureId, typeId, minx, miny, maxx, maxy, start, lengde ) "
+                                 "values ( ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ? )",
+                                 ( ( forste + nr, filId, rad[0], rad[1], rad[2] ) + tuple( rad[3] or ( None, ) * 4 ) +
+                                   tuple( ( rad[4] if len( rad ) > 4 else None ) or ( None, None ))
+                                   for nr, rad in enumerate( rader )))
+            self.db.executemany( "insert into boks values ( ?, ?, ?, ?, ? )",
+                                 ( ( forste + nr, rad[3][0], rad[3][2], rad[3][1], rad[3][3] ) for nr, rad in enumerate( rader ) if rad[3] ))
+        return len( rader )
+
+    def indekserFil( self, filnavn:str ):
+        """
+        Leser én geojson- eller geojsonl-fil og legger den inn i indeksen
+        """
+        samler = Samler()
+        sti = os.path.join( self.mappenavn, os.path.basename( filnavn ))
+        with open( sti, 'rb' ) as fp:
+            if sti.lower().endswith( geojsonstrom.FILENDELSE['ndjson'] ):
+                indeks = 0
+                start = 0
+                for linje in fp:
+                    if linje.strip():
+                        samler( indeks, dfjson.loads( linje ), ( start, len( linje.rstrip( b'\r\n' ))))
+                        indeks += 1
+                    start += len( linje )
+            else:
+                features = geojsonstrom.lesFeaturesMedPlassering( iter( lambda: fp.read( 1 << 16 ), b'' ))
+                for indeks, ( feature, plassering ) in enumerate( features ):
+                    samler( indeks, feature, plassering )
+        return self.leggTilFil( sti, samler.rader )
+
+    def oppdater( self ):
+        """
+        Oppdaterer indeksen mot filene i mappen: indekserer nye og endrede filer, og fjerner filer som er borte
+
+        RETURNS
+            dict med antall filer som er indeksert, fjernet og uendret
+        """
+        endelser = tuple( set( geojsonstrom.FILENDELSE.values() ))
+        filer = { x : os.path.join( self.mappenavn, x ) for x in os.listdir( self.mappenavn ) if x.lower().endswith( endelser ) }
+        kjente = { navn : ( filId, endret, storrelse ) for filId, navn, endret, storrelse in self.db.execute( "select id, filnavn, endret, storrelse from fil" ) }
+        resultat = { 'indeksert' : 0, 'fjernet' : 0, 'uendret' : 0 }
+
+        for navn, ( filId, _, _ ) in kjente.items():
+            if navn not in filer:
+                with self._las, self.db:
+                    self._slettFil( filId )
+                resultat['fjernet'] += 1
+
+        for navn, sti in sorted( filer.items() ):
+            kjent = kjente.get( navn )
+            if kjent and kjent[1] == os.path.getmtime( sti ) and kjent[2] == os.path.getsize( sti ):
+                resultat['uendret'] += 1
+                continue
+            self.indekserFil( sti )
+            resultat['indeksert'] += 1
+        return resultat
+
+    def _betingelser( self, typeId=None, featureCollectionId=None ):
+        sql = []
+        param = []
+        if typeId is not None:
+            typer = [ typeId ] if isinstance( typeId, int ) else list( typeId )
+            sql.append( f"f.typeId in ( {','.join( '?' * len( typer ))} )" )
+            param.extend( typer )
+        if featureCollectionId is not None:
+            sql.append( "fil.featureCollectionId = ?" )
+            param.append( featureCollectionId )
+        return sql, param
+
+    def _treff( self, rad ):
+        filnavn, featureCollectionId, indeks, fid, typeId, minx, miny, maxx, maxy, start, lengde = rad
+        return { 'filnavn' : filnavn, 'featureCollectionId' : featureCollectionId, 'indeks' : indeks, 'featureId' : fid, 'typeId' : typeId,
+                 'bbox' : ( minx, miny, maxx, maxy ) if minx is not None else None,
+                 'plassering' : ( start, lengde ) if start is not None else None }
+
+    def finn( self, bbox=None, typeId=None, featureCollectionId=None, antall=None ):
+        """
+        Finner features med bbox som overlapper søkeområdet
+
+        KEYWORDS
+            bbox : ( minx, miny, maxx, maxy ), default None (ingen romlig avgrensning)
+
+            typeId : int eller liste med vegobjekttype-ID
+
+            featureCollectionId : str, søk bare i én featureCollection
+
+            antall : int, maks antall treff
+
+        RETURNS
+            liste med treff (dict med filnavn, featureCollectionId, indeks, featureId, typeId, bbox og plassering
+            ( start, lengde ) i bytes i fila), se hentFeatures
+        """
+        betingelser, param = self._betingelser( typeId=typeId, featureCollectionId=featureCollectionId )
+        sql = _SELECT + " from feature f join fil on fil.id = f.filId"
+        if bbox is not None:
+            sql = _SELECT + " from boks b join feature f on f.id = b.id join fil on fil.id = f.filId"
+            betingelser[0:0] = [ _OVERLAPP ]
+            param[0:0] = [ bbox[2], bbox[0], bbox[3], bbox[1] ] * 2
+        if betingelser:
+            sql += " where " + " and ".join( betingelser )
+        sql += " order by fil.filnavn, f.indeks"
+        if antall:
+            sql += f" limit {int( antall )}"
+        return [ self._treff( rad ) for rad in self.db.execute( sql, param ) ]
+
+    def naermeste( self, x:float, y:float, antall=1, typeId=None, featureCollectionId=None, maksAvstand=None ):
+        """
+        Finner features nærmest punktet ( x, y ), målt til bbox (eksakt for punkter)
+
+        KEYWORDS
+            antall : int, default 1
+
+            maksAvstand : float, default None. Uten maksAvstand søkes det til hele indeksen er dekket
+
+        RETURNS
+            liste med treff som i finn, sortert på avstand, med avstand i tillegg
+        """
+        betingelser, param = self._betingelser( typeId=typeId, featureCollectionId=featureCollectionId )
+        utstrekning = self.db.execute( "select min( minx ), min( miny ), max( maxx ), max( maxy ) from feature" ).fetchone()
+        if utstrekning[0] is None:
+            return []
+        storst = max( abs( x - utstrekning[0] ), abs( x - utstrekning[2] ), abs( y - utstrekning[1] ), abs( y - utstrekning[3] ))
+        if maksAvstand is not None:
+            storst = min( storst, maksAvstand )
+
+        sql = _SELECT + " from boks b join feature f on f.id = b.id join fil on fil.id = f.filId where " + _OVERLAPP
+        if betingelser:
+            sql += " and " + " and ".join( betingelser )
+
+        # Doblet søkeradius til vi har nok treff innenfor radius, kandidater utenfor radius kan ha nærmere naboer vi ikke har sett
+        radius = min( 100.0, storst ) or 1.0
+        while True:
+            # Siste runde dekker hele utstrekningen, da tar vi med alt (også hjørnene, ut til √2·storst)
+            sisteRunde = radius >= storst
+            kandidater = []
+            for rad in self.db.execute( sql, [ x + radius, x - radius, y + radius, y - radius ] * 2 + param ):
+                treff = self._treff( rad )
+                minx, miny, maxx, maxy = treff['bbox']
+                treff['avstand'] = math.hypot( max( minx - x, 0, x - maxx ), max( miny - y, 0, y - maxy ))
+                if treff['avstand'] <= radius or sisteRunde:
+                    kandidater.append( treff )
+            if len( kandidater ) >= antall or sisteRunde:
+                break
+            radius = min( radius * 2, storst )
+
+        kandidater.sort( key=lambda t: t['avstand'] )
+        if maksAvstand is not None:
+            kandidater = [ t for t in kandidater if t['avstand'] <= maksAvstand ]
+        return kandidater[0:antall]
+
+    def antallPerType( self ):
+        """
+        dict typeId => antall features i indeksen
+        """
+        return dict( self.db.execute( "select typeId, count(*) from feature group by typeId order by count(*) desc" ))
+
+    def hentFeatures( self, treff ):
+        """
+        Leser inn features for treff fra finn / naermeste. Hvert feature leses direkte fra sin plassering i fila (seek), uten
+        å gå gjennom resten av fila. Filer indeksert uten plassering, eller som er endret siden de ble indeksert (featureId
+        stemmer ikke), leses strømmende fra starten og bare til og med siste feature som trengs
+
+        YIELDS
+            ( treff, feature ), gruppert per fil
+        """
+        perFil = { }
+        for etTreff in treff:
+            perFil.setdefault( etTreff['filnavn'], { } )[etTreff['indeks']] = etTreff
+
+        for filnavn, perIndeks in perFil.items():
+            sti = os.path.join( self.mappenavn, filnavn )
+            with open( sti, 'rb' ) as fp:
+                direkte = self._lesDirekte( fp, perIndeks )
+                if direkte is not None:
+                    yield from direkte
+                    continue
+                fp.seek( 0 )
+                yield from self._lesFraStart( fp, sti, perIndeks )
+
+    def _lesDirekte( self, fp, perIndeks:dict ):
+        """
+        Leser features på indeksert plassering. None hvis noe mangler eller ikke stemmer, da leser vi fila fra starten i stedet
+        """
+        funnet = []
+        for indeks in sorted( perIndeks ):
+            etTreff = perIndeks[indeks]
+            plassering = etTreff.get( 'plassering' )
+            if not plassering:
+                return None
+            fp.seek( plassering[0] )
+            try:
+                feature = dfjson.loads( fp.read( plassering[1] ))
+            except ValueError:
+                return None
+            if not isinstance( feature, dict ) or _featureId( feature ) != etTreff['featureId']:
+                return None
+            funnet.append( ( etTreff, feature ))
+        return funnet
+
+    def _lesFraStart( self, fp, sti:str, perIndeks:dict ):
+        sisteIndeks = max( perIndeks )
+        if sti.lower().endswith( geojsonstrom.FILENDELSE['ndjson'] ):
+            features = ( dfjson.loads( linje ) for linje in fp if linje.strip() )
+        else:
+            features = geojsonstrom.lesFeatures( iter( lambda: fp.read( 1 << 16 ), b'' ))
+        for indeks, feature in enumerate( features ):
+            if indeks in perIndeks:
+                yield perIndeks[indeks], feature
+            if indeks >= sisteIndeks:
+                break
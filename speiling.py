@@ -0,0 +1,205 @@
+"""
+Inkrementell speiling av en DF1.0-kontrakt til lokal mappe
+
+Første gang lastes alle featureCollections ned, akkurat som df10.lagreFeatureCollections. I tillegg skrives
+en manifest-fil (manifest.json) med ID, ETag / Last-Modified, innholds-hash og siste validationStatus for hver
+featureCollection. Neste gang sendes betingede kall (If-None-Match / If-Modified-Since), og kun featureCollections
+som er nye eller endret blir lastet ned og skrevet på nytt. featureCollections som er slettet på serveren fjernes
+lokalt. En nattlig speiling av en uendret kontrakt består da stort sett av statuskall og HTTP 304-svar.
+
+Eksempel
+    oppsummering = speiling.synkroniserKontrakt( kontrakt, 'speil/minkontrakt', user='jajens', pw=pw, maksParallelle=8 )
+"""
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+import hashlib
+import json
+import os
+import time
+
+import df10
+import dfjson
+import geojsonstrom
+
+MANIFEST = 'manifest.json'
+
+# Sekund mellom hver mellomlagring av manifest under synkronisering, så et avbrudd ikke mister ETag for det som er lastet ned
+LAGRE_HVERT = 5
+
+
+def lesManifest( mappenavn:str ):
+    """
+    Leser manifest for en speilet kontrakt. Returnerer tomt manifest hvis det ikke finnes
+    """
+    filnavn = os.path.join( mappenavn, MANIFEST )
+    if not os.path.exists( filnavn ):
+        return { 'featureCollections' : { } }
+    with open( filnavn, encoding='utf-8' ) as fp:
+        return json.load( fp )
+
+
+def _skrivManifest( mappenavn:str, manifest:dict ):
+    filnavn = os.path.join( mappenavn, MANIFEST )
+    with open( filnavn + '.tmp', 'w', encoding='utf-8' ) as fp:
+        json.dump( manifest, fp, indent=4, ensure_ascii=False )
+    os.replace( filnavn + '.tmp', filnavn )
+
+
+def _hashetStrom( biter, sha ):
+    for bit in biter:
+        sha.update( bit )
+        yield bit
+
+
+def _oppdaterStatusLokalt( filnavn:str, format:str, validationStatus:str ):
+    """
+    Skriver lokal fil på nytt med ny validationStatus, uten å laste ned data fra serveren
+    """
+    with open( filnavn, 'rb' ) as inn, open( filnavn + '.tmp', 'w', encoding='utf-8' ) as ut:
+        if format == 'ndjson':
+            for linje in inn:
+                if linje.strip():
+                    feature = dfjson.loads( linje )
+                    feature.setdefault( 'properties', { } )['validationStatus'] = validationStatus
+                    ut.write( dfjson.dumpsTekst( feature ) + '\n' )
+        else:
+            geojsonstrom.skrivFeatureCollection( iter( lambda: inn.read( 1 << 16 ), b'' ), ut,
+                                                    ekstraEgenskaper={ 'validationStatus' : validationStatus }, format=format )
+    os.replace( filnavn + '.tmp', filnavn )
+
+
+def _synkroniserEn( col:dict, mappenavn:str, forrige:dict, format:str, user=None, pw=None, klient=None ):
+    """
+    Synkroniserer én featureCollection. Returnerer ( resultat, manifestelement ), der resultat er 'ny', 'endret' eller 'uendret'
+    """
+    src = [ x for x in col['resources'] if 'src' in x ]
+    url = src[0]['src']
+    filnavn = os.path.join( mappenavn, col['id'] + geojsonstrom.FILENDELSE[format] )
+    status = df10.get_data( url + '/status', user=user, pw=pw, klient=klient )
+
+    betingelse = { }
+    if forrige and os.path.exists( filnavn ):
+        if forrige.get( 'etag' ):
+            betingelse['If-None-Match'] = forrige['etag']
+        if forrige.get( 'lastModified' ):
+            betingelse['If-Modified-Since'] = forrige['lastModified']
+
+    element = dict( forrige ) if forrige else { }
+    element['validationStatus'] = status['validationStatus']
+    element['filnavn'] = os.path.basename( filnavn )
+    element['sjekket'] = str( datetime.now() )[0:19]
+
+    with df10.get_stream( url, user=user, pw=pw, geojson=True, klient=klient, headers=betingelse ) as r:
+        if r.status_code == 304:
+            if forrige.get( 'validationStatus' ) == status['validationStatus']:
+                return 'uendret', element
+            _oppdaterStatusLokalt( filnavn, format, status['validationStatus'] )
+            return 'endret', element
+
+        sha = hashlib.sha256()
+        with open( filnavn + '.tmp', 'w', encoding='utf-8' ) as fp:
+            antall = geojsonstrom.skrivFeatureCollection( _hashetStrom( r.iter_content( chunk_size=1 << 16 ), sha ), fp,
+                                        ekstraEgenskaper={ 'validationStatus' : status['validationStatus'] }, format=format )
+        element['etag'] = r.headers.get( 'ETag' )
+        element['lastModified'] = r.headers.get( 'Last-Modified' )
+
+    element['sha256'] = sha.hexdigest()
+    element['antallFeatures'] = antall
+
+    if forrige and forrige.get( 'sha256' ) == element['sha256'] and forrige.get( 'validationStatus' ) == status['validationStatus'] and os.path.exists( filnavn ):
+        os.remove( filnavn + '.tmp' )
+        return 'uendret', element
+
+    os.replace( filnavn + '.tmp', filnavn )
+    element['lastet'] = element['sjekket']
+    return ( 'endret' if forrige else 'ny' ), element
+
+
+def synkroniserKontrakt( contractId:str, mappenavn:str, api='https://datafangst.vegvesen.no/api/v1/contract/', user='jajens', pw=None,
+                            klient=None, maksParallelle=1, format='innrykk', slettFjernede=True ):
+    """
+    Inkrementell speiling av alle featureCollections på kontrakten til mappenavn. Se beskrivelse øverst i modulen.
+
+    ARGUMENTS:
+        contractId : ID på kontrakt
+
+        mappenavn : tekst, navn på mappen med speilet (inkludert manifest.json)
+
+    KEYWORDS
+        maksParallelle : int, default 1. Antall featureCollections som synkroniseres samtidig
+
+        format : 'innrykk', 'kompakt' eller 'ndjson', se df10.lagreFeatureCollections. Bytter du format
+                 blir alt lastet ned på nytt
+
+        slettFjernede : bool, default True. Sletter lokale filer for featureCollections som ikke lenger finnes på serveren
+
+        api, user, pw, klient : som for df10.lagreFeatureCollections
+
+    RETURNS
+        dictionary med lister av featureCollection ID'er: ny, endret, uendret, slettet og feilet
+    """
+    t0 = datetime.now()
+    if format not in geojsonstrom.FORMATER:
+        raise ValueError( f"Ukjent format {format}, må være en av {geojsonstrom.FORMATER}")
+
+    if not ( klient and klient.harInnlogging() ) and not isinstance( pw, str ):
+        pw = df10.hentPassord( user, api )
+
+    if not os.path.exists( mappenavn ):
+        os.makedirs( mappenavn )
+
+    manifest = lesManifest( mappenavn )
+    if manifest.get( 'format', format ) != format or manifest.get( 'contractId', contractId ) != contractId:
+        print( f"Manifest i {mappenavn} gjelder annen kontrakt eller annet format, laster ned alt på nytt" )
+        manifest = { 'featureCollections' : { } }
+    manifest['contractId'] = contractId
+    manifest['format'] = format
+    kjente = manifest['featureCollections']
+
+    data = df10.alleFeaturecollections( contractId, api=api, user=user, pw=pw, klient=klient )
+    paaServer = { col['id'] : col for col in data['featureCollections'] }
+    print( f"{len(paaServer)} feature collections på kontrakt {contractId}, {len(kjente)} i lokalt speil {mappenavn}" )
+
+    oppsummering = { 'ny' : [], 'endret' : [], 'uendret' : [], 'slettet' : [], 'feilet' : [] }
+    sistLagret = time.monotonic()
+    pool = ThreadPoolExecutor( max_workers=max( 1, maksParallelle ))
+    try:
+        jobber = { pool.submit( _synkroniserEn, col, mappenavn, kjente.get( fcId ), format, user=user, pw=pw, klient=klient ) : fcId
+                    for fcId, col in paaServer.items() }
+        for jobb in as_completed( jobber ):
+            fcId = jobber[jobb]
+            try:
+                resultat, element = jobb.result()
+            except Exception as e:
+                print( f"\t-> Synkronisering feilet for feature collection {fcId}: {e}" )
+                oppsummering['feilet'].append( fcId )
+                continue
+            kjente[fcId] = element
+            oppsummering[resultat].append( fcId )
+            if resultat != 'uendret':
+                print( f"\t-> {resultat}: {fcId} {element['validationStatus']}" )
+                if time.monotonic() - sistLagret >= LAGRE_HVERT:
+                    _skrivManifest( mappenavn, manifest )
+                    sistLagret = time.monotonic()
+    except BaseException:
+        # Avbrudd (Ctrl-C o.l.): dropp nedlastinger som ikke har startet, og ta vare på det som er ferdig,
+        # så neste kjøring kan bruke ETag for det
+        pool.shutdown( wait=True, cancel_futures=True )
+        _skrivManifest( mappenavn, manifest )
+        raise
+    finally:
+        pool.shutdown( wait=True )
+
+    if slettFjernede:
+        for fcId in [ x for x in kjente if x not in paaServer ]:
+            filnavn = os.path.join( mappenavn, kjente[fcId].get( 'filnavn', fcId + geojsonstrom.FILENDELSE[format] ))
+            if os.path.exists( filnavn ):
+                os.remove( filnavn )
+            del kjente[fcId]
+            oppsummering['slettet'].append( fcId )
+
+    manifest['synkronisert'] = str( datetime.now() )[0:19]
+    _skrivManifest( mappenavn, manifest )
+
+    print( f"Synkronisert {mappenavn}: " + ', '.join( f"{len(v)} {k}" for k, v in oppsummering.items() ) + f", tidsbruk totalt: {datetime.now()-t0}" )
+    return oppsummering
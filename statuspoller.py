@@ -0,0 +1,197 @@
+"""
+Asynkron overvåking av valideringsstatus for mange featureCollections på en gang (DF1.0)
+
+Etter df10.postFeatureCollection / df10.putFeatureCollection valideres data asynkront på serveren.
+I stedet for å spørre om status for én og én featureCollection i en løkke kan du gi hele lista til
+overvakStatus, som spør om alle samtidig (med et tak på antall samtidige kall) og sender hver
+statusendring videre til en callback eller som en async iterator.
+
+Eksempel
+    async for endring in statuspoller.overvakStatus( responsListe, user='jajens', pw=pw ):
+        print( endring['featureCollectionId'], endring['validationStatus'] )
+
+    # Eller uten asyncio:
+    sluttstatus = statuspoller.ventPaaStatus( responsListe, user='jajens', pw=pw )
+"""
+import asyncio
+import inspect
+import time
+
+import df10
+import dfklient
+import dfmetrikk
+
+TERMINALE = ( 'ACCEPTED', 'REJECTED' )
+
+# 4xx-koder som kan gå over av seg selv. Andre 4xx (404 o.l.) er permanente, og vi slutter å spørre
+FORBIGAENDE_4XX = ( 408, 409, 425, 429 )
+
+
+def _permanentFeil( unntak ):
+    status = getattr( unntak, 'status_code', None )
+    return isinstance( unntak, dfklient.DatafangstHttpFeil ) and status is not None and 400 <= status < 500 and status not in FORBIGAENDE_4XX
+
+
+def _statusUrl( featureCollection, kontrakt=None, api='https://datafangst.vegvesen.no/api/v1/contract/' ):
+    """
+    Finner (featureCollectionId, status-URL) for en featureCollection.
+
+    featureCollection kan være ID (str, krever kontrakt) eller responsen fra df10.postFeatureCollection / putFeatureCollection
+    """
+    if isinstance( featureCollection, str ):
+        assert kontrakt, 'Må ha kontrakt= når featureCollection er oppgitt med ID'
+        return featureCollection, api + kontrakt + '/featurecollection/' + featureCollection + '/status'
+
+    statusElement = [ x for x in featureCollection['resources'] if x.get( 'rel' ) == 'status' and 'src' in x ]
+    assert len( statusElement ) > 0, f"Finner ikke statuselement for {featureCollection.get( 'featureCollectionId' )}"
+    return featureCollection['featureCollectionId'], statusElement[0]['src']
+
+
+async def _kallCallback( callback, endring ):
+    if callback is None:
+        return
+    resultat = callback( endring )
+    if inspect.isawaitable( resultat ):
+        await resultat
+
+
+async def overvakStatus( featureCollections, kontrakt=None, api='https://datafangst.vegvesen.no/api/v1/contract/', user='jajens', pw=None,
+                            klient=None, maksParallelle=10, startIntervall=2, maksIntervall=60, faktor=1.5, frist=None, maksFeil=10, callback=None ):
+    """
+    Async iterator som følger valideringsstatus for mange featureCollections samtidig
+
+    Hver featureCollection spørres med adaptivt intervall: Starter på startIntervall sekund, og intervallet
+    øker med faktor (opp til maksIntervall) så lenge statusen er uendret. Når statusen endrer seg starter vi
+    på startIntervall igjen. En featureCollection slutter å bli spurt når validationStatus er ACCEPTED eller REJECTED.
+
+    ARGUMENTS
+        featureCollections : liste med featureCollection ID (krever kontrakt=) og/eller responser fra
+                            df10.postFeatureCollection / df10.putFeatureCollection
+
+    KEYWORDS
+        kontrakt : str, ID til kontrakten. Påkrevd hvis featureCollections er oppgitt som ID
+
+        api, user, pw, klient : som for df10.get_data. Bruk gjerne klient med poolstorrelse >= maksParallelle
+
+        maksParallelle : int, default 10. Maks antall statuskall samtidig
+
+        startIntervall, maksIntervall : sekund, default 2 og 60
+
+        faktor : float, default 1.5. Hvor mye intervallet øker når statusen er uendret
+
+        frist : sekund, default None. Slutter å spørre (og melder tidsavbrudd) etter så lang tid
+
+        maksFeil : int, default 10. Slutter å spørre etter så mange feilede statuskall på rad. Permanente feil
+                   (HTTP 4xx som 404, f.eks ukjent featureCollection) gir stopp med en gang
+
+        callback : funksjon eller coroutine som kalles med hver statusendring
+
+    YIELDS
+        dictionary per statusendring med nøklene featureCollectionId, validationStatus, forrigeStatus,
+        terminal (bool), tidsavbrudd (bool), sekunder (tid siden start), status (hele statusresponsen) og
+        feil (feilmelding når vi har gitt opp å spørre, ellers None)
+    """
+    if not ( klient and klient.harInnlogging() ) and not isinstance( pw, str ):
+        pw = df10.hentPassord( user, api )
+
+    t0 = time.monotonic()
+    semafor = asyncio.Semaphore( maksParallelle )
+    ko = asyncio.Queue()
+    ferdig = object()
+
+    async def folgEn( fcId, url ):
+        forrige = None
+        intervall = startIntervall
+        feilPaaRad = 0
+        while True:
+            feil = None
+            try:
+                async with semafor:
+                    status = await asyncio.to_thread( df10.get_data, url, user=user, pw=pw, klient=klient )
+                feilPaaRad = 0
+            except Exception as e:
+                status = None
+                feilPaaRad += 1
+                if _permanentFeil( e ) or feilPaaRad >= maksFeil:
+                    feil = str( e )
+                    print( f"Statuskall for {fcId} feilet: {e}, gir opp" )
+                else:
+                    print( f"Statuskall for {fcId} feilet: {e}, prøver på ny om {intervall:.0f} sekund")
+
+            gjeldende = status.get( 'validationStatus' ) if status else forrige
+            tidsavbrudd = frist is not None and time.monotonic() - t0 + intervall > frist
+            terminal = gjeldende in TERMINALE
+
+            if ( status and gjeldende != forrige ) or ( tidsavbrudd and not terminal ) or feil:
+                await ko.put( { 'featureCollectionId' : fcId,
+                                'validationStatus'    : gjeldende,
+                                'forrigeStatus'       : forrige,
+                                'terminal'            : terminal,
+                                'tidsavbrudd'         : tidsavbrudd and not terminal,
+                                'sekunder'            : round( time.monotonic() - t0, 1 ),
+                                'status'              : status,
+                                'feil'                : feil } )
+                intervall = startIntervall
+            else:
+                intervall = min( maksIntervall, intervall * faktor )
+
+            forrige = gjeldende
+            if terminal or tidsavbrudd or feil:
+                if dfmetrikk.harLyttere( klient ):
+                    dfmetrikk.send( { 'type'                : 'validering',
+                                      'tidspunkt'           : round( time.time(), 3 ),
+                                      'featureCollectionId' : fcId,
+                                      'endepunkt'           : dfmetrikk.endepunkt( url ),
+                                      'validationStatus'    : gjeldende,
+                                      'sekunder'            : round( time.monotonic() - t0, 1 ),
+                                      'tidsavbrudd'         : tidsavbrudd and not terminal,
+                                      'feil'                : feil }, klient=klient )
+                return
+            await asyncio.sleep( intervall )
+
+    async def folgOgMeld( fcId, url ):
+        try:
+            await folgEn( fcId, url )
+        finally:
+            await ko.put( ferdig )
+
+    oppgaver = [ asyncio.create_task( folgOgMeld( *_statusUrl( fc, kontrakt=kontrakt, api=api ))) for fc in featureCollections ]
+    aktive = len( oppgaver )
+    try:
+        while aktive > 0:
+            endring = await ko.get()
+            if endring is ferdig:
+                aktive -= 1
+                continue
+            await _kallCallback( callback, endring )
+            yield endring
+    finally:
+        for oppgave in oppgaver:
+            oppgave.cancel()
+
+
+def ventPaaStatus( featureCollections, utskrift=True, **kwargs ):
+    """
+    Synkron variant av overvakStatus: Venter til alle featureCollections har endelig status (eller frist er nådd)
+
+    ARGUMENTS
+        featureCollections : se overvakStatus
+
+    KEYWORDS
+        utskrift : bool, default True. Skriver hver statusendring til konsoll
+
+        Ellers samme som overvakStatus
+
+    RETURNS
+        dictionary featureCollectionId => siste statusrespons
+    """
+    async def samle():
+        sisteStatus = { }
+        async for endring in overvakStatus( featureCollections, **kwargs ):
+            if utskrift:
+                print( f"{endring['sekunder']:>7} s {endring['featureCollectionId']} {endring['forrigeStatus']} -> {endring['validationStatus']}{' (tidsavbrudd)' if endring['tidsavbrudd'] else ''}{' (feil: ' + endring['feil'] + ')' if endring['feil'] else ''}" )
+            if endring['status']:
+                sisteStatus[endring['featureCollectionId']] = endring['status']
+        return sisteStatus
+
+    return asyncio.run( samle() )
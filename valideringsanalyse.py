@@ -0,0 +1,278 @@
+"""
+Lokal database (SQLite) med validationIssues fra DF1.0 /status, for statistikk på tvers av kontrakter
+
+I stedet for å lete i JSON-dumper med grep samler vi statusresponsene én gang i en SQLite-fil med én rad per
+valideringsmelding (kontrakt, featureCollection, severity, code, featureTypeId, attributeTypeId ...).
+Tekstkolonnene med få ulike verdier (severity, code) lagres som heltall mot egne oppslagstabeller, slik at
+fila blir liten, og det er indekser på de kolonnene vi grupperer på. Spørringer som "mest vanlige feilkoder per
+vegobjekttype over 10 000 featureCollections" tar da millisekunder, uten å hente eller parse noe på nytt.
+
+Samme featureCollection kan leses inn flere ganger, den nyeste statusen erstatter den forrige.
+Meldinger fra forhandsvalidering.valider har samme form og kan også legges inn.
+
+Eksempel
+    db = valideringsanalyse.Analysebase( 'validering.sqlite' )
+    db.samleFraKontrakt( kontrakt, user='jajens', pw=pw, maksParallelle=8 )
+    db.toppKoder( per='featureTypeId', severity='ERROR', antall=5 )
+    db.sql( 'select code, count(*) from issues group by code' )
+"""
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+import os
+import sqlite3
+import threading
+
+import df10
+import dfjson
+
+_SKJEMA = """
+create table if not exists severity ( id integer primary key, navn text unique not null );
+create table if not exists code ( id integer primary key, navn text unique not null );
+create table if not exists featurecollection (
+    id text primary key,
+    contractId text,
+    validationStatus text,
+    antallIssues integer,
+    hentet text );
+create table if not exists issue (
+    featureCollectionId text not null,
+    contractId text,
+    severityId integer not null,
+    codeId integer not null,
+    featureTypeId integer,
+    attributeTypeId integer,
+    lineNo integer,
+    featureId text,
+    message text );
+create index if not exists issue_fc on issue( featureCollectionId );
+create index if not exists issue_kode on issue( codeId, severityId );
+create index if not exists issue_type on issue( featureTypeId, codeId );
+create index if not exists issue_kontrakt on issue( contractId, codeId );
+create view if not exists issues as
+    select i.featureCollectionId, i.contractId, s.navn as severity, c.navn as code, i.featureTypeId,
+           i.attributeTypeId, i.lineNo, i.featureId, i.message, f.validationStatus
+    from issue i join severity s on s.id = i.severityId join code c on c.id = i.codeId
+    left join featurecollection f on f.id = i.featureCollectionId;
+"""
+
+_GRUPPERING = ( 'featureTypeId', 'attributeTypeId', 'contractId', 'featureCollectionId', 'validationStatus', 'severity' )
+
+
+class Analysebase:
+    """
+    SQLite-database med valideringsmeldinger
+
+    ARGUMENTS
+        filnavn : str, default 'valideringsanalyse.sqlite'. ':memory:' gir database kun i minnet
+
+    KEYWORDS
+        lagreMelding : bool, default True. Lagrer selve meldingsteksten. Uten tekst blir fila mye mindre
+    """
+
+    def __init__( self, filnavn='valideringsanalyse.sqlite', lagreMelding=True ):
+        self.filnavn = filnavn
+        self.lagreMelding = lagreMelding
+        self.db = sqlite3.connect( filnavn, check_same_thread=False )
+        self.db.executescript( _SKJEMA )
+        self._las = threading.Lock()
+        self._oppslag = { 'severity' : { }, 'code' : { } }
+        # Nye id'er i transaksjonen som pågår. Flyttes til _oppslag først etter commit, og forkastes ved rollback
+        self._nye = { 'severity' : { }, 'code' : { } }
+        for tabell, oppslag in self._oppslag.items():
+            oppslag.update( { navn : nr for nr, navn in self.db.execute( f"select id, navn from {tabell}" ) } )
+
+    def _id( self, tabell:str, navn:str ):
+        nr = self._oppslag[tabell].get( navn )
+        if nr is None:
+            nye = self._nye[tabell]
+            if navn not in nye:
+                self.db.execute( f"insert or ignore into {tabell} ( navn ) values ( ? )", ( navn, ))
+                nye[navn] = self.db.execute( f"select id from {tabell} where navn = ?", ( navn, )).fetchone()[0]
+            nr = nye[navn]
+        return nr
+
+    def _leggInn( self, status:dict, contractId, featureCollectionId, hentet ):
+        issues = status.get( 'validationIssues' ) or []
+        fcId = featureCollectionId or status.get( 'featureCollectionId' ) or status.get( 'id' )
+        if fcId is None:
+            fcId = next( ( x['location']['featureCollectionId'] for x in issues if 'featureCollectionId' in ( x.get( 'location' ) or { } )), None )
+        if fcId is None:
+            raise ValueError( "Finner ikke featureCollectionId i statusresponsen, oppgi featureCollectionId=" )
+        if contractId is None:
+            contractId = next( ( x['location']['contractId'] for x in issues if 'contractId' in ( x.get( 'location' ) or { } )), None )
+
+        rader = []
+        for issue in issues:
+            location = issue.get( 'location' ) or { }
+            rader.append( ( fcId, location.get( 'contractId', contractId ),
+                            self._id( 'severity', issue.get( 'severity', '' )), self._id( 'code', issue.get( 'code', '' )),
+                            location.get( 'featureTypeId' ), location.get( 'attributeTypeId' ), location.get( 'lineNo' ),
+                            location.get( 'featureId' ), issue.get( 'message' ) if self.lagreMelding else None ))
+
+        self.db.execute( "delete from issue where featureCollectionId = ?", ( fcId, ))
+        self.db.executemany( "insert into issue values ( ?, ?, ?, ?, ?, ?, ?, ?, ? )", rader )
+        self.db.execute( "insert or replace into featurecollection values ( ?, ?, ?, ?, ? )",
+                         ( fcId, contractId, status.get( 'validationStatus' ), len( rader ), hentet ))
+        return len( rader )
+
+    def leggTil( self, status, contractId=None, featureCollectionId=None ):
+        """
+        Legger inn én statusrespons (dict med validationIssues), eller en liste med statusresponser, i én transaksjon
+
+        KEYWORDS
+            contractId, featureCollectionId : str. Trengs bare hvis de ikke finnes i responsen eller i meldingene
+
+        RETURNS
+            antall valideringsmeldinger som ble lagt inn
+        """
+        statuser = [ status ] if isinstance( status, dict ) else list( status )
+        hentet = str( datetime.now() )[0:19]
+        with self._las:
+            try:
+                with self.db:
+                    antall = sum( self._leggInn( x, contractId, featureCollectionId, hentet ) for x in statuser )
+            except BaseException:
+                for nye in self._nye.values():
+                    nye.clear()
+                raise
+            for tabell, nye in self._nye.items():
+                self._oppslag[tabell].update( nye )
+                nye.clear()
+            return antall
+
+    def leggTilMeldinger( self, meldinger:list, featureCollectionId:str, contractId=None, validationStatus=None ):
+        """
+        Legger inn liste med valideringsmeldinger, f.eks fra forhandsvalidering.valider
+        """
+        return self.leggTil( { 'validationStatus' : validationStatus, 'validationIssues' : meldinger },
+                             contractId=contractId, featureCollectionId=featureCollectionId )
+
+    def lesFiler( self, filnavn ):
+        """
+        Leser inn JSON-filer med statusresponser (én dict eller liste med dicts per fil). filnavn kan være en mappe
+
+        RETURNS
+            antall valideringsmeldinger som ble lagt inn
+        """
+        if isinstance( filnavn, str ) and os.path.isdir( filnavn ):
+            filnavn = sorted( os.path.join( filnavn, x ) for x in os.listdir( filnavn ) if x.lower().endswith( '.json' ))
+        elif isinstance( filnavn, str ):
+            filnavn = [ filnavn ]
+
+        antall = 0
+        for etFilnavn in filnavn:
+            data = dfjson.lesFil( etFilnavn )
+            statuser = [ data ] if isinstance( data, dict ) else data
+            antall += self.leggTil( [ x for x in statuser if isinstance( x, dict ) and 'validationIssues' in x ] )
+        return antall
+
+    def samleFraKontrakt( self, contractId:str, api='https://datafangst.vegvesen.no/api/v1/contract/', user='jajens', pw=None,
+                            klient=None, maksParallelle=4 ):
+        """
+        Henter /status for alle featureCollections på kontrakten og legger dem inn i databasen
+
+        KEYWORDS
+            maksParallelle : int, default 4. Antall statuskall samtidig
+
+            api, user, pw, klient : som for df10.alleFeaturecollections
+
+        RETURNS
+            antall valideringsmeldinger som ble lagt inn
+        """
+        if not ( klient and klient.harInnlogging() ) and not isinstance( pw, str ):
+            pw = df10.hentPassord( user, api )
+
+        data = df10.alleFeaturecollections( contractId, api=api, user=user, pw=pw, klient=klient )
+        fcIder = [ x['id'] for x in data['featureCollections'] ]
+        print( f"Henter status for {len(fcIder)} feature collections på kontrakt {contractId}" )
+
+        antall = 0
+        with ThreadPoolExecutor( max_workers=max( 1, maksParallelle )) as pool:
+            jobber = { pool.submit( df10.sjekkFeatureCollectionStatus, contractId, fcId, utskrift=False, user=user, pw=pw, api=api, klient=klient ) : fcId
+                        for fcId in fcIder }
+            for jobb in as_completed( jobber ):
+                try:
+                    status = jobb.result()
+                except Exception as e:
+                    print( f"\t-> Statuskall feilet for feature collection {jobber[jobb]}: {e}" )
+                    continue
+                antall += self.leggTil( status, contractId=contractId, featureCollectionId=jobber[jobb] )
+
+        print( f"{antall} valideringsmeldinger fra kontrakt {contractId} lagt inn i {self.filnavn}" )
+        return antall
+
+    def sql( self, sporring:str, parametre=() ):
+        """
+        Kjører vilkårlig SQL-spørring. Viewet 'issues' har alle kolonnene med severity og code som tekst
+
+        RETURNS
+            liste med dict per rad
+        """
+        with self._las:
+            markor = self.db.execute( sporring, parametre )
+            kolonner = [ x[0] for x in markor.description ] if markor.description else []
+            return [ dict( zip( kolonner, rad )) for rad in markor.fetchall() ]
+
+    def _filter( self, severity=None, contractId=None, featureTypeId=None, code=None ):
+        betingelser = []
+        parametre = []
+        for kolonne, verdi in ( ( 'severity', severity ), ( 'contractId', contractId ), ( 'featureTypeId', featureTypeId ), ( 'code', code )):
+            if verdi is None:
+                continue
+            verdier = [ verdi ] if isinstance( verdi, ( str, int )) else list( verdi )
+            betingelser.append( f"{kolonne} in ( {','.join( '?' * len( verdier ))} )" )
+            parametre.extend( verdier )
+        return ( ' where ' + ' and '.join( betingelser ) if betingelser else '' ), parametre
+
+    def tellKoder( self, severity=None, contractId=None, featureTypeId=None, code=None ):
+        """
+        Antall meldinger og antall featureCollections per severity og code, mest vanlige først.
+        Filtrene kan være én verdi eller liste med verdier
+        """
+        hvor, parametre = self._filter( severity=severity, contractId=contractId, featureTypeId=featureTypeId, code=code )
+        return self.sql( f"""select severity, code, count(*) as antall, count( distinct featureCollectionId ) as featureCollections
+                             from issues {hvor} group by severity, code order by antall desc""", parametre )
+
+    def toppKoder( self, per='featureTypeId', antall=10, severity=None, contractId=None, featureTypeId=None, code=None ):
+        """
+        De mest vanlige kodene for hver verdi av 'per'
+
+        KEYWORDS
+            per : str, default 'featureTypeId'. En av featureTypeId, attributeTypeId, contractId, featureCollectionId, validationStatus, severity
+
+            antall : int, default 10. Antall koder per gruppe
+
+            severity, contractId, featureTypeId, code : filtre, se tellKoder
+
+        RETURNS
+            liste med dict ( per, code, severity, antall, rangering ), sortert på per og rangering
+        """
+        if per not in _GRUPPERING:
+            raise ValueError( f"Kan ikke gruppere på {per}, må være en av {_GRUPPERING}")
+        hvor, parametre = self._filter( severity=severity, contractId=contractId, featureTypeId=featureTypeId, code=code )
+        return self.sql( f"""select * from (
+                                select {per}, code, severity, count(*) as antall,
+                                    row_number() over ( partition by {per} order by count(*) desc, code ) as rangering
+                                from issues {hvor} group by {per}, code, severity )
+                             where rangering <= ? order by {per}, rangering""", parametre + [ antall ] )
+
+    def oppsummer( self, utskrift=True, **filtre ):
+        """
+        Skriver ut antall meldinger per severity og code, se tellKoder
+        """
+        telling = self.tellKoder( **filtre )
+        if utskrift:
+            antallFc = self.sql( "select count(*) as n from featurecollection" )[0]['n']
+            print( f"{sum( x['antall'] for x in telling )} valideringsmeldinger fra {antallFc} feature collections i {self.filnavn}" )
+            for rad in telling:
+                print( f"\t{rad['severity']:<9} {rad['code']:<35} {rad['antall']:>8} ({rad['featureCollections']} feature collections)" )
+        return telling
+
+    def lukk( self ):
+        self.db.close()
+
+    def __enter__( self ):
+        return self
+
+    def __exit__( self, *args ):
+        self.lukk()